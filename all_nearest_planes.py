@@ -3,96 +3,403 @@
 
 # gets the dump1090 JSON, assumes its on localhost
 from __future__ import print_function
-import requests
 import time
 import re
-import geojson
 from sys import stderr
-from shapely.geometry import Point, shape
-from os import path
-from subprocess import check_output, CalledProcessError
 import sys
 import os.path
-
-import sqlite3 as lite
+import numpy as np
+
+from cache import LRUCache, MISSING
+from flightdb import database_for
+from flightstore import FlightStore
+import metrics
+from dump1090 import Dump1090Client
+from sbs1 import SBS1Feed
+from beast import BeastFeed
+from geofence import geofence_for
+from expiry import ExpiryQueue
+from filters import compile_filter, legacy_altitude
+from enrichment import EnrichmentPool, PRIORITY_VISIBLE, PRIORITY_DEFAULT
+from phases import PhaseEngine, PHASE_NAMES, APPROACH_AREAS, SAMPLED_FIELDS
+from merge import merge_flights, FlightDelta, EMPTY_DELTA, POSITION_FIELDS
+from receivers import Receiver, ReceiverGroup
+from recording import Recorder, ReplaySource
+from routes import route_index_for
+from spatial import parse_location
+from trails import TrailHistory
 gSQLDBStandingDBLocn = os.path.join(os.path.dirname(__file__),'db','StandingData.sqb')
 gSQLDBBaseStnDBLocn = os.path.join(os.path.dirname(__file__),'db','BaseStation.sqb')
-
-def createDefaultsArgs():
+gFlightNumbersLocn = os.path.join(os.path.dirname(os.path.realpath(__file__)), "FlightNumbers.csv")
+
+merge_seconds = metrics.stage('merge')
+geofence_seconds = metrics.stage('geofence')
+phases_seconds = metrics.stage('phases')
+expiry_seconds = metrics.stage('expiry')
+enrichment_seconds = metrics.stage('enrichment_merge')
+filter_seconds = metrics.stage('filter')
+
+# the app's area for each zone name in the area geojson, zones not listed
+# here are reported under their own name
+AREA_NAMES = {
+  'north_flow_landing': 'north_flow',
+  'south_flow_landing': 'south_flow',
+  'flyby_area': 'flyby',
+}
+
+# what an aircraft needs before it is published, the views draw it with these
+PUBLISHED_FIELDS = ('lat', 'lon', 'track')
+
+def createDefaultsParser():
   import argparse
   parser = argparse.ArgumentParser(description='Usage: dump1090_to_nearest_flight.py [options]')
   parser.add_argument('-H', '--host',
-                      help="The location of the dump1090 server's HTTP interface",
+                      help="The location of the dump1090 server's HTTP interface, or several receivers separated by commas",
                       required=False,
                       default='faster-ads.local:8080')
+  parser.add_argument('-s', '--source',
+                      help="How to read dump1090: 'http' polls data.json, 'sbs' streams the SBS-1 feed, 'beast' decodes the Beast binary feed, 'replay' plays back a --record log given with --replay",
+                      required=False,
+                      choices=['http', 'sbs', 'beast', 'replay'],
+                      default='http')
+  parser.add_argument('--feed-port',
+                      help="The port of dump1090's SBS-1 or Beast output, defaults to 30003 for sbs and 30005 for beast",
+                      required=False,
+                      type=int,
+                      default=None)
+  parser.add_argument('--record',
+                      help="Append every update from the receivers to this gzip log, for replaying later",
+                      required=False,
+                      default=None)
+  parser.add_argument('--replay',
+                      help="The log to play back with --source replay",
+                      required=False,
+                      default=None)
+  parser.add_argument('--replay-speed',
+                      help="How much faster than real time to replay, 0 replays as fast as possible",
+                      required=False,
+                      type=float,
+                      default=1.0)
+  parser.add_argument('--expire',
+                      help="Seconds without hearing from an aircraft before it is dropped",
+                      required=False,
+                      type=float,
+                      default=60.0)
   parser.add_argument("-a", '--altitude',
-                      help="a location constraint for aircraft, e.g. '<10000' or '>30000'. In feet. ",
+                      help="a location constraint for aircraft, e.g. '<10000' or '>30000'. In feet. Same as --filter 'altitude < 10000'",
+                      required=False,
+                      default=None)
+  parser.add_argument("-f", '--filter',
+                      help="only show aircraft matching this, e.g. \"altitude < 10000 and (area = flyby or distance < 5)\". Fields are altitude, speed, vert_rate, track, distance (nm from --location), area, status, operator, route and callsign",
                       required=False,
                       default=None)
   parser.add_argument("-g", '--area',
                       help="path to geojson of a geographic constraint for aircraft",
                       required=False,
                       default=os.path.join(os.path.dirname(__file__),"flyby.geojson"))
+  parser.add_argument('--metrics-port',
+                      help="Serve the pipeline metrics for Prometheus on this local port",
+                      required=False,
+                      type=int,
+                      default=None)
+  parser.add_argument('--metrics-overlay',
+                      help="Draw the frame and pipeline timings over the views",
+                      required=False,
+                      action='store_true')
   parser.add_argument("-l", '--location',
                       help="Your location, in \"lat,long\" format. E.g. \"40.612345,-73.912345\" ",
                       required=False,
-                      default="37.3628,121.9292")  
+                      default="37.3628,-121.9292")
   # parser.add_argument('-h', '--help',
   #                     help="Display this screen", )
-  return parser.parse_args()
-
-class Flyover:
+  return parser
+
+def createDefaultsArgs(args=None, parser=None):
+  if parser is None:
+    parser = createDefaultsParser()
+  options = parser.parse_args(args)
+  try:
+    filter_for(options)
+  except ValueError, e:
+    parser.error(str(e))
+  return options
+
+def filter_text(options):
+  """--filter and the older --altitude together, as one expression."""
+  clauses = [text for text in (getattr(options, 'filter', None),) if text and text.strip()]
+  if getattr(options, 'altitude', None):
+    clauses.append(legacy_altitude(options.altitude))
+  if len(clauses) > 1:
+    return ' and '.join('(%s)' % clause for clause in clauses)
+  return clauses[0] if clauses else None
+
+def filter_for(options, text=None):
+  """The compiled filter for options, or for text with their --location."""
+  if text is None:
+    text = filter_text(options)
+  return compile_filter(text, parse_location(getattr(options, 'location', None)))
+
+class Flyover(object):
   flight_num_re = re.compile("^[A-Z]{2,3}\d+$", re.IGNORECASE)
   flight_num_re_2 = re.compile("^\d+$", re.IGNORECASE) #southwest airlines
-  flights_dict = {}
+  flight_code_re = re.compile("^(\D+)(\d+)")
+  #aircraft are enriched on worker threads, the poll only spends
+  #enrichment_budget seconds a tick merging the results back in
+  enrichment_budget = 0.02
+
+  def __init__(self):
+    self.flights_dict = FlightStore()
+    self.last_delta = EMPTY_DELTA
+    self.expiry = None
+    self.receivers = {}
+    self.recorder = None
+    #what the aircraft are timed by, the recording's time when replaying
+    self.clock = time.time
+    self.trails = TrailHistory()
+    self.phases = PhaseEngine()
+    #enrichment results, including the misses, so aircraft that come back
+    #and callsigns without a route are not looked up again
+    self.route_cache = LRUCache()
+    self.planetype_cache = LRUCache()
+    self.flightplan_cache = LRUCache()
+    self.enrichment = None
+    self.enrichment_backlog = set()
+    self.visible = frozenset()
+    #the aircraft the filter lets through, the snapshots only carry those
+    self.filter = None
+    self.filter_options = None
+    self.shown = set()
+
+  def set_filter(self, text, options=None):
+    """Only show aircraft matching text from the next poll on, None shows
+    them all. Raises FilterError when text can't be read.
+    """
+    self.filter = filter_for(options or self.filter_options or createDefaultsArgs([]), text or '')
+
+  def now(self):
+    return self.clock()
+
+  def close(self, timeout=5.0):
+    """Stop the receivers and finish the recording, if there is one."""
+    for group in self.receivers.itervalues():
+      group.stop(timeout)
+    self.receivers = {}
+    if self.recorder is not None:
+      self.recorder.close()
+      self.recorder = None
+
+  def expiry_queue(self, options):
+    timeout = getattr(options, 'expire', 60.0)
+    if self.expiry is None:
+      self.expiry = ExpiryQueue(timeout, self.now)
+    self.expiry.timeout = timeout
+    return self.expiry
+
+  def expiry_stats(self):
+    return self.expiry.stats() if self.expiry is not None else {}
+
+  def enrichment_pool(self):
+    if self.enrichment is None:
+      self.enrichment = EnrichmentPool(self.enrich)
+    return self.enrichment
+
+  def set_visible(self, keys):
+    """The hex codes of the aircraft on screen, enriched before the rest."""
+    self.visible = frozenset(keys)
+
+  def enrich(self, jobs):
+    """Look up route, aircraft type and flight plan for (hex, callsign)
+    jobs. Returns the fields to add to each aircraft keyed by hex, and the
+    set of hex codes whose lookups failed, to be tried again. Those still
+    get whatever the lookups that worked found.
+    """
+    keys = [key for key, callsign in jobs]
+    failed = set()
+    #one query per database for the whole batch
+    try:
+      codes = self.get_planetypes_from_ICAOs(keys)
+    except Exception, e:
+      print("aircraft type lookup failed: %s" % e, file=stderr)
+      codes = {}
+      failed.update(keys)
+    try:
+      dbPlans = self.get_flight_plans_from_callsigns([callsign.strip().encode('utf-8') for key, callsign in jobs])
+    except Exception, e:
+      print("flight plan lookup failed: %s" % e, file=stderr)
+      dbPlans = {}
+      failed.update(keys)
+    enriched = {}
+    for key, callsign in jobs:
+      try:
+        enriched[key] = self.enrichment_for(key, callsign, codes, dbPlans)
+      except Exception, e:
+        print("enriching %s failed: %s" % (key, e), file=stderr)
+        failed.add(key)
+    return enriched, failed
+
+  def enrichment_for(self, key, callsign, codes, dbPlans):
+    info = {}
+    plan = self.get_flight_plan(callsign)
+    if plan:
+      info.update(plan = plan)
+
+    codes_row = codes.get(key)
+    if codes_row:
+      info.update(planeType = codes_row[0])
+      info.update(typeName = codes_row[1])
+      info.update(planeRegistration = codes_row[2])
+
+    dbPlan = dbPlans.get(callsign.strip().encode('utf-8'))
+    if dbPlan:
+      info.update(OperatorName = dbPlan[0])
+      info.update(FromAirportName = dbPlan[1].encode("utf-8"))
+      info.update(FromAirportLocation = dbPlan[2].encode("utf-8"))
+      info.update(FromAirportCountry = dbPlan[3].encode("utf-8"))
+      info.update(FromAirportLongitude = dbPlan[4])
+      info.update(FromAirportLatitude = dbPlan[5])
+      info.update(ToAirportName = dbPlan[6].encode("utf-8"))
+      info.update(ToAirportLocation = dbPlan[7].encode("utf-8"))
+      info.update(ToAirportCountry = dbPlan[8].encode("utf-8"))
+      info.update(ToAirportLongitude = dbPlan[9])
+      info.update(ToAirportLatitude = dbPlan[10])
+      info.update(FlightNumber = dbPlan[11])
+    return info
+
+  def client_for(self, source, host, feed_port=None, expire=60.0):
+    if source == 'sbs':
+      return SBS1Feed(host.split(':')[0], feed_port or 30003, expire_after=expire)
+    elif source == 'beast':
+      return BeastFeed(host.split(':')[0], feed_port or 30005, expire_after=expire)
+    else:
+      return Dump1090Client(host)
+
+  def receivers_for(self, options):
+    """The ReceiverGroup polling every --host, or a ReplaySource for
+    --source replay, started on first use.
+    """
+    source = getattr(options, 'source', 'http')
+    feed_port = getattr(options, 'feed_port', None)
+    key = (source, options.host, feed_port)
+    group = self.receivers.get(key)
+    if group is None and source == 'replay':
+      group = ReplaySource(options.replay, getattr(options, 'replay_speed', 1.0))
+      self.receivers[key] = group
+      self.clock = group.now
+    elif group is None:
+      hosts = [host.strip() for host in options.host.split(',') if host.strip()]
+      expire = getattr(options, 'expire', 60.0)
+      group = ReceiverGroup([Receiver(self.client_for(source, host, feed_port, expire), host, forget_after=expire) for host in hosts])
+      group.start()
+      self.receivers[key] = group
+    return group
+
+  def receiver_health(self):
+    return [health for group in self.receivers.itervalues() for health in group.health()]
+
+  def poll_delay(self, options):
+    if options is '':
+      options = createDefaultsArgs()
+    return self.receivers_for(options).next_delay()
+
+  def collect_metrics(self):
+    """The aircraft, cache, expiry, enrichment and receiver stats as
+    metrics, for metrics.Registry.collector.
+    """
+    found = [
+      ('flyby_aircraft', 'gauge', 'Aircraft being tracked', {}, len(self.flights_dict)),
+      ('flyby_aircraft_shown', 'gauge', 'Aircraft the filter lets through', {}, len(self.shown)),
+    ]
+    for cache, stats in self.cache_stats().iteritems():
+      for result in ('hits', 'negative_hits', 'misses'):
+        found.append(('flyby_enrichment_cache_lookups_total', 'counter', 'Enrichment cache lookups by result',
+          {'cache': cache, 'result': result}, stats[result]))
+      found.append(('flyby_enrichment_cache_hit_rate', 'gauge', 'Share of enrichment cache lookups answered from the cache',
+        {'cache': cache}, stats['hit_rate']))
+    for name, value in self.expiry_stats().iteritems():
+      found.append(('flyby_expiry_' + name, 'gauge', 'Expiry queue ' + name, {}, value))
+    if self.enrichment is not None:
+      for name in ('submitted', 'completed', 'retried', 'failed', 'dropped'):
+        found.append(('flyby_enrichment_jobs_total', 'counter', 'Enrichment jobs by outcome',
+          {'outcome': name}, getattr(self.enrichment, name)))
+      found.append(('flyby_enrichment_pending', 'gauge', 'Enrichment jobs waiting', {}, len(self.enrichment.pending)))
+    for health in self.receiver_health():
+      labels = {'host': health['host']}
+      found.append(('flyby_receiver_up', 'gauge', 'Whether the receiver is answering', labels, int(health['state'] in ('ok', 'finished'))))
+      found.append(('flyby_receiver_aircraft', 'gauge', 'Aircraft the receiver reports', labels, health['aircraft']))
+      for name in ('polls', 'errors', 'played'):
+        if name in health:
+          found.append(('flyby_receiver_%s_total' % name, 'counter', 'Receiver ' + name, labels, health[name]))
+    return found
+
+  def get_flight_plans_from_callsigns(self, pFlightCodes):
+    """RouteView rows for many callsigns in one query, keyed by callsign."""
+    plans, missing = self.flightplan_cache.get_many(set(pFlightCodes))
+    if not missing:
+      return plans
+    found = {}
+    select = ("SELECT Callsign, OperatorName, FromAirportName, FromAirportLocation, FromAirportCountry, FromAirportLongitude, FromAirportLatitude, " +
+      " ToAirportName, ToAirportLocation, ToAirportCountry, ToAirportLongitude, ToAirportLatitude, FlightNumber FROM RouteView")
+    for row in database_for(gSQLDBStandingDBLocn).select_in(select, "Callsign", missing):
+      found.setdefault(row[0], row[1:])
+    for pFlightCode in missing:
+      plans[pFlightCode] = found.get(pFlightCode)
+      self.flightplan_cache.put(pFlightCode, plans[pFlightCode])
+    return plans
 
-  @classmethod
   def get_flight_plan_from_callsign(self, pFlightCode):
-    con = lite.connect(gSQLDBStandingDBLocn)
-    with con:    
-        cur = con.cursor()
-        cur.execute("SELECT OperatorName, FromAirportName, FromAirportLocation, FromAirportCountry, FromAirportLongitude, FromAirportLatitude, " +
-         " ToAirportName, ToAirportLocation, ToAirportCountry, ToAirportLongitude, ToAirportLatitude, FlightNumber FROM RouteView WHERE Callsign = ? ", (pFlightCode,))
-        rows = cur.fetchall()
-        for row in rows:
-            return row
-
-  @classmethod
+    return self.get_flight_plans_from_callsigns([pFlightCode]).get(pFlightCode)
+
+  def get_planetypes_from_ICAOs(self, pICAOs):
+    """(ICAOTYPECODE, Type, REGISTRATION) for many hex codes in one query,
+    keyed by the hex codes as given.
+    """
+    codes, missing = self.planetype_cache.get_many(set(pICAOs))
+    if not missing:
+      return codes
+    wanted = dict((pICAO.upper(), pICAO) for pICAO in missing)
+    found = {}
+    select = "SELECT MODES, ICAOTYPECODE, Type, REGISTRATION FROM AIRCRAFT"
+    for row in database_for(gSQLDBBaseStnDBLocn).select_in(select, "MODES", wanted.keys()):
+      key = wanted.get(row[0].upper())
+      if key is not None and key not in found:
+        found[key] = (row[1], row[2], row[3])
+    for pICAO in missing:
+      codes[pICAO] = found.get(pICAO)
+      self.planetype_cache.put(pICAO, codes[pICAO])
+    return codes
+
   def get_planetype_from_ICOA(self, pICAO):
-    con = lite.connect(gSQLDBBaseStnDBLocn)
-    with con:    
-        cur = con.cursor()    
-        cur.execute("SELECT ICAOTYPECODE, Type, REGISTRATION FROM AIRCRAFT WHERE MODES = UPPER(?) ", (pICAO,))
-        rows = cur.fetchall()
-        for row in rows:
-          return (row[0], row[1], row[2])
+    return self.get_planetypes_from_ICAOs([pICAO]).get(pICAO)
 
+  def cache_stats(self):
+    return {
+      'route': self.route_cache.stats(),
+      'planetype': self.planetype_cache.stats(),
+      'flightplan': self.flightplan_cache.stats(),
+    }
 
-  @classmethod
   def get_flight_plan(self, code):
     try:
       if self.flight_num_re_2.match(code.strip()): #probably SWA
         code = "SWA" + code
         #print(code)
 
-      result = re.findall('\d*\D+',code)
+      route = self.route_cache.get(code.strip())
+      if route is not MISSING:
+        return route
+
+      result = self.flight_code_re.match(code.strip())
       if result:
-        airline = result[0]
-        number = result[1].strip()
-        try:
-          flight_rows = check_output(["grep", "%s,%s,"%(airline, number), os.path.join(os.path.dirname(os.path.realpath(__file__)), "FlightNumbers.csv") ]).decode("utf-8").strip().split("\r\n")
-          route = flight_rows[0].split(",")[-1]
-          return route
-        except CalledProcessError:
-          #print("ERROR: No Match for " + code, file=sys.stderr)
-          return None
+        airline, number = result.groups()
+        route = route_index_for(gFlightNumbersLocn).lookup(airline, number)
+        self.route_cache.put(code.strip(), route)
+        return route
       else:
         print("no match")
 
     except Exception, e:
       print(e)
 
-  @classmethod
   def landing_or_departing(self, route, airport_code):
     airports = route.split("-")
     if airport_code in airports:
@@ -103,107 +410,46 @@ class Flyover:
     else:
       return "Flyby"
 
-  @classmethod
+  def nearest(self, options, k=1):
+    """[(distance in nm, aircraft)] of the k aircraft nearest --location."""
+    location = parse_location(options.location)
+    if location is None:
+      return []
+    return self.flights_dict.nearest(location[0], location[1], k)
+
+  def overhead(self, options, radius):
+    """[(distance in nm, aircraft)] of the aircraft within radius nm of --location."""
+    location = parse_location(options.location)
+    if location is None:
+      return []
+    return self.flights_dict.within(location[0], location[1], radius)
+
   def get_all_planes(self, options):
     if options is '':
       options = createDefaultsArgs()
-    flights = requests.get("http://%s/dump1090/data.json" % options.host).json()
+    flights = self.receivers_for(options).flights
     flights = [f for f in flights if "flight" in f and self.flight_num_re.match(f["flight"].strip()) and f["seen"] < 60]
     return flights
 
   #this is the one used by flygame
-  @classmethod
   def get_nearest_airplane(self, options):
     if options is '':
       options = createDefaultsArgs()
 
-    if options.location:
-      lat, lon = options.location.split(",")
-      location = {"lon": float(lon),"lat": float(lat)}
- 
-    flights = requests.get("http://%s/dump1090/data.json" % options.host).json()
-
-    #convert to a dict
-    flights_dict = dict((flight.get('flight').strip().encode('utf-8'),flight) for flight in flights if "flight" in flight and 
-      (self.flight_num_re.match(flight["flight"].strip()) or
-      self.flight_num_re_2.match(flight["flight"].strip())) 
-      #and flight["seen"] > 60
-      #and flight["speed"] > 100
-      )
-
-    def distance(f):
-      return ((f.get("lat", 0) - location["lat"]) ** 2 + (f.get("lon", 0) - location["lon"]) ** 2) ** 0.5
-
-    #north flow landing
-    def within_north_landing_area(f, area_geojson_location):
-      if not area_geojson_location:
-        return True
-      try:
-        with open(path.expanduser(area_geojson_location), 'r') as geo:
-          flight_loc = Point(f.get("lon", 0), f.get("lat", 0))
-          return shape(geojson.loads(geo.read())["features"][0]["geometry"]).contains(flight_loc)
-      except IOError:
-        print("couldn't find geojson file at %s, ignoring" % area_geojson_location, file=stderr)
-        return True
-
-    #south flow landing
-    def within_south_landing_area(f, area_geojson_location):
-      if not area_geojson_location:
-        return True
-      try:
-        with open(path.expanduser(area_geojson_location), 'r') as geo:
-          flight_loc = Point(f.get("lon", 0), f.get("lat", 0))
-          return shape(geojson.loads(geo.read())["features"][1]["geometry"]).contains(flight_loc)
-      except IOError:
-        print("couldn't find geojson file at %s, ignoring" % area_geojson_location, file=stderr)
-        return True
-
-    #south flow landing
-    def within_flyby_area(f, area_geojson_location):
-      if not area_geojson_location:
-        return True
-      try:
-        with open(path.expanduser(area_geojson_location), 'r') as geo:
-          flight_loc = Point(f.get("lon", 0), f.get("lat", 0))
-          #return shape(bounds).contains(flight_loc)
-          return shape(geojson.loads(geo.read())["features"][2]["geometry"]).contains(flight_loc)
-      except IOError:
-        print("couldn't find geojson file at %s, ignoring" % area_geojson_location, file=stderr)
-        return True
-
-    def landingOrTakeOff(flight):
-      if flight.get('altitude') < 10000 and flight.get('altitude') > 0 and flight.get('speed') > 100:
-        if flight.get('vert_rate') > 1000: #ascending
-          if flight.get('area') == 'south_flow':
-            flight.update(status = 'taking off')
-          elif flight.get('area') == 'north_flow':
-            flight.update(status = 'taking off')
-          else:
-            flight.update(status = 'ascending')
-        elif flight.get('vert_rate') < -1000: #descending
-          if flight.get('area') == 'south_flow':
-            flight.update(status = 'landing')
-          elif flight.get('area') == 'north_flow':
-            flight.update(status = 'landing')
-          else:
-            flight.update(status = 'descending')
-        else:
-          flight.update(status = 'low cruise')
-      else:
-        flight.update(status = 'cruising')
-
-    def altitude(flight, altitude_string):
-      if not altitude_string:
-        return True 
-      altitude_string = altitude_string.strip()
-      if 'altitude' not in flight:
-        return False 
-      if altitude_string[0] == ">":
-        return flight['altitude'] > int(altitude_string[1:])
-      elif altitude_string[0] == "<":
-        return flight['altitude'] < int(altitude_string[1:])
-      else: # assume less than
-        return flight['altitude'] < int(altitude_string)
+    if options is not self.filter_options:
+      self.filter_options = options
+      self.filter = filter_for(options)
+
+    flights = self.receivers_for(options).fetch()
+    now = self.now()
+    if flights is not None and getattr(options, 'record', None):
+      if self.recorder is None:
+        self.recorder = Recorder(options.record, clock=self.now)
+      self.recorder.write(flights, now)
+    pool = self.enrichment_pool()
+    expiry = self.expiry_queue(options)
+
+    fence = geofence_for(options.area)
 
     def printFlights(flights, description):
       print(description)
@@ -211,68 +457,146 @@ class Flyover:
         print(flight.get('flight'))
       print()
 
-    def addFlightInfo(flight):
-      plan = Flyover.get_flight_plan( flight.get('flight') )
-      if plan:
-        flight.update(plan = plan)
-
-      codes = Flyover.get_planetype_from_ICOA(flight.get('hex'))
-      if codes:
-        flight.update(planeType = codes[0])
-        flight.update(typeName = codes[1])
-        flight.update(planeRegistration = codes[2])
-
-      dbPlan = Flyover.get_flight_plan_from_callsign(flight.get('flight').strip().encode('utf-8'))
-      if dbPlan:
-        flight.update(OperatorName = dbPlan[0])
-        flight.update(FromAirportName = dbPlan[1].encode("utf-8"))
-        flight.update(FromAirportLocation = dbPlan[2].encode("utf-8"))
-        flight.update(FromAirportCountry = dbPlan[3].encode("utf-8"))
-        flight.update(FromAirportLongitude = dbPlan[4])
-        flight.update(FromAirportLatitude = dbPlan[5])
-        flight.update(ToAirportName = dbPlan[6].encode("utf-8"))
-        flight.update(ToAirportLocation = dbPlan[7].encode("utf-8"))
-        flight.update(ToAirportCountry = dbPlan[8].encode("utf-8"))
-        flight.update(ToAirportLongitude = dbPlan[9])
-        flight.update(ToAirportLatitude = dbPlan[10])
-        flight.update(FlightNumber = dbPlan[11])
-
-      #then get the area
-      if within_north_landing_area(flight, options.area):
-        flight.update(area = 'north_flow')
-      #is the flight in north flow?
-      elif within_south_landing_area(flight, options.area):
-        flight.update(area = 'south_flow')
-      #is the flight in the flyby area?
-      elif within_flyby_area(flight, options.area):
-        flight.update(area = 'flyby')
+    def setAreas(keys):
+      #classify all the aircraft in one call, returns the keys whose area changed
+      if not keys:
+        return []
+      if fence is None:
+        names = ['hidden'] * len(keys)
       else:
-        flight.update(area = 'hidden')
-      landingOrTakeOff(flight)
-
-      return flight
+        slots = self.flights_dict.slots_for(keys)
+        lon = np.nan_to_num(self.flights_dict.column('lon')[slots])
+        lat = np.nan_to_num(self.flights_dict.column('lat')[slots])
+        names = fence.classify(lon, lat)
+      changed = []
+      for key, name in zip(keys, names):
+        flight = self.flights_dict[key]
+        area = AREA_NAMES.get(name, name)
+        if flight.get('area') != area:
+          flight.update(area = area)
+          self.phases.approach[self.flights_dict.slots[key]] = area in APPROACH_AREAS
+          changed.append(key)
+      return changed
 
     def mergeNewData(flights_dict):
-      #merge the data
-      for key, value in flights_dict.iteritems():
-        if key not in self.flights_dict:
-          if value.get('seen') < 60:
-            print("adding " + value.get('flight'))
-            new_value = addFlightInfo(value)
-            self.flights_dict.update({key: new_value})
-        elif key in self.flights_dict:
-          #merge the new data into the old data
-          if value.get('seen') > 60: #delete old flights
-            print("deleting " + value.get('flight'))
-            del self.flights_dict[key]
-          else:
-            last_data = self.flights_dict.get(key)
-            for m_key, m_value in value.iteritems():
-              last_data.update({m_key : m_value})
-            self.flights_dict.update({key : last_data})
-
-
-    mergeNewData(flights_dict)
+      #merge the data, then only redo the work for what actually changed
+      with merge_seconds.time():
+        delta = merge_flights(self.flights_dict, flights_dict, expiry.timeout)
+      for key, flight in flights_dict.iteritems():
+        if key in self.flights_dict:
+          expiry.touch(key, now - flight.get('seen', 0))
+      for key in delta.added:
+        #published straight away with the raw position, the lookups follow
+        flight = self.flights_dict[key]
+        print("adding " + flight.get('flight'))
+        self.enrichment_backlog.add(key)
+      for key in delta.removed:
+        print("deleting " + key)
+        expiry.discard(key)
+        self.trails.discard(key)
+      self.phases.ensure(self.flights_dict.capacity)
+      if delta.added:
+        self.phases.reset(self.flights_dict.slots_for(delta.added))
+      moved = list(delta.added) + [key for key, changed in delta.updated.iteritems() if changed & POSITION_FIELDS]
+      if moved:
+        slots = self.flights_dict.slots_for(moved)
+        self.flights_dict.column('position_time')[slots] = now
+        self.flights_dict.reindex(moved)
+        lats = self.flights_dict.column('lat')[slots].tolist()
+        lons = self.flights_dict.column('lon')[slots].tolist()
+        for key, lat, lon in zip(moved, lats, lons):
+          if lat == lat and lon == lon: #NaN until it reports a position
+            self.trails.record(key, now, lat, lon)
+      with geofence_seconds.time():
+        changed_areas = setAreas(moved)
+      for key in changed_areas:
+        if key in delta.updated:
+          delta.updated[key].add('area')
+      sampled = list(delta.added) + [key for key, changed in delta.updated.iteritems() if changed & SAMPLED_FIELDS]
+      if sampled:
+        self.phases.sample(self.flights_dict, self.flights_dict.slots_for(sampled))
+      return delta
+
+    def updatePhases(delta):
+      #every aircraft every tick, in one pass, only changed statuses are written
+      store = self.flights_dict
+      self.phases.ensure(store.capacity)
+      for slot in self.phases.classify(store, store.occupied()).tolist():
+        flight = store.records[slot]
+        flight.update(status = PHASE_NAMES[self.phases.phase[slot]])
+        if flight.hex not in delta.added:
+          delta.updated.setdefault(flight.hex, set()).add('status')
+      return delta
+
+    def evictVanished(delta):
+      #aircraft that dropped out of the feed are never reported stale by it
+      for key in expiry.expired(now):
+        print("expiring " + key)
+        del self.flights_dict[key]
+        self.trails.discard(key)
+        delta.updated.pop(key, None)
+        delta.removed.append(key)
+      return delta
+
+    def applyFilter(delta):
+      #the delta as the snapshots see it, aircraft leaving the filter are removed
+      #and ones entering it added, whether or not they changed
+      store = self.flights_dict
+      if self.filter is None:
+        matching = set(store.iterkeys())
+      else:
+        slots = store.occupied()
+        matching = set(store.records[slot].hex for slot in slots[self.filter.mask(store, slots)].tolist())
+      entered = matching - self.shown
+      left = self.shown - matching
+      removed = set(delta.removed)
+      self.shown = matching
+      return FlightDelta(
+        sorted(entered),
+        dict((key, changed) for key, changed in delta.updated.iteritems() if key in matching and key not in entered),
+        delta.removed + [key for key in left if key not in removed])
+
+    def mergeEnrichment(delta):
+      #queue what is waiting, aircraft on screen first
+      for key in list(self.enrichment_backlog):
+        flight = self.flights_dict.get(key)
+        if flight is None or pool.submit(key, flight.get('flight'), PRIORITY_VISIBLE if key in self.visible else PRIORITY_DEFAULT):
+          self.enrichment_backlog.discard(key)
+      for key in self.visible:
+        flight = self.flights_dict.get(key)
+        if flight is not None and key in pool.pending: #visible keys can be a snapshot behind
+          pool.submit(key, flight.get('flight'), PRIORITY_VISIBLE)
+      #then merge whatever finished, within the time budget
+      for key, fields in pool.drain(self.enrichment_budget):
+        flight = self.flights_dict.get(key)
+        if flight is None or not fields: #gone already, or nothing was found
+          continue
+        flight.update(fields)
+        if key not in delta.added:
+          delta.updated.setdefault(key, set()).update(fields)
+      return delta
+
+    if flights is None: #nothing changed since the last poll
+      delta = FlightDelta([], {}, [])
+    else:
+      #convert to a dict keyed by ICAO hex, leaving out aircraft the streaming
+      #feeds have a callsign for but no position yet
+      flights_dict = dict((flight.get('hex'),flight) for flight in flights if "flight" in flight and 
+        (self.flight_num_re.match(flight["flight"].strip()) or
+        self.flight_num_re_2.match(flight["flight"].strip())) 
+        and all(flight.get(key) is not None for key in PUBLISHED_FIELDS)
+        #and flight["seen"] > 60
+        #and flight["speed"] > 100
+        )
+      delta = mergeNewData(flights_dict)
+    with expiry_seconds.time():
+      delta = evictVanished(delta)
+    with phases_seconds.time():
+      delta = updatePhases(delta)
+    with enrichment_seconds.time():
+      delta = mergeEnrichment(delta)
+    with filter_seconds.time():
+      self.last_delta = applyFilter(delta)
 
     try:
       return self.flights_dict
@@ -281,18 +605,27 @@ class Flyover:
 
 if __name__ == "__main__":
   args = createDefaultsArgs()
-  for i in range(0,10):
-    all_flights = Flyover.get_nearest_airplane(args)
-
-    #print(Flyover.get_nearest_airplane(args) or '')
+  flyover = Flyover()
+  if args.metrics_port:
+    metrics.REGISTRY.collector('flyover', flyover.collect_metrics)
+    metrics.serve(args.metrics_port)
+  try:
+    for i in range(0,10):
+      all_flights = flyover.get_nearest_airplane(args)
+
+      #print(Flyover.get_nearest_airplane(args) or '')
+
+      print(all_flights)
+      for distance, flight in flyover.nearest(args, 3):
+        print("{} {:.1f}nm".format(flight.get('flight'), distance))
+      for f, v in all_flights.iteritems():
+        pass
+        #print("{} {}".format(v.get('planeType'),v.get('planeRegistration') ))
 
-    print(all_flights)
-    for f, v in all_flights.iteritems():
-      pass
-      #print("{} {}".format(v.get('planeType'),v.get('planeRegistration') ))
-
-    print()
-    time.sleep (5.0);
+      print()
+      time.sleep (5.0);
+  finally:
+    flyover.close()
   # for flight in flights:
   #   print("{} {} {} {} {}".format(flight.get('flight'), flight.get('plan'), flight.get('area'), flight.get('status'), flight.get('vert_rate') ))
 
@@ -0,0 +1,332 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# decodes dump1090's Beast binary output (port 30005) without the JSON layer
+from __future__ import print_function
+import binascii
+import errno
+import math
+import socket
+import time
+
+import numpy as np
+
+from sbs1 import AircraftTable, TCPFeed
+
+ESC = b'\x1a'
+
+# payload length after the escape and type byte: 6 byte MLAT timestamp,
+# 1 byte signal level and the Mode A/C or Mode S message itself
+FRAME_LENGTHS = {
+  b'1': 6 + 1 + 2,  # Mode A/C
+  b'2': 6 + 1 + 7,  # Mode S short
+  b'3': 6 + 1 + 14, # Mode S long
+}
+MODES_LONG = b'3'
+
+IDENT_CHARSET = "#ABCDEFGHIJKLMNOPQRSTUVWXYZ##### ###############0123456789######"
+
+# CPR halves older than this are not paired up
+CPR_MAX_AGE = 10.0
+
+def _crc_table():
+  table = []
+  for i in range(256):
+    crc = i << 16
+    for _ in range(8):
+      if crc & 0x800000:
+        crc = ((crc << 1) ^ 0xFFF409) & 0xFFFFFF
+      else:
+        crc = (crc << 1) & 0xFFFFFF
+    table.append(crc)
+  return table
+
+CRC_TABLE = _crc_table()
+
+def crc_ok(payload):
+  """Check the 24 bit parity of a 14 byte Mode S message."""
+  crc = 0
+  for byte in bytearray(payload):
+    crc = ((crc << 8) & 0xFFFFFF) ^ CRC_TABLE[((crc >> 16) ^ byte) & 0xFF]
+  return crc == 0
+
+def _unescape(buf, start, length):
+  """Copy out a frame that contains escaped 0x1a bytes.
+
+  Returns (frame, stop). frame is None when the frame is not complete yet and
+  False when a bare escape shows it was cut short, in which case stop is
+  where the next frame starts.
+  """
+  out = bytearray()
+  end = len(buf)
+  i = start
+  while len(out) < length:
+    if i >= end:
+      return None, i
+    byte = buf[i:i + 1]
+    if byte == ESC:
+      if i + 1 >= end:
+        return None, i
+      if buf[i + 1:i + 2] != ESC:
+        return False, i
+      i += 2
+    else:
+      i += 1
+    out += byte
+  return memoryview(bytes(out)), i
+
+def split_frames(buf):
+  """Split a Beast byte string into (type, frame) pairs.
+
+  Frames are memoryview slices of buf unless they had to be unescaped. Also
+  returns how many bytes were consumed, the rest is an incomplete frame to
+  prepend to the next read.
+  """
+  frames = []
+  view = memoryview(buf)
+  end = len(buf)
+  pos = buf.find(ESC)
+  while pos != -1:
+    if pos + 1 >= end:
+      return frames, pos
+    kind = buf[pos + 1:pos + 2]
+    length = FRAME_LENGTHS.get(kind)
+    if length is None: #not a frame start, resync on the next escape
+      pos = buf.find(ESC, pos + 2 if kind == ESC else pos + 1)
+      continue
+    start = pos + 2
+    stop = start + length
+    if stop > end:
+      return frames, pos
+    if buf.find(ESC, start, stop) == -1:
+      frame = view[start:stop]
+    else:
+      frame, stop = _unescape(buf, start, length)
+      if frame is None:
+        return frames, pos
+    if frame is not False:
+      frames.append((kind, frame))
+    pos = buf.find(ESC, stop)
+  return frames, end
+
+def decode_altitude(alt12):
+  # only the 25ft (Q bit set) encoding, Gillham coded altitudes are skipped
+  if not alt12 & 0x10:
+    return None
+  n = ((alt12 & 0xFE0) >> 1) | (alt12 & 0xF)
+  return n * 25 - 1000
+
+def decode_message(payload, check_crc=True):
+  """Decode one 14 byte DF17 message into (icao, kind, fields).
+
+  kind is 'ident', 'velocity' or 'position'. Position fields carry the raw
+  CPR values and are resolved later in batches. Returns None for anything
+  else.
+  """
+  if check_crc and not crc_ok(payload):
+    return None
+  msg = int(binascii.hexlify(payload), 16)
+  if (msg >> 107) & 0x1F != 17:
+    return None
+  icao = "%06x" % ((msg >> 80) & 0xFFFFFF)
+  me = (msg >> 24) & 0xFFFFFFFFFFFFFF
+  tc = (me >> 51) & 0x1F
+
+  if 1 <= tc <= 4:
+    callsign = ''.join(IDENT_CHARSET[(me >> (42 - 6 * i)) & 0x3F] for i in range(8))
+    return icao, 'ident', {'flight': callsign.replace('#', '')}
+
+  if 9 <= tc <= 18:
+    fields = {
+      'odd': (me >> 34) & 1,
+      'lat_cpr': (me >> 17) & 0x1FFFF,
+      'lon_cpr': me & 0x1FFFF,
+    }
+    altitude = decode_altitude((me >> 36) & 0xFFF)
+    if altitude is not None:
+      fields['altitude'] = altitude
+    return icao, 'position', fields
+
+  if tc == 19:
+    subtype = (me >> 48) & 0x7
+    if subtype not in (1, 2):
+      return None #airspeed subtypes are not used here
+    fields = {}
+    v_ew = (me >> 32) & 0x3FF
+    v_ns = (me >> 21) & 0x3FF
+    if v_ew and v_ns:
+      scale = 4 if subtype == 2 else 1
+      vx = (v_ew - 1) * scale * (-1 if (me >> 42) & 1 else 1)
+      vy = (v_ns - 1) * scale * (-1 if (me >> 31) & 1 else 1)
+      fields['speed'] = int(round(math.hypot(vx, vy)))
+      fields['track'] = int(round(math.degrees(math.atan2(vx, vy)))) % 360
+      fields['validtrack'] = 1
+    vr = (me >> 10) & 0x1FF
+    if vr:
+      fields['vert_rate'] = (vr - 1) * 64 * (-1 if (me >> 19) & 1 else 1)
+    return icao, 'velocity', fields
+
+  return None
+
+def cpr_nl(lat):
+  """Vectorized number of longitude zones for each latitude."""
+  lat = np.abs(np.asarray(lat, dtype=np.float64))
+  with np.errstate(invalid='ignore', divide='ignore'):
+    a = 1.0 - (1.0 - np.cos(np.pi / 30.0)) / np.cos(np.radians(lat)) ** 2
+    nl = np.floor(2.0 * np.pi / np.arccos(a))
+  nl = np.where(lat < 1e-9, 59.0, nl)
+  nl = np.where(lat >= 87.0, 1.0, nl)
+  return nl.astype(np.int64)
+
+def decode_cpr_pairs(lat_even, lon_even, lat_odd, lon_odd, odd_newer):
+  """Globally decode arrays of even/odd airborne CPR pairs in one go.
+
+  Inputs are the raw 17 bit values and a boolean array saying which half is
+  the most recent. Returns (lat, lon, valid) arrays.
+  """
+  lat0 = np.asarray(lat_even, dtype=np.float64) / 131072.0
+  lon0 = np.asarray(lon_even, dtype=np.float64) / 131072.0
+  lat1 = np.asarray(lat_odd, dtype=np.float64) / 131072.0
+  lon1 = np.asarray(lon_odd, dtype=np.float64) / 131072.0
+  odd_newer = np.asarray(odd_newer, dtype=bool)
+
+  j = np.floor(59.0 * lat0 - 60.0 * lat1 + 0.5)
+  rlat0 = (360.0 / 60.0) * (np.mod(j, 60.0) + lat0)
+  rlat1 = (360.0 / 59.0) * (np.mod(j, 59.0) + lat1)
+  rlat0 = np.where(rlat0 >= 270.0, rlat0 - 360.0, rlat0)
+  rlat1 = np.where(rlat1 >= 270.0, rlat1 - 360.0, rlat1)
+
+  nl0 = cpr_nl(rlat0)
+  nl1 = cpr_nl(rlat1)
+  valid = (nl0 == nl1) & (np.abs(rlat0) <= 90.0) & (np.abs(rlat1) <= 90.0)
+
+  lat = np.where(odd_newer, rlat1, rlat0)
+  nl = nl0
+  ni = np.maximum(np.where(odd_newer, nl - 1, nl), 1)
+  m = np.floor(lon0 * (nl - 1) - lon1 * nl + 0.5)
+  lon = (360.0 / ni) * (np.mod(m, ni) + np.where(odd_newer, lon1, lon0))
+  lon = np.where(lon >= 180.0, lon - 360.0, lon)
+  return lat, lon, valid
+
+class BeastDecoder(AircraftTable):
+  """Keeps per-aircraft state from a stream of Beast frames.
+
+  Identification and velocity update the aircraft straight away, position
+  halves are collected and resolved together at the end of every feed().
+  """
+  name = 'Beast'
+
+  def __init__(self, check_crc=True):
+    AircraftTable.__init__(self)
+    self.check_crc = check_crc
+    self.pending = b''
+    # icao -> [even, odd], each (lat_cpr, lon_cpr, received, sequence).
+    # received is per chunk, so which half is newer goes by sequence, the
+    # order the halves were decoded in
+    self.cpr = {}
+    self.sequence = 0
+
+  def feed(self, data, touched=None):
+    """Decode a chunk of the Beast stream, returning the set of aircraft hex
+    codes that were updated.
+    """
+    if touched is None:
+      touched = set()
+    buf = self.pending + data if self.pending else data
+    frames, consumed = split_frames(buf)
+    self.pending = buf[consumed:]
+    now = time.time()
+    positions = set()
+    for kind, frame in frames:
+      if kind != MODES_LONG:
+        continue
+      decoded = decode_message(frame[7:], self.check_crc)
+      if decoded is None:
+        continue
+      icao, what, fields = decoded
+      state = self.state_for(icao)
+      if what == 'position':
+        halves = self.cpr.setdefault(icao, [None, None])
+        self.sequence += 1
+        halves[fields.pop('odd')] = (fields.pop('lat_cpr'), fields.pop('lon_cpr'), now, self.sequence)
+        positions.add(icao)
+      state.update(fields)
+      touched.add(icao)
+    if positions:
+      self.resolve_positions(positions)
+    return touched
+
+  def forget(self, icao):
+    AircraftTable.forget(self, icao)
+    self.cpr.pop(icao, None)
+
+  def resolve_positions(self, icaos):
+    pairs = []
+    for icao in icaos:
+      even, odd = self.cpr[icao]
+      if even is not None and odd is not None and abs(even[2] - odd[2]) <= CPR_MAX_AGE:
+        pairs.append((icao, even, odd))
+    if not pairs:
+      return
+    lat, lon, valid = decode_cpr_pairs(
+      [p[1][0] for p in pairs], [p[1][1] for p in pairs],
+      [p[2][0] for p in pairs], [p[2][1] for p in pairs],
+      [p[2][3] > p[1][3] for p in pairs])
+    for i in np.flatnonzero(valid):
+      state = self.aircraft[pairs[i][0]]
+      state['lat'] = float(lat[i])
+      state['lon'] = float(lon[i])
+      state['validposition'] = 1
+
+class BeastFeed(TCPFeed, BeastDecoder):
+  """Streams dump1090's Beast output over one TCP connection."""
+  name = 'Beast'
+
+  def __init__(self, host, port=30005, check_crc=True, bufsize=65536, **kwargs):
+    BeastDecoder.__init__(self, check_crc)
+    TCPFeed.__init__(self, host, port, **kwargs)
+    self.bufsize = bufsize
+
+  def close(self):
+    TCPFeed.close(self)
+    self.pending = b''
+
+  def read(self, touched):
+    chunks = []
+    while True:
+      try:
+        chunk = self.sock.recv(self.bufsize)
+      except socket.error as e:
+        if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+          break
+        raise
+      if not chunk:
+        self.feed(b''.join(chunks), touched)
+        return False
+      chunks.append(chunk)
+    self.feed(b''.join(chunks), touched)
+    return True
+
+def replay_file(path, chunk_size=65536, decoder=None):
+  """Run a captured Beast stream through a decoder, returning the decoder."""
+  decoder = decoder if decoder is not None else BeastDecoder()
+  with open(path, 'rb') as capture:
+    while True:
+      chunk = capture.read(chunk_size)
+      if not chunk:
+        break
+      decoder.feed(chunk)
+  return decoder
+
+if __name__ == "__main__":
+  import argparse
+  parser = argparse.ArgumentParser(description='Decode a captured Beast stream')
+  parser.add_argument('capture', help="path to a captured port 30005 feed")
+  args = parser.parse_args()
+  started = time.time()
+  decoder = replay_file(args.capture)
+  elapsed = time.time() - started
+  print("%d messages, %d aircraft in %.3fs (%.0f msg/s)" % (decoder.messages, len(decoder.aircraft),
+    elapsed, decoder.messages / elapsed if elapsed else 0))
+  for state in decoder.aircraft.values():
+    print(state)
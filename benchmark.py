@@ -0,0 +1,197 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# headless timings of the ingest and render hot paths, saved as JSON to compare runs
+from __future__ import print_function
+import json
+import os
+import os.path
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from timeit import default_timer as timer
+
+import numpy as np
+
+# no display needed, set before pygame is imported
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+import pygame
+
+from all_nearest_planes import Flyover, createDefaultsArgs, gSQLDBStandingDBLocn, gSQLDBBaseStnDBLocn
+from enrichment import EnrichmentPool
+from fake_dump1090 import TrafficSimulator, gAreaLocn
+from geofence import Geofence
+from ingest import FlightPoller
+from recording import Recorder
+
+PERCENTILES = (50, 90, 99)
+
+# map tiles for the benchmarks go to map_images_<zoom>_bench and are removed after
+TILE_FOLDER = '_bench'
+
+def summarize(times):
+  """Milliseconds at each percentile plus mean, min and max."""
+  times = np.array(times) * 1000.0
+  summary = dict(('p%d' % p, float(np.percentile(times, p))) for p in PERCENTILES)
+  summary.update(mean=float(times.mean()), min=float(times.min()), max=float(times.max()), runs=len(times))
+  return summary
+
+def timed(function, runs, setup=None):
+  times = []
+  for i in xrange(runs):
+    if setup is not None:
+      setup()
+    started = timer()
+    function()
+    times.append(timer() - started)
+  return times
+
+def record_traffic(count, steps, path, seed=1):
+  """A replay log of count simulated aircraft, one record a second."""
+  simulator = TrafficSimulator(count, seed=seed)
+  recorder = Recorder(path)
+  now = time.time()
+  for i in xrange(steps):
+    recorder.write(simulator.aircraft(), now)
+    now += 1.0
+    simulator.step(now)
+  recorder.close()
+
+def replay_poller(path):
+  """A FlightPoller over a replay log that plays one record per poll.
+  Without the databases the lookups only fail, so they are skipped.
+  """
+  options = createDefaultsArgs(['--source', 'replay', '--replay', path, '--replay-speed', '0', '--expire', '3600'])
+  flyover = Flyover()
+  if not (os.path.isfile(gSQLDBStandingDBLocn) and os.path.isfile(gSQLDBBaseStnDBLocn)):
+    flyover.enrichment = EnrichmentPool(lambda jobs: ({}, ()))
+  return FlightPoller(options, interval=0, flyover=flyover)
+
+def bench_ingest(count, runs, workdir):
+  # the first poll adds every aircraft, the rest are the steady state
+  path = os.path.join(workdir, 'traffic-%d.jsonl.gz' % count)
+  record_traffic(count, runs + 1, path)
+  poller = replay_poller(path)
+  started = timer()
+  poller.poll_once()
+  first = timer() - started
+  return {
+    'ingest_first[n=%d]' % count: summarize([first]),
+    'ingest[n=%d]' % count: summarize(timed(poller.poll_once, runs)),
+  }
+
+def bench_geofence(count, runs):
+  fence = Geofence(gAreaLocn)
+  random = np.random.RandomState(1)
+  lon = random.uniform(-122.2, -121.3, count)
+  lat = random.uniform(37.1, 37.6, count)
+  return {'geofence[n=%d]' % count: summarize(timed(lambda: fence.classify(lon, lat), runs))}
+
+def fake_tile(lat, lon, z, x, y):
+  # stands in for the mapbox download, a plain tile where it would be saved
+  fileName = os.path.join(os.path.dirname(__file__), "map_images_{}{}/{}_{}.png".format(z, TILE_FOLDER, x, y))
+  if not os.path.isdir(os.path.dirname(fileName)):
+    os.makedirs(os.path.dirname(fileName))
+  tile = pygame.Surface((256, 256))
+  tile.fill((200 + (x + y) % 2 * 40, 220, 200))
+  pygame.image.save(tile, fileName)
+
+def bench_views(count, runs, workdir, size):
+  import controller
+  import model
+  path = os.path.join(workdir, 'views-%d.jsonl.gz' % count)
+  record_traffic(count, 3, path)
+  poller = replay_poller(path)
+  for i in range(3):
+    poller.poll_once()
+  screen = pygame.display.set_mode(size)
+  flymodel = model.UIFlyByModel(size[0], size[1], poller=poller)
+  flymodel.getStreetImage = flymodel.getSatelliteImage = fake_tile
+  flycontroller = controller.UIFlyByController(flymodel)
+  flymodel.map_folder = TILE_FOLDER
+  allPlanesMap = flycontroller.allPlanesMap
+  planeMap = flycontroller.planeMap
+  planelist = flycontroller.planelist
+  planeMap.setPlane(poller.latest().flights.values()[0].get('flight').strip())
+  for view in (allPlanesMap, planeMap, planelist):
+    view.render(screen) #fetch the tiles
+    view.render(screen)
+  center = flymodel.deg2num(flymodel.center_lat, flymodel.center_lon, allPlanesMap.zoom)
+  results = {
+    'render_all_planes_map[n=%d]' % count: summarize(timed(lambda: allPlanesMap.render(screen), runs)),
+    'render_plane_map[n=%d]' % count: summarize(timed(lambda: planeMap.render(screen), runs)),
+    'render_plane_list[n=%d]' % count: summarize(timed(lambda: planelist.render(screen), runs)),
+  }
+  load = lambda: allPlanesMap.loadTiles(center[0], center[1], allPlanesMap.zoom)
+  load()
+  results['load_tiles_warm'] = summarize(timed(load, runs))
+  results['load_tiles_cold'] = summarize(timed(load, runs, setup=allPlanesMap.clearTiles))
+  return results
+
+def git_revision():
+  try:
+    return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def compare(results, baseline):
+  print()
+  print("%-34s %10s %10s %8s" % ('p50 vs baseline', 'before', 'after', 'change'))
+  for name in sorted(results):
+    if name in baseline:
+      before, after = baseline[name]['p50'], results[name]['p50']
+      change = (after - before) / before * 100.0 if before else 0.0
+      print("%-34s %9.3fms %9.3fms %+7.1f%%" % (name, before, after, change))
+
+if __name__ == "__main__":
+  import argparse
+  parser = argparse.ArgumentParser(description='Time the ingest and render hot paths without a display')
+  parser.add_argument('-n', '--sizes', default='10,100,1000', help="comma separated fleet sizes")
+  parser.add_argument('-r', '--runs', type=int, default=50, help="timed runs of each benchmark")
+  parser.add_argument('--size', default='480x320', help="screen size for the views, WIDTHxHEIGHT")
+  parser.add_argument('-o', '--output', default=None, help="save the results to this JSON file")
+  parser.add_argument('-c', '--compare', default=None, help="a saved JSON file to compare against")
+  args = parser.parse_args()
+
+  sizes = [int(size) for size in args.sizes.split(',')]
+  screen_size = tuple(int(v) for v in args.size.split('x'))
+  pygame.display.init()
+  pygame.font.init()
+  workdir = tempfile.mkdtemp(prefix='flyby-bench-')
+  results = {}
+  try:
+    for count in sizes:
+      print("benchmarking %d aircraft" % count)
+      results.update(bench_ingest(count, args.runs, workdir))
+      results.update(bench_geofence(count, args.runs))
+      results.update(bench_views(count, args.runs, workdir, screen_size))
+  finally:
+    shutil.rmtree(workdir, ignore_errors=True)
+    for name in os.listdir(os.path.dirname(os.path.abspath(__file__))):
+      if name.startswith('map_images_') and name.endswith(TILE_FOLDER):
+        shutil.rmtree(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), ignore_errors=True)
+
+  print()
+  print("%-34s %10s %10s %10s %10s" % ('benchmark', 'p50', 'p90', 'p99', 'max'))
+  for name in sorted(results):
+    r = results[name]
+    print("%-34s %8.3fms %8.3fms %8.3fms %8.3fms" % (name, r['p50'], r['p90'], r['p99'], r['max']))
+
+  if args.compare:
+    with open(args.compare) as saved:
+      compare(results, json.load(saved)['results'])
+  if args.output:
+    with open(args.output, 'w') as output:
+      json.dump({
+        'timestamp': time.time(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sizes': sizes,
+        'runs': args.runs,
+        'results': results,
+      }, output, indent=2, sort_keys=True)
+    print("saved to %s" % args.output)
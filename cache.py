@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# bounded LRU cache with per-entry expiry for the enrichment lookups
+from __future__ import print_function
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+class LRUCache(object):
+  """Size bounded, least recently used cache whose entries expire after ttl
+  seconds. A value of None records a "not found" result and expires after
+  negative_ttl instead, so misses are not looked up again on every sighting.
+
+  get() returns MISSING when the key has to be looked up. The counters are
+  there to size maxsize and the ttls for real traffic.
+  """
+
+  def __init__(self, maxsize=2048, ttl=6 * 3600.0, negative_ttl=600.0, clock=time.time):
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self.negative_ttl = negative_ttl
+    self.clock = clock
+    self.entries = OrderedDict()
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.negative_hits = 0
+    self.misses = 0
+    self.expirations = 0
+    self.evictions = 0
+
+  def __len__(self):
+    return len(self.entries)
+
+  def get(self, key):
+    with self.lock:
+      entry = self.entries.pop(key, None)
+      if entry is None:
+        self.misses += 1
+        return MISSING
+      value, expires = entry
+      if expires <= self.clock():
+        self.expirations += 1
+        self.misses += 1
+        return MISSING
+      self.entries[key] = entry #most recently used goes to the end
+      if value is None:
+        self.negative_hits += 1
+      else:
+        self.hits += 1
+      return value
+
+  def put(self, key, value):
+    ttl = self.ttl if value is not None else self.negative_ttl
+    with self.lock:
+      self.entries.pop(key, None)
+      self.entries[key] = (value, self.clock() + ttl)
+      while len(self.entries) > self.maxsize:
+        self.entries.popitem(last=False)
+        self.evictions += 1
+
+  def get_many(self, keys):
+    """Split keys into a dict of cached values and a list still to look up."""
+    found = {}
+    missing = []
+    for key in keys:
+      value = self.get(key)
+      if value is MISSING:
+        missing.append(key)
+      else:
+        found[key] = value
+    return found, missing
+
+  def stats(self):
+    lookups = self.hits + self.negative_hits + self.misses
+    return {
+      'size': len(self.entries),
+      'hits': self.hits,
+      'negative_hits': self.negative_hits,
+      'misses': self.misses,
+      'expirations': self.expirations,
+      'evictions': self.evictions,
+      'hit_rate': float(self.hits + self.negative_hits) / lookups if lookups else 0.0,
+    }
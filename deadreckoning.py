@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# extrapolates aircraft positions between polls so the maps can move them every frame
+from __future__ import print_function
+import time
+import numpy as np
+
+# nautical miles per degree of latitude
+NM_PER_DEGREE = 60.0
+
+class DeadReckoner(object):
+  """Moves every aircraft along its track at its ground speed and vertical
+  rate from the time of its last position fix, all in one vectorized step.
+
+  When a snapshot brings new fixes, the difference between where an
+  aircraft was being drawn and where the new fix puts it is faded out over
+  blend_time seconds instead of jumping. Differences over snap_distance
+  degrees, e.g. a bad fix or an aircraft coming back, are not blended.
+  Extrapolation stops after max_extrapolation seconds without a fix.
+  """
+
+  def __init__(self, blend_time=1.0, max_extrapolation=15.0, snap_distance=0.05, clock=time.time):
+    self.blend_time = blend_time
+    self.max_extrapolation = max_extrapolation
+    self.snap_distance = snap_distance
+    self.clock = clock
+    self.version = None
+    self.keys = []
+    self.index = {}
+    self.blend_started = 0.0
+    for name in ('lat', 'lon', 'altitude', 'fixed', 'speed', 'vert_rate', 'north', 'east', 'error_lat', 'error_lon'):
+      setattr(self, name, np.empty(0))
+
+  def update(self, snapshot):
+    """Take the fixes of a FlightSnapshot, once per version."""
+    if snapshot.version == self.version:
+      return
+    now = self.clock()
+    drawn = self.positions(now)
+    flights = [flight for flight in snapshot.flights.itervalues() if 'lat' in flight and 'lon' in flight]
+
+    def column(name, default=0.0):
+      values = np.fromiter((flight.get(name, default) for flight in flights), dtype=np.float64, count=len(flights))
+      values[np.isnan(values)] = default
+      return values
+
+    self.version = snapshot.version
+    self.keys = [flight.get('hex') for flight in flights]
+    self.lat = column('lat')
+    self.lon = column('lon')
+    self.altitude = column('altitude')
+    self.fixed = column('position_time', snapshot.timestamp)
+    self.speed = column('speed')
+    self.vert_rate = column('vert_rate')
+    track = np.radians(column('track'))
+    # degrees of latitude and longitude covered per nautical mile
+    self.north = np.cos(track) / NM_PER_DEGREE
+    self.east = np.sin(track) / (NM_PER_DEGREE * np.maximum(np.cos(np.radians(self.lat)), 0.01))
+
+    # carry over the offset from where each aircraft is on screen right now
+    self.error_lat = np.zeros(len(flights))
+    self.error_lon = np.zeros(len(flights))
+    pairs = [(i, self.index[key]) for i, key in enumerate(self.keys) if key in self.index]
+    self.index = dict((key, i) for i, key in enumerate(self.keys))
+    self.blend_started = now
+    if pairs:
+      new, old = np.array(pairs).T
+      fresh = self.positions(now)
+      self.error_lat[new] = drawn[0][old] - fresh[0][new]
+      self.error_lon[new] = drawn[1][old] - fresh[1][new]
+      snap = np.hypot(self.error_lat, self.error_lon) > self.snap_distance
+      self.error_lat[snap] = 0.0
+      self.error_lon[snap] = 0.0
+
+  def positions(self, now=None):
+    """Arrays of lat, lon and altitude for self.keys at time now."""
+    if now is None:
+      now = self.clock()
+    dt = np.clip(now - self.fixed, 0.0, self.max_extrapolation)
+    distance = self.speed * dt / 3600.0
+    fade = max(0.0, 1.0 - (now - self.blend_started) / self.blend_time) if self.blend_time else 0.0
+    lat = self.lat + distance * self.north + fade * self.error_lat
+    lon = self.lon + distance * self.east + fade * self.error_lon
+    altitude = self.altitude + self.vert_rate * dt / 60.0
+    return lat, lon, altitude
+
+  def by_key(self, now=None):
+    """Dict of hex to (lat, lon, altitude) at time now."""
+    lat, lon, altitude = self.positions(now)
+    return dict(zip(self.keys, zip(lat.tolist(), lon.tolist(), altitude.tolist())))
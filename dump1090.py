@@ -0,0 +1,118 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# keep-alive, conditional and adaptive polling of dump1090's data.json
+from __future__ import print_function
+import hashlib
+import json
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+parse_seconds = metrics.stage('parse')
+
+class Dump1090Client(object):
+  """Polls one dump1090 HTTP interface over a pooled keep-alive session.
+
+  fetch() returns the parsed aircraft list only when the feed changed and
+  None otherwise, so callers can skip the merge. Unchanged bodies are caught
+  by ETag/Last-Modified (304) or, failing that, by a hash of the body before
+  any JSON parsing happens.
+  """
+
+  def __init__(self, host, timeout=(2.0, 3.0), min_interval=0.5, max_interval=5.0,
+               max_backoff=60.0, session=None):
+    self.url = "http://%s/dump1090/data.json" % host
+    self.timeout = timeout
+    self.min_interval = min_interval
+    self.max_interval = max_interval
+    self.max_backoff = max_backoff
+    if session is None:
+      session = requests.Session()
+      adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=0)
+      session.mount('http://', adapter)
+      session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+    self.session = session
+
+    self.etag = None
+    self.last_modified = None
+    self.digest = None
+    self.flights = []
+    self.interval = min_interval
+    self.change_period = None
+    self.last_change = None
+    self.failures = 0
+
+    self.requests = 0
+    self.not_modified = 0
+    self.unchanged = 0
+    self.updates = 0
+    self.errors = 0
+
+  def fetch(self):
+    """Return the new aircraft list, or None when nothing changed.
+
+    Network and HTTP errors are counted for the backoff and then re-raised.
+    """
+    headers = {}
+    if self.etag:
+      headers['If-None-Match'] = self.etag
+    if self.last_modified:
+      headers['If-Modified-Since'] = self.last_modified
+    self.requests += 1
+    try:
+      response = self.session.get(self.url, headers=headers, timeout=self.timeout)
+      if response.status_code == 304:
+        self.failures = 0
+        self.not_modified += 1
+        self._unchanged()
+        return None
+      response.raise_for_status()
+    except requests.RequestException:
+      self.failures += 1
+      self.errors += 1
+      raise
+    self.failures = 0
+    self.etag = response.headers.get('ETag')
+    self.last_modified = response.headers.get('Last-Modified')
+
+    body = response.content
+    digest = hashlib.sha1(body).digest()
+    if digest == self.digest:
+      self.unchanged += 1
+      self._unchanged()
+      return None
+    with parse_seconds.time():
+      self.flights = json.loads(body.decode('utf-8'))
+    self.digest = digest
+    self.updates += 1
+    self._changed()
+    return self.flights
+
+  def _changed(self):
+    # track how often the feed really changes and poll at about twice that rate
+    now = time.time()
+    if self.last_change is not None:
+      period = now - self.last_change
+      if self.change_period is None:
+        self.change_period = period
+      else:
+        self.change_period = 0.7 * self.change_period + 0.3 * period
+      self.interval = self.change_period / 2.0
+    self.last_change = now
+    self.interval = min(self.max_interval, max(self.min_interval, self.interval))
+
+  def _unchanged(self):
+    # a quiet feed: back the poll interval off gently
+    self.interval = min(self.max_interval, self.interval * 1.25)
+
+  def next_delay(self):
+    """Seconds to wait before the next fetch, with exponential backoff while
+    the receiver is failing.
+    """
+    if self.failures:
+      return min(self.max_backoff, self.min_interval * (2 ** self.failures))
+    return self.interval
@@ -0,0 +1,138 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# enrichment lookups on a bounded pool of threads, off the poll thread
+from __future__ import print_function
+import itertools
+import threading
+import time
+import traceback
+import Queue
+from sys import stderr
+
+import metrics
+
+lookup_seconds = metrics.stage('enrichment_lookup')
+
+# lower runs first, retries wait behind everything new
+PRIORITY_VISIBLE = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_RETRY = 2
+
+class EnrichmentPool(object):
+  """Runs enrichment jobs on a few daemon threads.
+
+  lookup is called with a list of (key, job) pairs, as many as are waiting up
+  to batch_size, and returns a dict of key to the fields to merge in along
+  with the keys whose lookups failed. Failed keys, or the whole batch when
+  lookup raises, are queued again until they have failed max_attempts
+  times. Jobs are taken in priority order and a key that is already
+  waiting is only queued again to move it up. drain() hands back finished
+  results within a time budget so the poll thread never stalls on them.
+  """
+
+  def __init__(self, lookup, workers=2, maxsize=512, batch_size=50, max_attempts=3):
+    self.lookup = lookup
+    self.batch_size = batch_size
+    self.max_attempts = max_attempts
+    self.jobs = Queue.PriorityQueue(maxsize)
+    self.results = Queue.Queue()
+    self.pending = {}
+    self.attempts = {}
+    self.lock = threading.Lock()
+    self.sequence = itertools.count()
+    self.submitted = 0
+    self.completed = 0
+    self.dropped = 0
+    self.retried = 0
+    self.failed = 0
+    self.threads = []
+    for i in range(workers):
+      thread = threading.Thread(target=self.work, name='Enrichment-%d' % i)
+      thread.daemon = True
+      thread.start()
+      self.threads.append(thread)
+
+  def submit(self, key, job, priority=PRIORITY_DEFAULT):
+    """Queue a job, returning False if the queue is full."""
+    with self.lock:
+      waiting = self.pending.get(key)
+      if waiting is not None and waiting <= priority:
+        return True
+      try:
+        self.jobs.put_nowait((priority, next(self.sequence), key, job))
+      except Queue.Full:
+        self.dropped += 1
+        return False
+      self.pending[key] = priority
+      self.submitted += 1
+      return True
+
+  def _take(self, item, batch):
+    priority, _, key, job = item
+    with self.lock:
+      # stale entries left behind when a key was moved up the queue
+      if self.pending.get(key) != priority:
+        return
+      del self.pending[key]
+    batch.append((key, job))
+
+  def work(self):
+    while True:
+      batch = []
+      self._take(self.jobs.get(), batch)
+      while len(batch) < self.batch_size:
+        try:
+          self._take(self.jobs.get_nowait(), batch)
+        except Queue.Empty:
+          break
+      if not batch:
+        continue
+      try:
+        with lookup_seconds.time():
+          found, failed = self.lookup(batch)
+      except Exception:
+        print("enrichment failed", file=stderr)
+        traceback.print_exc()
+        found, failed = {}, set(key for key, job in batch)
+      for key, fields in found.iteritems():
+        self.results.put((key, fields))
+      for key, job in batch:
+        if key in failed:
+          self.retry(key, job)
+        else:
+          with self.lock:
+            self.attempts.pop(key, None)
+            self.completed += 1
+
+  def retry(self, key, job):
+    """Queue a failed job again behind the new ones, or give up on it once
+    it has failed max_attempts times.
+    """
+    with self.lock:
+      if key in self.pending: #submitted again meanwhile
+        return
+      attempts = self.attempts.pop(key, 0) + 1
+      if attempts < self.max_attempts:
+        try:
+          self.jobs.put_nowait((PRIORITY_RETRY, next(self.sequence), key, job))
+          self.pending[key] = PRIORITY_RETRY
+          self.attempts[key] = attempts
+          self.retried += 1
+          return
+        except Queue.Full:
+          pass
+      self.failed += 1
+
+  def drain(self, budget):
+    """Return finished (key, fields) results, stopping after budget seconds."""
+    done = []
+    deadline = time.time() + budget
+    while True:
+      try:
+        done.append(self.results.get_nowait())
+      except Queue.Empty:
+        break
+      if time.time() >= deadline:
+        break
+    return done
@@ -0,0 +1,74 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# evicts aircraft that have not been heard from, whether or not dump1090 still lists them
+from __future__ import print_function
+import heapq
+import time
+
+class ExpiryQueue(object):
+  """Tracks when each key was last heard from and hands back the keys that
+  have been quiet for timeout seconds.
+
+  Keys sit in a heap by deadline with one entry each. Hearing from a key
+  only records the time, and an entry popped before its real deadline is
+  pushed back, so a tick costs O(expired) rather than O(tracked).
+  """
+
+  def __init__(self, timeout=60.0, clock=time.time):
+    self.timeout = timeout
+    self.clock = clock
+    self.heard = {}
+    self.deadlines = {}
+    self.heap = []
+    self.evicted = 0
+    self.repushed = 0
+
+  def __len__(self):
+    return len(self.heard)
+
+  def touch(self, key, heard=None):
+    """Record that key was heard from at heard, by default now."""
+    if heard is None:
+      heard = self.clock()
+    last = self.heard.get(key)
+    if last is None:
+      self.schedule(key, heard + self.timeout)
+    elif heard <= last:
+      return
+    self.heard[key] = heard
+
+  def schedule(self, key, deadline):
+    heapq.heappush(self.heap, (deadline, key))
+    self.deadlines[key] = deadline
+
+  def discard(self, key):
+    # its heap entry is skipped when it comes up
+    self.heard.pop(key, None)
+    self.deadlines.pop(key, None)
+
+  def expired(self, now=None):
+    """Remove and return the keys not heard from for timeout seconds."""
+    if now is None:
+      now = self.clock()
+    keys = []
+    while self.heap and self.heap[0][0] <= now:
+      deadline, key = heapq.heappop(self.heap)
+      if self.deadlines.get(key) != deadline: #discarded, or a stale entry
+        continue
+      last = self.heard[key]
+      if last + self.timeout > now:
+        self.schedule(key, last + self.timeout)
+        self.repushed += 1
+        continue
+      self.discard(key)
+      keys.append(key)
+    self.evicted += len(keys)
+    return keys
+
+  def stats(self):
+    return {
+      'tracked': len(self.heard),
+      'evicted': self.evicted,
+      'repushed': self.repushed,
+    }
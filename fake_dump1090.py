@@ -0,0 +1,261 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# simulated traffic served as dump1090's data.json, for testing without a receiver
+from __future__ import print_function
+import BaseHTTPServer
+import SocketServer
+import hashlib
+import io
+import json
+import os.path
+import sqlite3 as lite
+import threading
+import time
+from email.utils import formatdate
+
+import numpy as np
+
+from all_nearest_planes import gFlightNumbersLocn, gSQLDBStandingDBLocn, gSQLDBBaseStnDBLocn
+
+gAreaLocn = os.path.join(os.path.dirname(__file__), "flyby.geojson")
+
+# the runway end of the landing corridors is the one nearest the airport
+AIRPORT = (-121.9292, 37.3628)
+NM_PER_DEGREE = 60.0
+
+# used when neither FlightNumbers.csv nor StandingData.sqb is around
+FALLBACK_AIRLINES = ('UAL', 'SWA', 'AAL', 'DAL', 'ASA', 'JBU')
+
+def corridors(area_geojson_location):
+  """(name, start, end, half_width) of each zone. start and end are lon/lat
+  arrays of a centerline along the longest chord between two of the zone's
+  vertices, moved to the middle of the zone, and half_width is how far
+  either side of it aircraft fly, in degrees of latitude.
+  """
+  with open(area_geojson_location) as geojson:
+    features = json.load(geojson)['features']
+  found = []
+  for feature in features:
+    geometry = feature['geometry']
+    ring = geometry['coordinates'][0] if geometry['type'] == 'Polygon' else geometry['coordinates'][0][0]
+    points = np.array(ring, dtype=np.float64)[:, :2]
+    scale = np.array([np.cos(np.radians(points[:, 1].mean())), 1.0])
+    flat = points * scale
+    distances = np.hypot(*(flat[:, None, :] - flat[None, :, :]).transpose(2, 0, 1))
+    i, j = np.unravel_index(np.argmax(distances), distances.shape)
+    axis = (flat[j] - flat[i]) / distances[i, j]
+    normal = np.array([-axis[1], axis[0]])
+    across = (flat - flat[i]).dot(normal)
+    shift = normal * (across.max() + across.min()) / 2.0 / scale
+    start, end = points[i] + shift, points[j] + shift
+    if feature['properties'].get('name', '').endswith('_landing'):
+      # fly towards the airport when landing
+      if np.hypot(*((start - AIRPORT) * scale)) < np.hypot(*((end - AIRPORT) * scale)):
+        start, end = end, start
+    found.append((feature['properties'].get('name'), start, end, (across.max() - across.min()) / 4.0))
+  return found
+
+def load_callsigns(csv_location=gFlightNumbersLocn, standing_location=gSQLDBStandingDBLocn):
+  """Callsigns with a route in FlightNumbers.csv and StandingData.sqb,
+  whichever of the two are there, so the enrichment lookups find them.
+  """
+  sources = []
+  if os.path.isfile(csv_location):
+    with io.open(csv_location, 'r', encoding='utf-8', errors='replace') as csv:
+      sources.append(set(fields[0] + fields[1] for fields in (line.split(',') for line in csv) if len(fields) >= 3 and fields[1].isdigit()))
+  if os.path.isfile(standing_location):
+    try:
+      con = lite.connect(standing_location)
+      sources.append(set(row[0] for row in con.execute("SELECT Callsign FROM RouteView") if row[0]))
+      con.close()
+    except lite.Error, e:
+      print(e)
+  callsigns = set.intersection(*sources) if sources else set()
+  if not callsigns and sources:
+    callsigns = set.union(*sources)
+  if not callsigns:
+    callsigns = set('%s%d' % (airline, number) for airline in FALLBACK_AIRLINES for number in range(1, 2000))
+  return sorted(callsigns)
+
+def load_hexes(basestation_location=gSQLDBBaseStnDBLocn):
+  """ICAO hex codes from BaseStation.sqb, so the aircraft types are found."""
+  if not os.path.isfile(basestation_location):
+    return []
+  try:
+    con = lite.connect(basestation_location)
+    hexes = [row[0].lower() for row in con.execute("SELECT MODES FROM AIRCRAFT") if row[0]]
+    con.close()
+    return hexes
+  except lite.Error, e:
+    print(e)
+    return []
+
+class TrafficSimulator(object):
+  """count aircraft flying the corridors of the area geojson, as arrays.
+
+  Aircraft in the *_landing corridors land towards the airport or take off
+  away from it, the rest cross their zone at cruise altitude. An aircraft
+  that reaches the end of its corridor is replaced by a new one.
+  """
+
+  def __init__(self, count, area_geojson_location=gAreaLocn, callsigns=None, hexes=None, seed=None):
+    self.random = np.random.RandomState(seed)
+    self.corridors = corridors(area_geojson_location)
+    self.starts = np.array([start for name, start, end, half_width in self.corridors])
+    self.ends = np.array([end for name, start, end, half_width in self.corridors])
+    self.half_widths = np.array([half_width for name, start, end, half_width in self.corridors])
+    self.approaches = np.array([name.endswith('_landing') for name, start, end, half_width in self.corridors])
+    scale = np.cos(np.radians((self.starts[:, 1] + self.ends[:, 1]) / 2.0))
+    # corridor lengths in nautical miles
+    self.corridor_lengths = np.hypot((self.ends[:, 0] - self.starts[:, 0]) * scale, self.ends[:, 1] - self.starts[:, 1]) * NM_PER_DEGREE
+    self.callsigns = callsigns or load_callsigns()
+    self.hexes = hexes or []
+    self.count = count
+    self.used_hexes = set()
+    self.hex = [None] * count
+    self.flight = [None] * count
+    self.squawk = [None] * count
+    self.corridor = np.zeros(count, dtype=np.intp)
+    self.landing = np.zeros(count, dtype=bool)
+    self.departing = np.zeros(count, dtype=bool)
+    self.progress = np.zeros(count)
+    self.speed = np.zeros(count)
+    self.start_altitude = np.zeros(count)
+    self.end_altitude = np.zeros(count)
+    self.offset = np.zeros(count)
+    self.messages = np.zeros(count, dtype=np.int64)
+    self.respawn(np.arange(count))
+    self.progress[:] = self.random.uniform(0.0, 1.0, count)
+    self.stepped = time.time()
+
+  def new_hex(self):
+    while True:
+      if self.hexes and len(self.used_hexes) < len(self.hexes):
+        key = self.hexes[self.random.randint(len(self.hexes))]
+      else:
+        key = '%06x' % self.random.randint(0x100000, 0xffffff)
+      if key not in self.used_hexes:
+        self.used_hexes.add(key)
+        return key
+
+  def respawn(self, which):
+    n = len(which)
+    for i in which:
+      self.used_hexes.discard(self.hex[i])
+      self.hex[i] = self.new_hex()
+      self.flight[i] = '%-8s' % self.callsigns[self.random.randint(len(self.callsigns))]
+      self.squawk[i] = '%04o' % self.random.randint(0o10000)
+    self.corridor[which] = self.random.randint(len(self.corridors), size=n)
+    approach = self.approaches[self.corridor[which]]
+    departing = approach & (self.random.uniform(size=n) < 0.5)
+    self.landing[which] = approach & ~departing
+    self.departing[which] = departing
+    self.progress[which] = 0.0
+    self.speed[which] = np.where(approach, self.random.uniform(140, 190, n), self.random.uniform(250, 480, n))
+    cruise = self.random.uniform(8000, 38000, n).round(-2)
+    self.start_altitude[which] = np.where(departing, 0, np.where(approach, self.random.uniform(3000, 5000, n).round(-2), cruise))
+    self.end_altitude[which] = np.where(departing, self.random.uniform(5000, 8000, n).round(-2), np.where(approach, 0, cruise))
+    self.offset[which] = self.random.uniform(-1.0, 1.0, n)
+
+  def step(self, now=None):
+    """Move every aircraft on by the time since the last step."""
+    if now is None:
+      now = time.time()
+    dt = now - self.stepped
+    self.stepped = now
+    self.progress += self.speed * dt / 3600.0 / self.corridor_lengths[self.corridor]
+    self.messages += self.random.poisson(max(dt, 0) * 4, self.count)
+    done = np.flatnonzero(self.progress >= 1.0)
+    if len(done):
+      self.respawn(done)
+
+  def aircraft(self):
+    """The aircraft as dump1090's data.json lists them."""
+    # departures and every other flyby fly their corridor backwards
+    backwards = self.departing | (~self.landing & (np.arange(self.count) % 2 == 1))
+    a = np.where(backwards[:, None], self.ends[self.corridor], self.starts[self.corridor])
+    b = np.where(backwards[:, None], self.starts[self.corridor], self.ends[self.corridor])
+    scale = np.cos(np.radians((a[:, 1] + b[:, 1]) / 2.0))
+    direction = (b - a) * np.column_stack((scale, np.ones(self.count)))
+    direction /= np.hypot(direction[:, 0], direction[:, 1])[:, None]
+    across = self.offset * self.half_widths[self.corridor]
+    lon = a[:, 0] + (b[:, 0] - a[:, 0]) * self.progress - direction[:, 1] * across / scale
+    lat = a[:, 1] + (b[:, 1] - a[:, 1]) * self.progress + direction[:, 0] * across
+    track = np.degrees(np.arctan2(direction[:, 0], direction[:, 1])) % 360
+    altitude = self.start_altitude + (self.end_altitude - self.start_altitude) * self.progress
+    minutes = self.corridor_lengths[self.corridor] / self.speed * 60.0
+    vert_rate = (self.end_altitude - self.start_altitude) / minutes
+    seen = self.random.uniform(0.0, 1.0, self.count)
+    aircraft = []
+    for i in xrange(self.count):
+      aircraft.append({
+        'hex': self.hex[i], 'squawk': self.squawk[i], 'flight': self.flight[i],
+        'lat': round(lat[i], 6), 'lon': round(lon[i], 6), 'validposition': 1,
+        'altitude': int(round(altitude[i], -2)), 'vert_rate': int(round(vert_rate[i], -1)),
+        'track': int(track[i]), 'validtrack': 1, 'speed': int(self.speed[i]),
+        'messages': int(self.messages[i]), 'seen': round(seen[i], 1),
+      })
+    return aircraft
+
+class DataJsonHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  def do_GET(self):
+    if self.path.split('?')[0] != '/dump1090/data.json':
+      self.send_error(404)
+      return
+    body, etag, modified = self.server.published
+    if self.headers.get('If-None-Match') == etag:
+      self.send_response(304)
+      self.send_header('ETag', etag)
+      self.end_headers()
+      return
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.send_header('ETag', etag)
+    self.send_header('Last-Modified', modified)
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+class FakeDump1090(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """Serves the simulator's aircraft at /dump1090/data.json, stepped and
+  published every update_interval seconds the way dump1090 rewrites it.
+  """
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def __init__(self, address, simulator, update_interval=1.0):
+    BaseHTTPServer.HTTPServer.__init__(self, address, DataJsonHandler)
+    self.simulator = simulator
+    self.update_interval = update_interval
+    self.publish()
+    updater = threading.Thread(target=self.update, name='FakeDump1090')
+    updater.daemon = True
+    updater.start()
+
+  def publish(self):
+    body = json.dumps(self.simulator.aircraft())
+    self.published = (body, '"%s"' % hashlib.sha1(body).hexdigest(), formatdate(usegmt=True))
+
+  def update(self):
+    while True:
+      time.sleep(self.update_interval)
+      self.simulator.step()
+      self.publish()
+
+if __name__ == "__main__":
+  import argparse
+  parser = argparse.ArgumentParser(description='Serve simulated aircraft as a local dump1090')
+  parser.add_argument('-n', '--aircraft', type=int, default=50, help="how many aircraft to fly, e.g. 5 to 5000")
+  parser.add_argument('-p', '--port', type=int, default=8080)
+  parser.add_argument('-g', '--area', default=gAreaLocn, help="geojson whose zones the aircraft fly through")
+  parser.add_argument('-i', '--interval', type=float, default=1.0, help="seconds between updates of data.json")
+  parser.add_argument('--seed', type=int, default=None)
+  args = parser.parse_args()
+  simulator = TrafficSimulator(args.aircraft, args.area, hexes=load_hexes(), seed=args.seed)
+  server = FakeDump1090(('', args.port), simulator, args.interval)
+  print("serving %d aircraft at http://localhost:%d/dump1090/data.json" % (args.aircraft, args.port))
+  server.serve_forever()
@@ -0,0 +1,247 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# a small filter language for aircraft, compiled once and evaluated over the store's columns
+from __future__ import print_function
+import re
+import numpy as np
+
+from flightstore import folded
+from spatial import haversine
+
+# numeric fields and the FlightStore column each reads, distance is in nm
+# from the location the filter was compiled with
+NUMERIC_FIELDS = {
+  'altitude': 'altitude',
+  'speed': 'speed',
+  'vert_rate': 'vert_rate',
+  'track': 'track',
+  'distance': None,
+}
+
+# text fields and the FlightStore text column each reads, compared ignoring case
+TEXT_FIELDS = {
+  'area': 'area',
+  'status': 'status',
+  'operator': 'OperatorName',
+  'route': 'plan',
+  'callsign': 'flight',
+}
+
+NUMERIC_OPERATORS = {
+  '<': np.less,
+  '<=': np.less_equal,
+  '>': np.greater,
+  '>=': np.greater_equal,
+  '=': np.equal,
+  '==': np.equal,
+  '!=': np.not_equal,
+}
+
+TEXT_OPERATORS = ('=', '==', '!=', '~', 'in')
+
+_token_re = re.compile(r'\s*(?:(<=|>=|!=|==|[<>=~(),])|"([^"]*)"|\'([^\']*)\'|([^\s<>=!~(),"\']+))')
+
+class FilterError(ValueError):
+  pass
+
+def tokenize(text):
+  tokens = []
+  position = 0
+  text = text.rstrip()
+  while position < len(text):
+    match = _token_re.match(text, position)
+    if match is None or match.end() == position:
+      raise FilterError("can't read %r at %r" % (text, text[position:]))
+    symbol, double, single, word = match.groups()
+    if symbol is not None:
+      tokens.append(('symbol', symbol))
+    elif word is not None:
+      tokens.append(('word', word))
+    else:
+      tokens.append(('text', double if double is not None else single))
+    position = match.end()
+  return tokens
+
+def legacy_altitude(altitude_string):
+  """The --altitude constraint, '<10000', '>30000' or '10000' for below,
+  as a filter expression.
+  """
+  altitude_string = altitude_string.strip()
+  if altitude_string[0] in '<>':
+    return 'altitude %s %s' % (altitude_string[0], altitude_string[1:].strip())
+  return 'altitude < %s' % altitude_string
+
+class FilterColumns(object):
+  """What one evaluation reads, gathered once however many clauses use it."""
+
+  def __init__(self, store, slots, location):
+    self.store = store
+    self.slots = slots
+    self.location = location
+    self.cache = {}
+
+  def numeric(self, field):
+    values = self.cache.get(field)
+    if values is None:
+      if field == 'distance':
+        lat, lon = self.location
+        values = haversine(lat, lon, self.store.column('lat')[self.slots], self.store.column('lon')[self.slots])
+      else:
+        values = self.store.column(NUMERIC_FIELDS[field])[self.slots]
+      self.cache[field] = values
+    return values
+
+  def text(self, field, key, test):
+    return self.store.text_column(TEXT_FIELDS[field]).where(key, test, self.slots)
+
+class FlightFilter(object):
+  """A compiled filter expression.
+
+  Clauses compare a field to a value and are combined with and, or, not
+  and parentheses, e.g.
+
+    altitude < 10000 and (area = flyby or distance < 5)
+    operator ~ united and route ~ SJC
+    status in landing, "taking off"
+
+  Numeric fields are altitude in feet, speed in knots, vert_rate in feet
+  per minute, track in degrees and distance in nautical miles from the
+  location, and take <, <=, >, >=, = and !=. Text fields are area, status,
+  operator, route and callsign, and take =, != and in for an exact match,
+  or ~ for one that contains the value, ignoring case. An aircraft that has
+  not reported a field never matches a clause on it.
+
+  The expression is parsed once into a tree of functions that each work on
+  whole columns, so a tick evaluates it once for every aircraft at once.
+  """
+
+  def __init__(self, text, location=None):
+    self.text = text.strip()
+    self.location = location
+    self.tokens = tokenize(self.text)
+    self.position = 0
+    self.predicate = self.parse_or()
+    if self.position < len(self.tokens):
+      raise FilterError("unexpected %r in %r" % (self.tokens[self.position][1], self.text))
+    del self.tokens
+
+  def __repr__(self):
+    return 'FlightFilter(%r)' % self.text
+
+  def mask(self, store, slots):
+    """Boolean array of which slots match."""
+    if not len(slots):
+      return np.zeros(0, dtype=bool)
+    with np.errstate(invalid='ignore'):
+      return self.predicate(FilterColumns(store, slots, self.location))
+
+  def peek(self):
+    return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+  def take(self):
+    if self.position >= len(self.tokens):
+      raise FilterError("%r ends too soon" % self.text)
+    token = self.tokens[self.position]
+    self.position += 1
+    return token
+
+  def keyword(self, word):
+    kind, value = self.peek()
+    if kind == 'word' and value.lower() == word:
+      self.position += 1
+      return True
+    return False
+
+  def parse_or(self):
+    terms = [self.parse_and()]
+    while self.keyword('or'):
+      terms.append(self.parse_and())
+    if len(terms) == 1:
+      return terms[0]
+    return lambda columns: reduce(np.logical_or, [term(columns) for term in terms])
+
+  def parse_and(self):
+    factors = [self.parse_not()]
+    while self.keyword('and'):
+      factors.append(self.parse_not())
+    if len(factors) == 1:
+      return factors[0]
+    return lambda columns: reduce(np.logical_and, [factor(columns) for factor in factors])
+
+  def parse_not(self):
+    if self.keyword('not'):
+      factor = self.parse_not()
+      return lambda columns: ~factor(columns)
+    if self.peek() == ('symbol', '('):
+      self.take()
+      expression = self.parse_or()
+      if self.take() != ('symbol', ')'):
+        raise FilterError("missing ) in %r" % self.text)
+      return expression
+    return self.parse_clause()
+
+  def parse_clause(self):
+    kind, field = self.take()
+    field = field.lower()
+    kind, operator = self.take()
+    if kind == 'word' and operator.lower() == 'in':
+      operator = 'in'
+    elif kind != 'symbol' or operator in '(),':
+      raise FilterError("expected a comparison after %r in %r" % (field, self.text))
+    if field in NUMERIC_FIELDS:
+      return self.numeric_clause(field, operator)
+    if field in TEXT_FIELDS:
+      return self.text_clause(field, operator)
+    raise FilterError("unknown field %r in %r" % (field, self.text))
+
+  def value(self):
+    kind, value = self.take()
+    if kind == 'symbol':
+      raise FilterError("expected a value, not %r, in %r" % (value, self.text))
+    return value
+
+  def numeric_clause(self, field, operator):
+    if operator not in NUMERIC_OPERATORS:
+      raise FilterError("%r can't be compared with %r" % (field, operator))
+    if field == 'distance' and self.location is None:
+      raise FilterError("distance needs a --location")
+    try:
+      value = float(self.value())
+    except ValueError:
+      raise FilterError("%r needs a number in %r" % (field, self.text))
+    compare = NUMERIC_OPERATORS[operator]
+    def clause(columns):
+      values = columns.numeric(field)
+      return compare(values, value) & ~np.isnan(values)
+    return clause
+
+  def text_clause(self, field, operator):
+    if operator not in TEXT_OPERATORS:
+      raise FilterError("%r can't be compared with %r" % (field, operator))
+    values = [folded(self.value())]
+    if operator == 'in':
+      while self.peek() == ('symbol', ','):
+        self.take()
+        values.append(folded(self.value()))
+    value = values[0]
+    if operator == '~':
+      test = lambda text: value in text
+    elif operator == 'in':
+      test = lambda text: text in values
+    elif operator == '!=':
+      test = lambda text: text != value
+    else:
+      test = lambda text: text == value
+    # each distinct text is tested once, by the column, for every filter
+    # that compares it the same way
+    key = (operator if operator != '==' else '=',) + tuple(values)
+    return lambda columns: columns.text(field, key, test)
+
+def compile_filter(text, location=None):
+  """The FlightFilter for an expression, None for an empty one. Raises
+  FilterError when it can't be read.
+  """
+  if text is None or not text.strip():
+    return None
+  return FlightFilter(text, location)
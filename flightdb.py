@@ -0,0 +1,66 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# persistent read-only access to the Virtual Radar Server sqlite databases
+from __future__ import print_function
+import os.path
+import sqlite3 as lite
+import threading
+import urllib
+
+# IN (...) lists are padded up to one of these sizes so only a handful of
+# distinct statements ever reach sqlite's prepared statement cache
+BATCH_SIZES = (1, 8, 32, 128, 500)
+
+class ReadOnlyDatabase(object):
+  """One read-only connection per thread to a sqlite file, opened with
+  mode=ro&immutable=1 where the sqlite3 module supports URIs, with memory
+  mapped I/O and a prepared statement cache.
+  """
+
+  def __init__(self, location, mmap_size=64 * 1024 * 1024, cached_statements=64):
+    self.location = location
+    self.mmap_size = mmap_size
+    self.cached_statements = cached_statements
+    self.local = threading.local()
+    self.opened = 0
+
+  def connection(self):
+    con = getattr(self.local, 'con', None)
+    if con is None:
+      uri = 'file:%s?mode=ro&immutable=1' % urllib.quote(self.location)
+      try:
+        con = lite.connect(uri, uri=True, cached_statements=self.cached_statements)
+      except TypeError: #no uri support before python 3.4
+        if not os.path.isfile(self.location): #connect() would create it
+          raise lite.OperationalError("unable to open database file %s" % self.location)
+        con = lite.connect(self.location, cached_statements=self.cached_statements)
+        con.execute("PRAGMA query_only = ON")
+      con.execute("PRAGMA mmap_size = %d" % self.mmap_size)
+      self.local.con = con
+      self.opened += 1
+    return con
+
+  def select_in(self, select, column, values):
+    """Run `select WHERE column IN (...)` over values in as few statements as
+    possible, yielding every row.
+    """
+    values = list(values)
+    con = self.connection()
+    while values:
+      chunk, values = values[:BATCH_SIZES[-1]], values[BATCH_SIZES[-1]:]
+      size = next(size for size in BATCH_SIZES if size >= len(chunk))
+      chunk += [chunk[-1]] * (size - len(chunk))
+      sql = "%s WHERE %s IN (%s)" % (select, column, ','.join('?' * size))
+      for row in con.execute(sql, chunk):
+        yield row
+
+_databases = {}
+
+def database_for(location):
+  """Shared ReadOnlyDatabase for a sqlite file."""
+  db = _databases.get(location)
+  if db is None:
+    db = ReadOnlyDatabase(location)
+    _databases[location] = db
+  return db
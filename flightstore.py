@@ -0,0 +1,296 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# columnar store of the aircraft being tracked, keyed by ICAO hex
+from __future__ import print_function
+import numpy as np
+
+from spatial import GridIndex
+
+# numeric telemetry, one float64 column each with NaN for "not reported".
+# position_time is when lat/lon last changed, on the Flyover's clock (the
+# recording's time when replaying).
+COLUMNS = ('lat', 'lon', 'altitude', 'track', 'speed', 'vert_rate', 'seen', 'position_time')
+
+# read back as ints, the way dump1090 reports them
+INTEGER_COLUMNS = frozenset(['altitude', 'track', 'speed', 'vert_rate'])
+
+# everything else the app sets on an aircraft, kept on its FlightRecord
+RECORD_FIELDS = ('hex', 'flight', 'squawk', 'area', 'status', 'plan',
+  'planeType', 'typeName', 'planeRegistration', 'OperatorName',
+  'FromAirportName', 'FromAirportLocation', 'FromAirportCountry', 'FromAirportLongitude', 'FromAirportLatitude',
+  'ToAirportName', 'ToAirportLocation', 'ToAirportCountry', 'ToAirportLongitude', 'ToAirportLatitude',
+  'FlightNumber')
+
+# record fields also kept as TextColumns, so the filters can compare them
+# for every aircraft at once
+TEXT_COLUMNS = ('flight', 'area', 'status', 'plan', 'OperatorName')
+
+_column_set = frozenset(COLUMNS)
+_record_set = frozenset(RECORD_FIELDS)
+_text_set = frozenset(TEXT_COLUMNS)
+_unset = object()
+
+def folded(value):
+  """value stripped and lower-cased as unicode, the way TextColumn keeps it."""
+  if value is None:
+    return None
+  if isinstance(value, str):
+    value = value.decode('utf-8', 'replace')
+  elif not isinstance(value, unicode):
+    value = unicode(value)
+  return value.strip().lower()
+
+class TextColumn(object):
+  """A text field of every slot, case-folded and dictionary encoded.
+
+  codes holds the index in words of each slot's value, -1 where it was not
+  reported. Words are only ever added, so a code keeps its meaning and what
+  a test made of the words so far stays true: where() tests each new word
+  once and then answers for any number of slots with one array lookup.
+  There are few distinct areas, statuses, operators and routes, and the
+  callsigns repeat from day to day.
+  """
+
+  def __init__(self, capacity):
+    self.codes = np.full(capacity, -1, dtype=np.int32)
+    self.words = []
+    self.index = {}
+    # key -> which words the test passed, with a False for code -1 at the end
+    self.accepted = {}
+
+  def grow(self, capacity):
+    codes = np.full(capacity, -1, dtype=np.int32)
+    codes[:len(self.codes)] = self.codes
+    self.codes = codes
+
+  def set(self, slot, value):
+    value = folded(value)
+    if value is None:
+      self.codes[slot] = -1
+      return
+    code = self.index.get(value)
+    if code is None:
+      code = len(self.words)
+      self.index[value] = code
+      self.words.append(value)
+    self.codes[slot] = code
+
+  def where(self, key, test, slots):
+    """Boolean array of which slots have a value test passes. key names the
+    test, so its results for the words seen so far can be kept.
+    """
+    accepted = self.accepted.get(key)
+    checked = 0 if accepted is None else len(accepted) - 1
+    if checked < len(self.words):
+      new = np.fromiter((test(word) for word in self.words[checked:]), dtype=bool, count=len(self.words) - checked)
+      accepted = np.concatenate((new if accepted is None else np.concatenate((accepted[:-1], new)), [False]))
+      self.accepted[key] = accepted
+    elif accepted is None:
+      accepted = np.zeros(1, dtype=bool)
+    return accepted[self.codes[slots]]
+
+class FlightRecord(object):
+  """One aircraft in a FlightStore. It reads like the dict it replaces:
+  telemetry comes from the store's columns, the strings live in slots and
+  anything dump1090 sends that is not listed goes to extra.
+  """
+  __slots__ = ('store', 'slot', 'extra') + RECORD_FIELDS
+
+  def __init__(self, store, slot):
+    self.store = store
+    self.slot = slot
+    self.extra = None
+    for name in RECORD_FIELDS:
+      setattr(self, name, _unset)
+
+  def get(self, name, default=None):
+    if name in _column_set:
+      value = self.store.columns[name][self.slot]
+      if value != value: #NaN
+        return default
+      return int(value) if name in INTEGER_COLUMNS else float(value)
+    if name in _record_set:
+      value = getattr(self, name)
+      return default if value is _unset else value
+    if self.extra is None:
+      return default
+    return self.extra.get(name, default)
+
+  def __getitem__(self, name):
+    value = self.get(name, _unset)
+    if value is _unset:
+      raise KeyError(name)
+    return value
+
+  def __contains__(self, name):
+    return self.get(name, _unset) is not _unset
+
+  def __setitem__(self, name, value):
+    if name in _column_set:
+      self.store.columns[name][self.slot] = np.nan if value is None else value
+    elif name in _record_set:
+      if name == 'flight':
+        self.store.index_callsign(self, value)
+      if name in _text_set:
+        self.store.texts[name].set(self.slot, value)
+      setattr(self, name, value)
+    else:
+      if self.extra is None:
+        self.extra = {}
+      self.extra[name] = value
+
+  def update(self, fields=(), **kwargs):
+    for name, value in dict(fields, **kwargs).iteritems():
+      self[name] = value
+
+  def keys(self):
+    return [name for name in COLUMNS + RECORD_FIELDS if name in self] + (self.extra.keys() if self.extra else [])
+
+  def iteritems(self):
+    for name in self.keys():
+      yield name, self[name]
+
+  def copy(self):
+    """A plain dict of the aircraft, e.g. to publish it to another thread."""
+    return dict(self.iteritems())
+
+  def __repr__(self):
+    return repr(self.copy())
+
+class FlightStore(object):
+  """Aircraft keyed by ICAO hex, with the numeric telemetry in preallocated
+  NumPy columns so the vectorized code can work on whole columns.
+
+  Each aircraft owns a slot, a row of the columns. Slots of aircraft that
+  went away are reused from a free list and the columns only grow, by
+  doubling, when every slot is taken, so memory stays flat for a steady
+  sky. Also keeps an index of the stripped callsigns, a GridIndex of the
+  positions for the nearest and within queries and a TextColumn of each of
+  the TEXT_COLUMNS for the filters.
+  """
+
+  def __init__(self, capacity=256):
+    self.capacity = capacity
+    self.columns = dict((name, np.full(capacity, np.nan)) for name in COLUMNS)
+    self.texts = dict((name, TextColumn(capacity)) for name in TEXT_COLUMNS)
+    self.records = [None] * capacity
+    self.slots = {}
+    self.free = range(capacity - 1, -1, -1)
+    self.callsigns = {}
+    self.index = GridIndex(capacity=capacity)
+
+  def grow(self):
+    capacity = self.capacity * 2
+    for name in COLUMNS:
+      column = np.full(capacity, np.nan)
+      column[:self.capacity] = self.columns[name]
+      self.columns[name] = column
+    for texts in self.texts.itervalues():
+      texts.grow(capacity)
+    self.records.extend([None] * (capacity - self.capacity))
+    self.free.extend(range(capacity - 1, self.capacity - 1, -1))
+    self.index.ensure(capacity)
+    self.capacity = capacity
+
+  def __len__(self):
+    return len(self.slots)
+
+  def __contains__(self, key):
+    return key in self.slots
+
+  def __iter__(self):
+    return iter(self.slots)
+
+  def __getitem__(self, key):
+    return self.records[self.slots[key]]
+
+  def get(self, key, default=None):
+    slot = self.slots.get(key)
+    return default if slot is None else self.records[slot]
+
+  def __setitem__(self, key, fields):
+    """Add an aircraft, or replace one, from a dict of its fields."""
+    if key in self.slots:
+      del self[key]
+    if not self.free:
+      self.grow()
+    slot = self.free.pop()
+    record = FlightRecord(self, slot)
+    self.records[slot] = record
+    self.slots[key] = slot
+    record.hex = key
+    record.update(fields)
+
+  def __delitem__(self, key):
+    slot = self.slots.pop(key)
+    record = self.records[slot]
+    self.index_callsign(record, None)
+    self.index.discard(slot)
+    self.records[slot] = None
+    for column in self.columns.itervalues():
+      column[slot] = np.nan
+    for texts in self.texts.itervalues():
+      texts.codes[slot] = -1
+    self.free.append(slot)
+
+  def keys(self):
+    return self.slots.keys()
+
+  def iterkeys(self):
+    return self.slots.iterkeys()
+
+  def itervalues(self):
+    for slot in self.slots.itervalues():
+      yield self.records[slot]
+
+  def iteritems(self):
+    for key, slot in self.slots.iteritems():
+      yield key, self.records[slot]
+
+  def column(self, name):
+    """The whole column for a field, indexed by slot. Free slots are NaN."""
+    return self.columns[name]
+
+  def text_column(self, name):
+    """The TextColumn of a text field."""
+    return self.texts[name]
+
+  def occupied(self):
+    """Array of the slots in use."""
+    return np.fromiter(self.slots.itervalues(), dtype=np.intp, count=len(self.slots))
+
+  def slots_for(self, keys):
+    """Array of the slots of keys, to index the columns with."""
+    return np.fromiter((self.slots[key] for key in keys), dtype=np.intp, count=len(keys))
+
+  def reindex(self, keys):
+    """Move keys to their current positions in the spatial index, after
+    their lat/lon changed.
+    """
+    slots = self.slots_for(keys)
+    self.index.update(slots, self.columns['lat'][slots], self.columns['lon'][slots])
+
+  def nearest(self, lat, lon, k=1):
+    """[(distance in nm, record)] of the k aircraft nearest (lat, lon), nearest first."""
+    slots, distances = self.index.nearest(lat, lon, k, self.columns['lat'], self.columns['lon'])
+    return [(distance, self.records[slot]) for slot, distance in zip(slots.tolist(), distances.tolist())]
+
+  def within(self, lat, lon, radius):
+    """[(distance in nm, record)] of the aircraft within radius nm of (lat, lon), nearest first."""
+    slots, distances = self.index.within(lat, lon, radius, self.columns['lat'], self.columns['lon'])
+    return [(distance, self.records[slot]) for slot, distance in zip(slots.tolist(), distances.tolist())]
+
+  def index_callsign(self, record, callsign):
+    old = record.get('flight')
+    if old is not None and self.callsigns.get(old.strip()) is record:
+      del self.callsigns[old.strip()]
+    if callsign is not None:
+      self.callsigns[callsign.strip()] = record
+
+  def for_callsign(self, callsign):
+    """The aircraft with a callsign, ignoring padding, or None."""
+    return self.callsigns.get(callsign.strip())
+
+  def __repr__(self):
+    return repr(dict((key, record.copy()) for key, record in self.iteritems()))
@@ -0,0 +1,149 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# the flyby.geojson zones, loaded once and reloaded only when the file changes
+from __future__ import print_function
+import os
+import time
+from collections import namedtuple
+from os import path
+from sys import stderr
+
+import geojson
+import numpy as np
+from shapely.geometry import Point, shape
+from shapely.prepared import prep
+
+# rings holds every exterior and interior ring of the zone as an (n, 2) array
+# of lon, lat so the even-odd rule takes care of holes and multipolygons
+Zone = namedtuple('Zone', ['name', 'priority', 'bounds', 'rings', 'prepared'])
+
+def geometry_rings(geometry):
+  """All rings of a Polygon or MultiPolygon geojson geometry as arrays."""
+  if geometry["type"] == "Polygon":
+    polygons = [geometry["coordinates"]]
+  elif geometry["type"] == "MultiPolygon":
+    polygons = geometry["coordinates"]
+  else:
+    return []
+  return [np.asarray(ring, dtype=np.float64)[:, :2] for polygon in polygons for ring in polygon]
+
+def points_in_rings(rings, lon, lat):
+  """Vectorized even-odd point in polygon test of lon, lat arrays."""
+  inside = np.zeros(lon.shape, dtype=bool)
+  px = lon[np.newaxis, :]
+  py = lat[np.newaxis, :]
+  for ring in rings:
+    xi = ring[:-1, 0:1]
+    yi = ring[:-1, 1:2]
+    xj = ring[1:, 0:1]
+    yj = ring[1:, 1:2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+      crosses = ((yi > py) != (yj > py)) & (px < (xj - xi) * (py - yi) / (yj - yi) + xi)
+    inside ^= (np.count_nonzero(crosses, axis=0) % 2).astype(bool)
+  return inside
+
+class Geofence(object):
+  """The features of a geojson file as named zones.
+
+  Zones are tried in priority order: a feature's "priority" property, lowest
+  first, then the order of the file. classify() assigns a zone to whole
+  arrays of positions at once, contains() answers for a single point with a
+  bounding box test followed by a prepared geometry. The file is stat()ed at
+  most every check_interval seconds and re-parsed only when its mtime moved.
+  """
+
+  def __init__(self, area_geojson_location, check_interval=1.0):
+    self.location = path.expanduser(area_geojson_location)
+    self.check_interval = check_interval
+    self.zones = []
+    self.by_name = {}
+    self.mtime = None
+    self.checked = 0
+    self.missing = False
+    self.reload_if_changed(force=True)
+
+  def load(self):
+    with open(self.location, 'r') as geo:
+      features = geojson.loads(geo.read())["features"]
+    zones = []
+    for index, feature in enumerate(features):
+      properties = feature.get("properties") or {}
+      geometry = shape(feature["geometry"])
+      zones.append(Zone(properties.get("name", "zone_%d" % index),
+                        (properties.get("priority", 0), index),
+                        geometry.bounds,
+                        geometry_rings(feature["geometry"]),
+                        prep(geometry)))
+    zones.sort(key=lambda zone: zone.priority)
+    self.zones = zones
+    self.by_name = dict((zone.name, zone) for zone in zones)
+
+  def reload_if_changed(self, force=False):
+    now = time.time()
+    if not force and now - self.checked < self.check_interval:
+      return
+    self.checked = now
+    try:
+      mtime = os.stat(self.location).st_mtime
+      if mtime != self.mtime:
+        self.load()
+        self.mtime = mtime
+        self.missing = False
+    except (IOError, OSError):
+      if not self.missing:
+        print("couldn't find geojson file at %s, ignoring" % self.location, file=stderr)
+      self.missing = True
+      self.zones = []
+      self.by_name = {}
+      self.mtime = None
+
+  @property
+  def zone_names(self):
+    self.reload_if_changed()
+    return [zone.name for zone in self.zones]
+
+  def contains(self, name, lon, lat):
+    """Is lon, lat inside the named zone?"""
+    self.reload_if_changed()
+    zone = self.by_name.get(name)
+    if zone is None:
+      return False
+    minx, miny, maxx, maxy = zone.bounds
+    if lon < minx or lon > maxx or lat < miny or lat > maxy:
+      return False
+    return zone.prepared.contains(Point(lon, lat))
+
+  def classify(self, lon, lat, default='hidden'):
+    """Return an array with the name of the first zone, by priority, that
+    holds each lon, lat pair, or default for points outside every zone.
+    """
+    self.reload_if_changed()
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    names = np.empty(lon.shape, dtype=object)
+    names.fill(default)
+    unassigned = np.ones(lon.shape, dtype=bool)
+    for zone in self.zones:
+      minx, miny, maxx, maxy = zone.bounds
+      candidates = np.flatnonzero(unassigned & (lon >= minx) & (lon <= maxx) & (lat >= miny) & (lat <= maxy))
+      if not len(candidates):
+        continue
+      hits = candidates[points_in_rings(zone.rings, lon[candidates], lat[candidates])]
+      names[hits] = zone.name
+      unassigned[hits] = False
+      if not unassigned.any():
+        break
+    return names
+
+_geofences = {}
+
+def geofence_for(area_geojson_location):
+  """Shared Geofence for a path, or None when no area file is configured."""
+  if not area_geojson_location:
+    return None
+  fence = _geofences.get(area_geojson_location)
+  if fence is None:
+    fence = Geofence(area_geojson_location)
+    _geofences[area_geojson_location] = fence
+  return fence
@@ -4,5 +4,7 @@
 # wget -q -O FlightNumbers.csv -nc http://www.virtualradarserver.co.uk/Files/FlightNumbers.csv
 
 #my way
-curl -O http://www.virtualradarserver.co.uk/Files/FlightNumbers.csv
-#grep KSJC FlightNumbers.csv > KSJCFlights.csv
\ No newline at end of file
+#download next to the old file and swap it in, the running app rebuilds its
+#route index when it sees the new file
+curl -o FlightNumbers.csv.part http://www.virtualradarserver.co.uk/Files/FlightNumbers.csv && mv FlightNumbers.csv.part FlightNumbers.csv
+#grep KSJC FlightNumbers.csv > KSJCFlights.csv
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# background poller that owns the Flyover and keeps dump1090 off the render loop
+from __future__ import print_function
+import threading
+import time
+import traceback
+from collections import namedtuple
+from sys import stderr
+from timeit import default_timer as timer
+
+import metrics
+from all_nearest_planes import Flyover, createDefaultsArgs
+from merge import EMPTY_DELTA, is_empty
+
+# an immutable view of the sky at one point in time, timestamped by the
+# Flyover's clock. flights maps the ICAO hex to a dict that is never mutated
+# after it has been published, delta is what changed since the previous version.
+FlightSnapshot = namedtuple('FlightSnapshot', ['version', 'timestamp', 'flights', 'delta'])
+
+EMPTY_SNAPSHOT = FlightSnapshot(0, 0.0, {}, EMPTY_DELTA)
+
+poll_seconds = metrics.stage('poll')
+publish_seconds = metrics.stage('publish')
+
+class FlightPoller(threading.Thread):
+  """Polls dump1090 on its own thread and publishes FlightSnapshots.
+
+  Readers call latest() which only swaps a reference, so the render loop
+  never waits on the receiver, the merge or the enrichment lookups.
+  """
+
+  def __init__(self, options=None, interval=None, flyover=None):
+    threading.Thread.__init__(self, name='FlightPoller')
+    self.daemon = True
+    self.options = options if options is not None else createDefaultsArgs()
+    self.interval = interval
+    self.flyover = flyover if flyover is not None else Flyover()
+    self._snapshot = EMPTY_SNAPSHOT
+    self._stop_event = threading.Event()
+    metrics.REGISTRY.collector('flyover', self.flyover.collect_metrics)
+    self.polls = metrics.counter('flyby_polls_total', 'Polls of the receivers', result='published')
+    self.idle_polls = metrics.counter('flyby_polls_total', 'Polls of the receivers', result='unchanged')
+
+  def latest(self):
+    """Return the most recently published snapshot without blocking."""
+    return self._snapshot
+
+  def poll_once(self):
+    """Fetch and merge once, then publish the changes as a new snapshot.
+
+    Aircraft that did not change keep the dict of the previous snapshot, so
+    only the delta is copied. Nothing is published when nothing changed.
+    """
+    with poll_seconds.time():
+      flights = self.flyover.get_nearest_airplane(self.options) or {}
+    delta = self.flyover.last_delta
+    previous = self._snapshot
+    if is_empty(delta):
+      self.idle_polls.inc()
+      return previous
+    started = timer()
+    frozen = dict(previous.flights)
+    for key in delta.removed:
+      frozen.pop(key, None)
+    for key in delta.added:
+      frozen[key] = dict(flights[key])
+    for key in delta.updated:
+      frozen[key] = dict(flights[key])
+    self._snapshot = FlightSnapshot(previous.version + 1, self.flyover.now(), frozen, delta)
+    publish_seconds.observe(timer() - started)
+    self.polls.inc()
+    return self._snapshot
+
+  def run(self):
+    while not self._stop_event.is_set():
+      started = time.time()
+      try:
+        self.poll_once()
+      except Exception:
+        print("flight poll failed", file=stderr)
+        traceback.print_exc()
+      self._stop_event.wait(max(0.0, self.next_delay() - (time.time() - started)))
+    # stopped, let the receivers go and finish any recording
+    self.flyover.close()
+
+  def next_delay(self):
+    # a fixed interval wins, otherwise follow the client's adaptive rate
+    if self.interval is not None:
+      return self.interval
+    return self.flyover.poll_delay(self.options)
+
+  def stop(self):
+    self._stop_event.set()
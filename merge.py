@@ -0,0 +1,53 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# change-detecting merge of dump1090 aircraft into the flight dictionary
+from __future__ import print_function
+from collections import namedtuple
+
+# added and removed are lists of ICAO hex codes, updated maps each hex code to
+# the set of fields that actually changed value
+FlightDelta = namedtuple('FlightDelta', ['added', 'updated', 'removed'])
+
+EMPTY_DELTA = FlightDelta((), {}, ())
+
+# fields that change on every message without saying anything about the
+# aircraft, they are kept current but never reported as a change
+VOLATILE_FIELDS = frozenset(['seen', 'messages'])
+
+POSITION_FIELDS = frozenset(['lat', 'lon'])
+
+def is_empty(delta):
+  return not (delta.added or delta.updated or delta.removed)
+
+def merge_flights(current, incoming, max_seen=60):
+  """Merge incoming aircraft into current in place and return a FlightDelta.
+
+  Both are dicts keyed by ICAO hex. Aircraft dump1090 has not heard from for
+  max_seen seconds are removed, and new ones that are already that stale
+  are never added. Known aircraft only have their changed fields written.
+  """
+  added = []
+  updated = {}
+  removed = []
+  for key, value in incoming.iteritems():
+    last_data = current.get(key)
+    if last_data is None:
+      if value.get('seen', 0) < max_seen:
+        current[key] = dict(value)
+        added.append(key)
+    elif value.get('seen', 0) > max_seen:
+      del current[key]
+      removed.append(key)
+    else:
+      changed = None
+      for m_key, m_value in value.iteritems():
+        if last_data.get(m_key) != m_value:
+          last_data[m_key] = m_value
+          if m_key not in VOLATILE_FIELDS:
+            if changed is None:
+              changed = set()
+            changed.add(m_key)
+      if changed:
+        updated[key] = changed
+  return FlightDelta(added, updated, removed)
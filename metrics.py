@@ -0,0 +1,227 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# counters and histograms of the pipeline stages, served as Prometheus text
+from __future__ import print_function
+import BaseHTTPServer
+import SocketServer
+import bisect
+import threading
+from timeit import default_timer as timer
+
+import numpy as np
+
+# seconds, from an in-memory merge up to a slow fetch
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# observations a histogram keeps for recent_percentile, e.g. for the overlay
+RECENT = 128
+
+class Counter(object):
+  kind = 'counter'
+
+  def __init__(self):
+    self.value = 0
+
+  def inc(self, amount=1):
+    self.value += amount
+
+  def samples(self, name, labels):
+    return [(name, labels, self.value)]
+
+class Gauge(object):
+  kind = 'gauge'
+
+  def __init__(self):
+    self.value = 0.0
+
+  def set(self, value):
+    self.value = value
+
+  def samples(self, name, labels):
+    return [(name, labels, self.value)]
+
+class Timer(object):
+  # with histogram.time(): observes how long the block took
+  __slots__ = ('histogram', 'started')
+
+  def __init__(self, histogram):
+    self.histogram = histogram
+
+  def __enter__(self):
+    self.started = timer()
+    return self
+
+  def __exit__(self, *exc_info):
+    self.histogram.observe(timer() - self.started)
+
+class Histogram(object):
+  """Cumulative bucket counts with their sum, as Prometheus expects, plus
+  the last RECENT observations for percentiles over the recent past.
+  """
+  kind = 'histogram'
+
+  def __init__(self, buckets=TIME_BUCKETS):
+    self.buckets = tuple(buckets)
+    self.counts = [0] * (len(self.buckets) + 1)
+    self.sum = 0.0
+    self.count = 0
+    self.recent = [0.0] * RECENT
+    self.lock = threading.Lock()
+
+  def observe(self, value):
+    with self.lock:
+      self.counts[bisect.bisect_left(self.buckets, value)] += 1
+      self.recent[self.count % RECENT] = value
+      self.sum += value
+      self.count += 1
+
+  def time(self):
+    return Timer(self)
+
+  def recent_percentile(self, percentile):
+    """The percentile of the last RECENT observations, None before any."""
+    with self.lock:
+      recent = self.recent[:min(self.count, RECENT)]
+    if not recent:
+      return None
+    return float(np.percentile(recent, percentile))
+
+  def samples(self, name, labels):
+    with self.lock:
+      counts, total, count = list(self.counts), self.sum, self.count
+    samples = []
+    cumulative = 0
+    for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+      cumulative += bucket
+      samples.append((name + '_bucket', labels + (('le', format_value(bound)),), cumulative))
+    samples.append((name + '_sum', labels, total))
+    samples.append((name + '_count', labels, count))
+    return samples
+
+def format_value(value):
+  if value == float('inf'):
+    return '+Inf'
+  if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+    return '%d' % value
+  return repr(value)
+
+def format_labels(labels):
+  if not labels:
+    return ''
+  return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels)
+
+class Registry(object):
+  """The metrics of the app, keyed by name and labels.
+
+  Stages record into counters and histograms they fetch once, stats that
+  are already kept elsewhere are read when the metrics are, by collectors.
+  """
+
+  def __init__(self):
+    self.metrics = {}
+    self.families = {}
+    self.collectors = {}
+    self.lock = threading.Lock()
+
+  def get(self, kind, name, help, labels, **kwargs):
+    key = (name, tuple(sorted(labels.iteritems())))
+    metric = self.metrics.get(key)
+    if metric is None:
+      with self.lock:
+        metric = self.metrics.get(key)
+        if metric is None:
+          metric = kind(**kwargs)
+          self.families.setdefault(name, (kind.kind, help))
+          self.metrics[key] = metric
+    return metric
+
+  def counter(self, name, help, **labels):
+    return self.get(Counter, name, help, labels)
+
+  def gauge(self, name, help, **labels):
+    return self.get(Gauge, name, help, labels)
+
+  def histogram(self, name, help, buckets=TIME_BUCKETS, **labels):
+    return self.get(Histogram, name, help, labels, buckets=buckets)
+
+  def collector(self, name, function):
+    """Call function whenever the metrics are read. It returns
+    (name, kind, help, labels dict, value) tuples. A later collector with
+    the same name replaces the earlier one.
+    """
+    self.collectors[name] = function
+
+  def collect(self):
+    """{name: (kind, help, [(sample name, labels, value)])} of everything."""
+    families = {}
+    for (name, labels), metric in self.metrics.items():
+      kind, help = self.families[name]
+      families.setdefault(name, (kind, help, []))[2].extend(metric.samples(name, labels))
+    for function in self.collectors.values():
+      for name, kind, help, labels, value in function():
+        families.setdefault(name, (kind, help, []))[2].append((name, tuple(sorted(labels.iteritems())), value))
+    return families
+
+  def render(self):
+    """Every metric in the Prometheus text exposition format."""
+    lines = []
+    for name, (kind, help, samples) in sorted(self.collect().iteritems()):
+      lines.append('# HELP %s %s' % (name, help))
+      lines.append('# TYPE %s %s' % (name, kind))
+      for sample, labels, value in samples:
+        lines.append('%s%s %s' % (sample, format_labels(labels), format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+def stage(name):
+  """The histogram of the seconds spent in a stage of the pipeline."""
+  return REGISTRY.histogram('flyby_stage_seconds', 'Seconds spent in each stage of the pipeline', stage=name)
+
+def counter(name, help, **labels):
+  return REGISTRY.counter(name, help, **labels)
+
+def gauge(name, help, **labels):
+  return REGISTRY.gauge(name, help, **labels)
+
+def histogram(name, help, buckets=TIME_BUCKETS, **labels):
+  return REGISTRY.histogram(name, help, buckets, **labels)
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  def do_GET(self):
+    if self.path.split('?')[0] not in ('/', '/metrics'):
+      self.send_error(404)
+      return
+    body = self.server.registry.render()
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+class MetricsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """Serves a Registry at /metrics from a daemon thread."""
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def __init__(self, address, registry=REGISTRY):
+    BaseHTTPServer.HTTPServer.__init__(self, address, MetricsHandler)
+    self.registry = registry
+    thread = threading.Thread(target=self.serve_forever, name='MetricsServer')
+    thread.daemon = True
+    thread.start()
+
+_servers = {}
+
+def serve(port, registry=REGISTRY):
+  """Serve the metrics on localhost:port, once however often it is called."""
+  server = _servers.get(port)
+  if server is None:
+    server = MetricsServer(('127.0.0.1', port), registry)
+    _servers[port] = server
+    print("metrics at http://localhost:%d/metrics" % port)
+  return server
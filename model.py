@@ -32,20 +32,39 @@ from shapely.geometry import Point, Polygon, LineString
 access_token='YOUR API KEY'
 service = Static(access_token=access_token)
 
-from all_nearest_planes import Flyover
+from ingest import FlightPoller, EMPTY_SNAPSHOT
+from merge import POSITION_FIELDS
+from deadreckoning import DeadReckoner
+import metrics
 import os.path
+import time
 import ui_flyby
 
+reckon_seconds = metrics.stage('reckon')
+
 class UIFlyByModel(object):
-	def __init__(self, width, height):
+	def __init__(self, width, height, poller=None):
 		"""Create main FreqShow application model.  Must provide the width and
-		height of the screen in pixels.
+		height of the screen in pixels.  A FlightPoller can be passed in, it is
+		then left to the caller to start it or drive its poll_once().
 		"""
 		# Set properties that will be used by views.
 		self.width = width
 		self.height = height
-		self.flyover = Flyover()
+		if poller is None:
+			poller = FlightPoller()
+			poller.start()
+		self.poller = poller
+		self.flyover = self.poller.flyover
+		self.snapshot = EMPTY_SNAPSHOT
 		self.all_flights = {}
+		self.flights_version = 0
+		# Seconds between taking new snapshots from the poller, 0 takes
+		# the latest whenever the views ask.
+		self.refresh_interval = 0
+		self.refreshed = 0
+		# On the flyover's clock, which is the recording's when replaying.
+		self.reckoner = DeadReckoner(clock=self.flyover.now)
 		self.map_folder = "_vect"
 		self.center_lon = -122.185724
 		self.center_lat = 37.617190
@@ -53,13 +72,70 @@ class UIFlyByModel(object):
 		self.tile_zoomed_out = 9
 		self.tile_dimension = 256
 		self.map_folder = "_vect"
+		# Off to only draw the tiles already on disk, e.g. headless.
+		self.download_tiles = True
+
+	def refresh(self, now=None):
+		"""Take the poller's latest snapshot once refresh_interval has passed
+		since the last one, never blocks on dump1090.  Returns True when it
+		added, removed or moved aircraft.
+		"""
+		if now is None:
+			now = time.time()
+		if now - self.refreshed < self.refresh_interval:
+			return False
+		self.refreshed = now
+		snapshot = self.poller.latest()
+		previous = self.snapshot
+		if snapshot.version == previous.version:
+			return False
+		self.snapshot = snapshot
+		self.all_flights = snapshot.flights
+		self.flights_version = snapshot.version
+		delta = snapshot.delta
+		# Deltas skipped in between are not known, assume they moved something.
+		return (snapshot.version != previous.version + 1 or bool(delta.added)
+			or bool(delta.removed)
+			or any(changed & POSITION_FIELDS for changed in delta.updated.itervalues()))
 
 	def get_flights(self):
-		self.all_flights = self.flyover.get_nearest_airplane('')
+		# The snapshot of the last refresh.
+		if not self.refresh_interval:
+			self.refresh()
 		return self.all_flights
 
+	def get_positions(self):
+		# Where each aircraft should be drawn this frame, as
+		# (lat, lon, altitude) keyed by hex, extrapolated from its last fix.
+		if not self.refresh_interval:
+			self.refresh()
+		with reckon_seconds.time():
+			self.reckoner.update(self.snapshot)
+			return self.reckoner.by_key()
+
+	def set_visible(self, keys):
+		self.flyover.set_visible(keys)
+
+	def filter_text(self):
+		# The expression aircraft are filtered with, None when they all show.
+		flight_filter = self.flyover.filter
+		return flight_filter.text if flight_filter is not None else None
+
+	def set_filter(self, text):
+		# Applied by the poller from its next poll, raises FilterError.
+		self.flyover.set_filter(text, self.poller.options)
+
+	def flight_for_callsign(self, callsign):
+		# The store indexes callsigns, the snapshot has the published copy.
+		record = self.flyover.flights_dict.for_callsign(callsign)
+		if record is None:
+			return None
+		return self.get_flights().get(record.hex)
+
 	#This is for satellite images
 	def getSatelliteImage(self, lat, lon, z, x, y):
+		if not self.download_tiles:
+			return
 		#first create an empty file to mark it so the request is not sent twice
 		directory = os.path.join(os.path.dirname(__file__),"map_images_{}{}".format(z, self.map_folder))
 		if not os.path.exists(directory):
@@ -72,6 +148,8 @@ class UIFlyByModel(object):
 
 	#This is for satellite images
 	def getStreetImage(self, lat, lon, z, x, y):
+		if not self.download_tiles:
+			return
 		#first create an empty file to mark it so the request is not sent twice
 		directory = os.path.join(os.path.dirname(__file__),"map_images_{}{}".format(z, self.map_folder))
 		if not os.path.exists(directory):
@@ -96,6 +174,14 @@ class UIFlyByModel(object):
 		y = ((1.0 - math.log(math.tan(lat_rad) + (1 / math.cos(lat_rad))) / math.pi) / 2.0 * n)
 		return (x, y)
 
+	def deg2PixelArray(self, lat_deg, lon_deg, zoom):
+		# deg2RawNum for arrays of points, in pixels, as an (n, 2) array.
+		lat_rad = np.radians(lat_deg)
+		n = 2.0 ** zoom * self.tile_dimension
+		x = (lon_deg + 180.0) / 360.0 * n
+		y = (1.0 - np.log(np.tan(lat_rad) + (1 / np.cos(lat_rad))) / math.pi) / 2.0 * n
+		return np.column_stack((x, y))
+
 	def getOffset(self, lat_deg, lon_deg, zoom):
 		lat_rad = math.radians(lat_deg)
 		n = 2.0 ** zoom
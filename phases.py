@@ -0,0 +1,111 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# flight phase of every aircraft from smoothed altitude and vertical rate, as arrays
+from __future__ import print_function
+import numpy as np
+
+UNKNOWN, CRUISING, LOW_CRUISE, CLIMBING, DESCENDING, TAKING_OFF, LANDING = range(-1, 6)
+
+PHASE_NAMES = {
+  CRUISING: 'cruising',
+  LOW_CRUISE: 'low cruise',
+  CLIMBING: 'climbing',
+  DESCENDING: 'descending',
+  TAKING_OFF: 'taking off',
+  LANDING: 'landing',
+}
+
+# a new value of either is a new sample for the smoothing
+SAMPLED_FIELDS = frozenset(['altitude', 'vert_rate'])
+
+# the app's areas where climbing means taking off and descending means landing
+APPROACH_AREAS = frozenset(['north_flow', 'south_flow'])
+
+class PhaseEngine(object):
+  """Keeps the flight phase of every aircraft in a FlightStore current.
+
+  Altitude and vertical rate are averaged over the last window samples of
+  each aircraft, in arrays indexed by the store's slots. An aircraft only
+  enters a phase past its threshold and only leaves it once it is back
+  past the threshold by the hysteresis margin, so the status does not
+  flicker around the thresholds.
+
+  Below low_altitude and faster than min_speed, an aircraft climbing faster
+  than climb_rate is climbing, or taking off in an approach area, and one
+  descending faster than descent_rate is descending, or landing. Otherwise
+  it is in low cruise. Anything else is cruising.
+  """
+
+  def __init__(self, window=5, low_altitude=10000, altitude_hysteresis=500,
+      climb_rate=1000, descent_rate=-1000, rate_hysteresis=300, min_speed=100):
+    self.window = window
+    self.low_altitude = low_altitude
+    self.altitude_hysteresis = altitude_hysteresis
+    self.climb_rate = climb_rate
+    self.descent_rate = descent_rate
+    self.rate_hysteresis = rate_hysteresis
+    self.min_speed = min_speed
+    self.capacity = 0
+    self.altitudes = np.empty((0, window))
+    self.vert_rates = np.empty((0, window))
+    self.heads = np.empty(0, dtype=np.intp)
+    self.phase = np.empty(0, dtype=np.int8)
+    self.approach = np.empty(0, dtype=bool)
+
+  def ensure(self, capacity):
+    # grow along with the store's columns
+    if capacity <= self.capacity:
+      return
+    extra = capacity - self.capacity
+    self.altitudes = np.vstack((self.altitudes, np.full((extra, self.window), np.nan)))
+    self.vert_rates = np.vstack((self.vert_rates, np.full((extra, self.window), np.nan)))
+    self.heads = np.concatenate((self.heads, np.zeros(extra, dtype=np.intp)))
+    self.phase = np.concatenate((self.phase, np.full(extra, UNKNOWN, dtype=np.int8)))
+    self.approach = np.concatenate((self.approach, np.zeros(extra, dtype=bool)))
+    self.capacity = capacity
+
+  def reset(self, slots):
+    """Forget the history of slots taken by new aircraft."""
+    self.altitudes[slots] = np.nan
+    self.vert_rates[slots] = np.nan
+    self.heads[slots] = 0
+    self.phase[slots] = UNKNOWN
+    self.approach[slots] = False
+
+  def sample(self, store, slots):
+    """Add the current altitude and vertical rate of slots to their windows."""
+    heads = self.heads[slots]
+    self.altitudes[slots, heads] = store.column('altitude')[slots]
+    self.vert_rates[slots, heads] = store.column('vert_rate')[slots]
+    self.heads[slots] = (heads + 1) % self.window
+
+  def smoothed(self, samples):
+    present = ~np.isnan(samples)
+    counts = present.sum(axis=1)
+    totals = np.where(present, samples, 0.0).sum(axis=1)
+    return np.where(counts > 0, totals / np.maximum(counts, 1), np.nan)
+
+  def classify(self, store, slots):
+    """Work out the phase of slots, returning the slots whose phase changed."""
+    previous = self.phase[slots]
+    altitude = self.smoothed(self.altitudes[slots])
+    vert_rate = np.nan_to_num(self.smoothed(self.vert_rates[slots]))
+    speed = np.nan_to_num(store.column('speed')[slots])
+    approach = self.approach[slots]
+
+    was_low = previous >= LOW_CRUISE
+    low_limit = np.where(was_low, self.low_altitude + self.altitude_hysteresis, self.low_altitude)
+    low = (altitude < low_limit) & (altitude > 0) & (speed > self.min_speed)
+
+    was_climbing = (previous == CLIMBING) | (previous == TAKING_OFF)
+    was_descending = (previous == DESCENDING) | (previous == LANDING)
+    climbing = vert_rate > np.where(was_climbing, self.climb_rate - self.rate_hysteresis, self.climb_rate)
+    descending = vert_rate < np.where(was_descending, self.descent_rate + self.rate_hysteresis, self.descent_rate)
+
+    phase = np.full(len(slots), CRUISING, dtype=np.int8)
+    phase[low] = LOW_CRUISE
+    phase[low & climbing] = np.where(approach[low & climbing], TAKING_OFF, CLIMBING)
+    phase[low & descending] = np.where(approach[low & descending], LANDING, DESCENDING)
+    self.phase[slots] = phase
+    return slots[phase != previous]
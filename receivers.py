@@ -0,0 +1,205 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# polls several dump1090 receivers at once and merges their aircraft by ICAO hex
+from __future__ import print_function
+import threading
+import time
+from sys import stderr
+
+import metrics
+
+fetch_seconds = metrics.stage('fetch')
+
+class Receiver(threading.Thread):
+  """Polls one receiver's client on its own thread, at the client's own
+  rate, and keeps its own table of the aircraft it reported for
+  ReceiverGroup.
+
+  Only the aircraft a fetch returned are copied into the table and marked
+  touched, so with the SBS-1 and Beast feeds a poll costs what the message
+  rate does. A receiver that is slow or down only holds up this thread.
+  Its aircraft age from the time they were fetched, and are forgotten
+  once they have not been reported for forget_after seconds.
+  """
+
+  def __init__(self, client, host, stale_after=10.0, forget_after=60.0, prune_interval=5.0):
+    threading.Thread.__init__(self, name='Receiver-%s' % host)
+    self.daemon = True
+    self.client = client
+    self.host = host
+    self.stale_after = stale_after
+    self.forget_after = forget_after
+    self.prune_interval = prune_interval
+    # hex -> (time fetched, aircraft), replaced as one so readers get a
+    # matching pair
+    self.table = {}
+    # hex codes updated since ReceiverGroup last took them
+    self.touched = set()
+    self.lock = threading.Lock()
+    self.fetched = 0.0
+    self.pruned = 0.0
+    self.polls = 0
+    self.errors = 0
+    self.consecutive_errors = 0
+    self.last_error = None
+    self.state = 'starting'
+    self._stop_event = threading.Event()
+
+  def poll_once(self):
+    self.polls += 1
+    try:
+      with fetch_seconds.time():
+        flights = self.client.fetch()
+    except Exception, e:
+      self.errors += 1
+      self.consecutive_errors += 1
+      self.last_error = str(e)
+      return
+    now = time.time()
+    self.fetched = now
+    self.consecutive_errors = 0
+    if flights is not None:
+      # the feeds keep mutating their own dicts, so keep copies
+      updates = [(flight['hex'], (now, dict(flight))) for flight in flights if flight.get('hex') is not None]
+      with self.lock:
+        self.table.update(updates)
+        self.touched.update(key for key, entry in updates)
+    if now - self.pruned >= self.prune_interval:
+      self.prune(now)
+
+  def prune(self, now=None):
+    """Forget the aircraft not reported for forget_after seconds."""
+    if now is None:
+      now = time.time()
+    self.pruned = now
+    with self.lock:
+      gone = [key for key, (fetched, flight) in self.table.iteritems()
+        if now - fetched + flight.get('seen', 0) > self.forget_after]
+      for key in gone:
+        del self.table[key]
+        self.touched.discard(key)
+    return gone
+
+  def take_touched(self):
+    """The hex codes updated since the last call."""
+    with self.lock:
+      touched, self.touched = self.touched, set()
+    return touched
+
+  def health(self, now=None):
+    if now is None:
+      now = time.time()
+    if self.consecutive_errors:
+      state = 'down'
+    elif not self.fetched or now - self.fetched > self.stale_after:
+      state = 'stale'
+    else:
+      state = 'ok'
+    return {
+      'host': self.host,
+      'state': state,
+      'aircraft': len(self.table),
+      'age': now - self.fetched if self.fetched else None,
+      'polls': self.polls,
+      'errors': self.errors,
+      'consecutive_errors': self.consecutive_errors,
+      'last_error': self.last_error,
+    }
+
+  def run(self):
+    while not self._stop_event.is_set():
+      started = time.time()
+      self.poll_once()
+      state = self.health()['state']
+      if state != self.state:
+        if state == 'down':
+          print("receiver %s is down: %s" % (self.host, self.last_error), file=stderr)
+        else:
+          print("receiver %s is %s" % (self.host, state))
+        self.state = state
+      self._stop_event.wait(max(0.0, self.client.next_delay() - (time.time() - started)))
+
+  def next_delay(self):
+    return self.client.next_delay()
+
+  def stop(self):
+    self._stop_event.set()
+
+class ReceiverGroup(object):
+  """The receivers covering one area, read as a single feed.
+
+  An aircraft heard by several receivers is taken from the one with the
+  freshest position. Its seen is the smallest age any of them reports,
+  counted from the moment the receiver fetched it.
+  """
+
+  def __init__(self, receivers):
+    self.receivers = receivers
+
+  def start(self):
+    for receiver in self.receivers:
+      receiver.start()
+
+  def stop(self, timeout=None):
+    """Stop the receivers, waiting up to timeout seconds in all for the
+    fetches in flight to finish."""
+    for receiver in self.receivers:
+      receiver.stop()
+    deadline = time.time() + timeout if timeout is not None else None
+    for receiver in self.receivers:
+      if receiver.is_alive():
+        receiver.join(max(0.0, deadline - time.time()) if deadline is not None else None)
+
+  def fetch(self):
+    """The merged aircraft any receiver updated since the last call, or
+    None when none did. Aircraft that are no longer reported are left to
+    the caller's expiry.
+    """
+    touched = set()
+    for receiver in self.receivers:
+      touched.update(receiver.take_touched())
+    if not touched:
+      return None
+    return self.merged(touched)
+
+  @property
+  def flights(self):
+    keys = set()
+    for receiver in self.receivers:
+      keys.update(receiver.table.keys())
+    return self.merged(keys)
+
+  def merged(self, keys):
+    now = time.time()
+    merged = []
+    for key in keys:
+      best = None
+      for receiver in self.receivers:
+        entry = receiver.table.get(key)
+        if entry is None:
+          continue
+        fetched, flight = entry
+        age = now - fetched
+        seen = age + flight.get('seen', 0)
+        seen_pos = age + flight.get('seen_pos', flight.get('seen', 0)) if 'lat' in flight else float('inf')
+        if best is None:
+          best = [seen_pos, seen, flight]
+          continue
+        if seen_pos < best[0]:
+          best[0] = seen_pos
+          best[2] = flight
+        best[1] = min(best[1], seen)
+      if best is not None:
+        merged.append(dict(best[2], seen=best[1]))
+    return merged
+
+  def now(self):
+    return time.time()
+
+  def next_delay(self):
+    return min(receiver.next_delay() for receiver in self.receivers)
+
+  def health(self):
+    now = time.time()
+    return [receiver.health(now) for receiver in self.receivers]
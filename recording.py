@@ -0,0 +1,142 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# records the aircraft dump1090 reported to a compressed log and plays it back
+from __future__ import print_function
+import gzip
+import json
+import time
+import zlib
+from sys import stderr
+
+class Recorder(object):
+  """Appends timestamped aircraft lists to a gzip file of JSON lines, one
+  line per fetch that brought something new.
+
+  Each run appends a new gzip member, which gzip readers treat as one
+  stream. Output is flushed every flush_interval seconds, so a crash loses
+  at most that much.
+  """
+
+  def __init__(self, path, flush_interval=5.0, clock=time.time):
+    self.path = path
+    self.flush_interval = flush_interval
+    self.clock = clock
+    self.log = gzip.open(path, 'ab')
+    self.flushed = clock()
+    self.records = 0
+
+  def write(self, flights, t=None):
+    if t is None:
+      t = self.clock()
+    self.log.write(json.dumps({'t': t, 'aircraft': flights}, separators=(',', ':')) + '\n')
+    self.records += 1
+    if t - self.flushed >= self.flush_interval:
+      self.log.flush()
+      self.flushed = t
+
+  def close(self):
+    self.log.close()
+
+def read_records(path):
+  """Yield the (time, aircraft) records of a log, in order. A log cut short
+  by a crash ends at its last complete record.
+  """
+  log = gzip.open(path, 'rb')
+  try:
+    for line in log:
+      try:
+        record = json.loads(line)
+      except ValueError:
+        break
+      yield record['t'], record['aircraft']
+  except (IOError, EOFError, zlib.error), e:
+    print("%s ends early: %s" % (path, e), file=stderr)
+  finally:
+    log.close()
+
+class ReplaySource(object):
+  """Plays a Recorder log back in place of the receivers.
+
+  Records hold the aircraft a fetch brought, so every record that is due
+  is played, and flights keeps the latest of every aircraft played. speed
+  scales the recorded time, 1.0 is real time and 10.0 ten times
+  faster. A speed of 0 plays as fast as possible, one record per fetch.
+  clock is what time passes by, so tests and benchmarks can drive it, and
+  now() is the time in the recording, for whatever times the aircraft.
+  """
+
+  def __init__(self, path, speed=1.0, clock=time.time):
+    self.path = path
+    self.speed = speed
+    self.clock = clock
+    self.records = read_records(path)
+    self.upcoming = next(self.records, None)
+    self.table = {}
+    self.played = 0
+    self.started = None
+    self.first = None
+    self.last_played = self.upcoming[0] if self.upcoming else 0.0
+
+  def recorded_now(self):
+    # the time in the recording that corresponds to the clock
+    now = self.clock()
+    if self.started is None:
+      self.started = now
+      self.first = self.upcoming[0] if self.upcoming else 0.0
+    return self.first + (now - self.started) * self.speed
+
+  def now(self):
+    """The time in the recording that is playing. As fast as possible,
+    that is the time of the record played last.
+    """
+    if not self.speed:
+      return self.last_played
+    return self.recorded_now()
+
+  def fetch(self):
+    """The latest recorded aircraft that are due, or None when no record is."""
+    if self.upcoming is None:
+      return None
+    due = float('inf') if not self.speed else self.recorded_now()
+    played = {}
+    while self.upcoming is not None and self.upcoming[0] <= due:
+      for flight in self.upcoming[1]:
+        played[flight.get('hex')] = flight
+      self.last_played = self.upcoming[0]
+      self.played += 1
+      self.upcoming = next(self.records, None)
+      if not self.speed:
+        break
+    if not played:
+      return None
+    if self.upcoming is None:
+      print("finished replaying %s, %d records" % (self.path, self.played))
+    self.table.update(played)
+    return played.values()
+
+  @property
+  def flights(self):
+    return self.table.values()
+
+  @property
+  def finished(self):
+    return self.upcoming is None
+
+  def next_delay(self):
+    if self.upcoming is None:
+      return 1.0
+    if not self.speed:
+      return 0.0
+    return min(1.0, max(0.0, (self.upcoming[0] - self.recorded_now()) / self.speed))
+
+  def health(self):
+    return [{
+      'host': self.path,
+      'state': 'finished' if self.finished else 'ok',
+      'aircraft': len(self.table),
+      'played': self.played,
+    }]
+
+  def stop(self, timeout=None):
+    self.records.close()
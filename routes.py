@@ -0,0 +1,82 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# in process route lookups over FlightNumbers.csv, replacing a grep per callsign
+from __future__ import print_function
+import io
+import os
+import threading
+import time
+from sys import stderr
+
+class RouteIndex(object):
+  """Hash index of FlightNumbers.csv from "AIRLINE,NUMBER" to the route,
+  which is the last column of the row. The first row for a key wins, as it
+  did with grep.
+
+  The file is stat()ed at most every check_interval seconds and the index is
+  rebuilt when its mtime or size changed, e.g. after getAllFlightNumbers.sh
+  downloaded a new copy.
+  """
+
+  def __init__(self, csv_location, check_interval=5.0):
+    self.location = csv_location
+    self.check_interval = check_interval
+    self.routes = {}
+    self.signature = None
+    self.checked = 0
+    self.missing = False
+    self.lock = threading.Lock()
+
+  def build(self):
+    routes = {}
+    with io.open(self.location, 'r', encoding='utf-8', errors='replace') as csv:
+      for line in csv:
+        fields = line.rstrip('\r\n').split(',')
+        if len(fields) < 3:
+          continue
+        key = fields[0] + ',' + fields[1]
+        if key not in routes:
+          routes[key] = fields[-1]
+    self.routes = routes
+
+  def refresh(self):
+    now = time.time()
+    if now - self.checked < self.check_interval:
+      return
+    with self.lock:
+      if now - self.checked < self.check_interval:
+        return
+      self.checked = now
+      self.reindex()
+
+  def reindex(self):
+    try:
+      stat = os.stat(self.location)
+      signature = (stat.st_mtime, stat.st_size)
+      if signature != self.signature:
+        started = time.time()
+        self.build()
+        self.signature = signature
+        self.missing = False
+        print("indexed %d routes in %.2fs" % (len(self.routes), time.time() - started))
+    except (IOError, OSError):
+      if not self.missing:
+        print("couldn't read %s, no routes" % self.location, file=stderr)
+      self.missing = True
+      self.routes = {}
+      self.signature = None
+
+  def lookup(self, airline, number):
+    self.refresh()
+    return self.routes.get(airline + ',' + number)
+
+_indexes = {}
+
+def route_index_for(csv_location):
+  """Shared RouteIndex for a FlightNumbers.csv path."""
+  index = _indexes.get(csv_location)
+  if index is None:
+    index = RouteIndex(csv_location)
+    _indexes[csv_location] = index
+  return index
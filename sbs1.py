@@ -0,0 +1,274 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# streaming ingest of dump1090's SBS-1 (BaseStation) text feed on port 30003
+from __future__ import print_function
+import errno
+import select
+import socket
+import time
+from sys import stderr
+
+# field positions in a BaseStation MSG line
+HEX_IDENT = 4
+CALLSIGN = 10
+ALTITUDE = 11
+GROUND_SPEED = 12
+TRACK = 13
+LATITUDE = 14
+LONGITUDE = 15
+VERTICAL_RATE = 16
+SQUAWK = 17
+
+# (field index, data.json key, converter)
+FIELDS = (
+  (CALLSIGN, 'flight', lambda v: v),
+  (ALTITUDE, 'altitude', int),
+  (GROUND_SPEED, 'speed', lambda v: int(float(v))),
+  (TRACK, 'track', lambda v: int(float(v))),
+  (LATITUDE, 'lat', float),
+  (LONGITUDE, 'lon', float),
+  (VERTICAL_RATE, 'vert_rate', int),
+  (SQUAWK, 'squawk', lambda v: v),
+)
+
+def parse_message(line):
+  """Parse one MSG line into (hex, fields) where fields only holds the values
+  present in this message. Returns None for anything that is not a MSG line.
+  """
+  parts = line.strip().split(',')
+  if len(parts) < 11 or parts[0] != 'MSG':
+    return None
+  icao = parts[HEX_IDENT].strip().lower()
+  if not icao:
+    return None
+  fields = {}
+  for index, key, convert in FIELDS:
+    if index < len(parts) and parts[index].strip():
+      try:
+        fields[key] = convert(parts[index].strip())
+      except ValueError:
+        pass
+  if 'lat' in fields and 'lon' in fields:
+    fields['validposition'] = 1
+  if 'track' in fields:
+    fields['validtrack'] = 1
+  return icao, fields
+
+def iter_lines(sock, bufsize=8192):
+  """Yield complete lines as they arrive on a non-blocking socket, and None
+  whenever the socket has nothing more to read right now. Partial lines are
+  kept on the generator until the rest of them arrives. The generator ends
+  when the peer closes the connection.
+  """
+  pending = b''
+  while True:
+    try:
+      chunk = sock.recv(bufsize)
+    except socket.error as e:
+      if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+        chunk = None
+      else:
+        raise
+    if chunk == b'':
+      return
+    if chunk:
+      pending += chunk
+      lines = pending.split(b'\n')
+      pending = lines.pop()
+      for line in lines:
+        yield line.decode('ascii', 'replace')
+    else:
+      yield None
+
+class AircraftTable(object):
+  """Per-aircraft state keyed by ICAO hex, updated in place by a feed.
+
+  Aircraft not heard from for expire_after seconds are dropped by prune(),
+  which a feed runs every prune_interval seconds.
+  """
+
+  def __init__(self, expire_after=60.0, prune_interval=5.0):
+    self.aircraft = {}
+    self.last_message = {}
+    self.messages = 0
+    self.expire_after = expire_after
+    self.prune_interval = prune_interval
+    self.pruned = time.time()
+
+  def state_for(self, icao):
+    """Return the mutable state dict for an aircraft, creating it if needed."""
+    state = self.aircraft.get(icao)
+    if state is None:
+      state = {'hex': icao, 'messages': 0}
+      self.aircraft[icao] = state
+    state['messages'] += 1
+    self.last_message[icao] = time.time()
+    self.messages += 1
+    return state
+
+  def updated(self, touched):
+    """Return the state of the touched aircraft, or None if there are none."""
+    if not touched:
+      return None
+    now = time.time()
+    updated = []
+    for icao in touched:
+      state = self.aircraft[icao]
+      state['seen'] = now - self.last_message[icao]
+      updated.append(state)
+    return updated
+
+  @property
+  def flights(self):
+    now = time.time()
+    for icao, state in self.aircraft.iteritems():
+      state['seen'] = now - self.last_message[icao]
+    return self.aircraft.values()
+
+  def forget(self, icao):
+    del self.aircraft[icao]
+    del self.last_message[icao]
+
+  def prune(self, now=None):
+    """Drop the aircraft not heard from for expire_after seconds, returning
+    their hex codes.
+    """
+    if now is None:
+      now = time.time()
+    self.pruned = now
+    gone = [icao for icao, heard in self.last_message.iteritems() if now - heard > self.expire_after]
+    for icao in gone:
+      self.forget(icao)
+    return gone
+
+  def prune_due(self, now=None):
+    """prune() once prune_interval seconds have passed since the last time."""
+    if now is None:
+      now = time.time()
+    if now - self.pruned >= self.prune_interval:
+      return self.prune(now)
+    return []
+
+class TCPFeed(AircraftTable):
+  """Holds one TCP connection to a dump1090 network output and keeps
+  per-aircraft state keyed by ICAO hex, updated in place as messages arrive.
+
+  fetch() drains whatever has arrived since the last call and returns only
+  the aircraft touched by those messages, so the cost of a poll follows the
+  message rate rather than the number of aircraft in the sky.
+
+  Subclasses read their wire format with read(touched), which consumes
+  everything readable on the socket, adds the hex of each aircraft it
+  updated to touched and returns False once the peer hung up.
+  """
+  name = 'TCP'
+
+  def __init__(self, host, port, timeout=3.0, interval=0.25, max_backoff=60.0, expire_after=60.0):
+    AircraftTable.__init__(self, expire_after)
+    self.host = host
+    self.port = port
+    self.timeout = timeout
+    self.interval = interval
+    self.max_backoff = max_backoff
+    self.sock = None
+    self.failures = 0
+
+  def connect(self):
+    self.sock = socket.create_connection((self.host, self.port), self.timeout)
+    self.sock.setblocking(0)
+
+  def close(self):
+    if self.sock is not None:
+      self.sock.close()
+    self.sock = None
+
+  def fetch(self):
+    """Return the aircraft updated since the last fetch, or None if there
+    were no new messages. Socket errors close the connection, count towards
+    the backoff and are re-raised.
+    """
+    try:
+      if self.sock is None:
+        self.connect()
+      touched = set()
+      readable, _, _ = select.select([self.sock], [], [], 0)
+      if readable and not self.read(touched):
+        #the feed hung up, reconnect on the next fetch
+        print("%s feed at %s:%d closed the connection" % (self.name, self.host, self.port), file=stderr)
+        self.close()
+    except (socket.error, socket.timeout):
+      self.close()
+      self.failures += 1
+      raise
+    self.failures = 0
+    self.prune_due()
+    return self.updated(touched)
+
+  def next_delay(self):
+    if self.failures:
+      return min(self.max_backoff, self.interval * (2 ** self.failures))
+    return self.interval
+
+class SBS1Feed(TCPFeed):
+  """Streams the SBS-1 text feed, parsing MSG lines as they arrive."""
+  name = 'SBS-1'
+
+  def __init__(self, host, port=30003, bufsize=8192, **kwargs):
+    TCPFeed.__init__(self, host, port, **kwargs)
+    self.bufsize = bufsize
+    self.lines = None
+
+  def connect(self):
+    TCPFeed.connect(self)
+    self.lines = iter_lines(self.sock, self.bufsize)
+
+  def close(self):
+    TCPFeed.close(self)
+    self.lines = None
+
+  def apply(self, line):
+    """Apply one MSG line to the aircraft state, returning the hex it touched."""
+    message = parse_message(line)
+    if message is None:
+      return None
+    icao, fields = message
+    self.state_for(icao).update(fields)
+    return icao
+
+  def read(self, touched):
+    for line in self.lines:
+      if line is None:
+        return True
+      icao = self.apply(line)
+      if icao is not None:
+        touched.add(icao)
+    return False
+
+def serve_replay(path, host='127.0.0.1', port=30003, lines_per_second=None):
+  """Replay a captured SBS-1 feed to the first client that connects, for
+  exercising SBS1Feed without a receiver.
+  """
+  server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+  server.bind((host, port))
+  server.listen(1)
+  try:
+    conn, _ = server.accept()
+    with open(path, 'rb') as capture:
+      for line in capture:
+        conn.sendall(line)
+        if lines_per_second:
+          time.sleep(1.0 / lines_per_second)
+    conn.close()
+  finally:
+    server.close()
+
+if __name__ == "__main__":
+  import argparse
+  parser = argparse.ArgumentParser(description='Replay a captured SBS-1 feed on a local port')
+  parser.add_argument('capture', help="path to a captured port 30003 feed")
+  parser.add_argument('-p', '--port', type=int, default=30003)
+  parser.add_argument('-r', '--rate', type=float, default=None, help="lines per second, default as fast as possible")
+  args = parser.parse_args()
+  serve_replay(args.capture, port=args.port, lines_per_second=args.rate)
@@ -0,0 +1,66 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# paces the UI loop, full rate while things change and a trickle while idle
+from __future__ import print_function
+import time
+
+class FrameScheduler(object):
+  """Decides how long the UI loop sleeps before drawing its next frame.
+
+  Frames come at most fps a second while there is activity, touch input
+  or aircraft that moved, and drop to idle_fps once there has been none
+  for idle_after seconds. Activity during an idle wait makes the next
+  frame due straight away, so a touch is never left waiting on the idle
+  rate. clock is what time passes by, so tests can drive it.
+  """
+
+  def __init__(self, fps=20.0, idle_fps=2.0, idle_after=3.0, clock=time.time):
+    self.frame_interval = 1.0 / fps
+    self.idle_interval = 1.0 / idle_fps
+    self.idle_after = idle_after
+    self.clock = clock
+    self.last_frame = None
+    self.last_activity = clock()
+    self.wake = False
+    self.frames = 0
+    self.idle_frames = 0
+
+  def activity(self, now=None):
+    """Something changed on screen or the user touched it."""
+    if now is None:
+      now = self.clock()
+    if self.idle(now):
+      # out of an idle wait, draw now rather than at the idle rate
+      self.wake = True
+    self.last_activity = now
+
+  def idle(self, now=None):
+    if now is None:
+      now = self.clock()
+    return now - self.last_activity >= self.idle_after
+
+  def delay(self, now=None):
+    """Seconds until the next frame is due, 0 when it already is."""
+    if now is None:
+      now = self.clock()
+    if self.last_frame is None or self.wake:
+      return 0.0
+    interval = self.idle_interval if self.idle(now) else self.frame_interval
+    return max(0.0, self.last_frame + interval - now)
+
+  def frame(self, now=None):
+    """A frame is being drawn."""
+    if now is None:
+      now = self.clock()
+    if self.idle(now):
+      self.idle_frames += 1
+    self.frames += 1
+    self.last_frame = now
+    self.wake = False
+
+  def stats(self):
+    return {
+      'frames': self.frames,
+      'idle_frames': self.idle_frames,
+    }
@@ -0,0 +1,169 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# great-circle distances and a grid index of aircraft positions, for nearest and radius queries
+from __future__ import print_function
+import math
+import numpy as np
+
+EARTH_RADIUS_NM = 3440.065
+NM_PER_DEGREE = 60.0
+
+def haversine(lat, lon, lats, lons):
+  """Great-circle distances in nautical miles from (lat, lon) to each of
+  the lats/lons arrays.
+  """
+  lat1 = math.radians(lat)
+  lat2 = np.radians(lats)
+  dlat = lat2 - lat1
+  dlon = np.radians(lons) - math.radians(lon)
+  a = np.sin(dlat / 2.0) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2.0) ** 2
+  return 2.0 * EARTH_RADIUS_NM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def parse_location(location):
+  """(lat, lon) from a "lat,long" string, None when there is none."""
+  if not location:
+    return None
+  lat, lon = location.split(",")
+  return float(lat), float(lon)
+
+class GridIndex(object):
+  """Buckets the slots of a FlightStore by cell_size degree cells of
+  latitude and longitude, so a query only measures the aircraft in the
+  cells around its point.
+
+  Updated incrementally: only the slots given to update are looked at, and
+  only those that crossed into another cell move bucket. Slots without a
+  position are left out.
+  """
+
+  def __init__(self, cell_size=0.25, capacity=0):
+    self.cell_size = cell_size
+    self.columns = int(round(360.0 / cell_size))
+    self.cells = np.full(capacity, -1, dtype=np.int64)
+    self.buckets = {}
+
+  def __len__(self):
+    return int((self.cells >= 0).sum())
+
+  def ensure(self, capacity):
+    if capacity > len(self.cells):
+      self.cells = np.concatenate((self.cells, np.full(capacity - len(self.cells), -1, dtype=np.int64)))
+
+  def cell(self, row, column):
+    return row * self.columns + column % self.columns
+
+  def cells_for(self, lats, lons):
+    rows = np.floor((np.asarray(lats) + 90.0) / self.cell_size).astype(np.int64)
+    columns = np.floor((np.asarray(lons) + 180.0) / self.cell_size).astype(np.int64) % self.columns
+    return rows * self.columns + columns
+
+  def update(self, slots, lats, lons):
+    """Rebucket slots at their new positions, NaN for no position."""
+    slots = np.asarray(slots, dtype=np.intp)
+    if not len(slots):
+      return
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    placed = ~(np.isnan(lats) | np.isnan(lons))
+    cells = np.full(len(slots), -1, dtype=np.int64)
+    cells[placed] = self.cells_for(lats[placed], lons[placed])
+    moved = cells != self.cells[slots]
+    for slot, old, new in zip(slots[moved].tolist(), self.cells[slots][moved].tolist(), cells[moved].tolist()):
+      if old >= 0:
+        self.remove_from(old, slot)
+      if new >= 0:
+        self.buckets.setdefault(new, set()).add(slot)
+    self.cells[slots] = cells
+
+  def discard(self, slot):
+    old = self.cells[slot]
+    if old >= 0:
+      self.remove_from(old, slot)
+      self.cells[slot] = -1
+
+  def remove_from(self, cell, slot):
+    bucket = self.buckets[cell]
+    bucket.discard(slot)
+    if not bucket:
+      del self.buckets[cell]
+
+  def ring(self, lat, lon, radius, searched):
+    """Slots in the cells radius cells out from the cell of (lat, lon) that
+    are not in searched, which they are added to. Rings wide enough to wrap
+    around the world would otherwise meet cells twice.
+    """
+    row = int(math.floor((lat + 90.0) / self.cell_size))
+    column = int(math.floor((lon + 180.0) / self.cell_size))
+    found = []
+    if radius == 0:
+      cells = [(row, column)]
+    else:
+      cells = [(row + d, column + c) for d in (-radius, radius) for c in range(-radius, radius + 1)]
+      cells += [(row + d, column + c) for c in (-radius, radius) for d in range(-radius + 1, radius)]
+    for r, c in cells:
+      cell = self.cell(r, c)
+      if 0 <= r * self.cell_size <= 180.0 and cell not in searched:
+        searched.add(cell)
+        found.extend(self.buckets.get(cell, ()))
+    return found
+
+  def candidates_within(self, lat, lon, radius_nm):
+    """Slots in every cell that could hold a point within radius_nm."""
+    dlat = radius_nm / NM_PER_DEGREE
+    shrink = math.cos(math.radians(min(89.0, abs(lat) + dlat)))
+    dlon = dlat / max(shrink, 0.01)
+    rows = int(math.ceil(dlat / self.cell_size))
+    columns = int(math.ceil(dlon / self.cell_size))
+    if (2 * rows + 1) * (2 * columns + 1) >= len(self.buckets):
+      #the box covers more cells than are in use, just take them all
+      return [slot for bucket in self.buckets.itervalues() for slot in bucket]
+    row = int(math.floor((lat + 90.0) / self.cell_size))
+    column = int(math.floor((lon + 180.0) / self.cell_size))
+    found = []
+    for r in range(row - rows, row + rows + 1):
+      for c in range(column - columns, column + columns + 1):
+        found.extend(self.buckets.get(self.cell(r, c), ()))
+    return found
+
+  def nearest(self, lat, lon, k, lats, lons):
+    """(slots, distances) of the k slots nearest (lat, lon), nearest first.
+    lats and lons are the position columns the slots index.
+
+    Rings of cells are searched outwards until the k-th nearest found so
+    far is closer than anything in a ring not yet searched could be.
+    """
+    if k <= 0:
+      return np.empty(0, dtype=np.intp), np.empty(0)
+    total = len(self)
+    slots = []
+    searched = set()
+    radius = 0
+    while len(slots) < total:
+      if (2 * radius + 1) ** 2 > len(self.buckets):
+        #the rings cover more cells than are in use, just take them all
+        slots = np.flatnonzero(self.cells >= 0)
+        break
+      slots.extend(self.ring(lat, lon, radius, searched))
+      if len(slots) >= k:
+        # the cells searched reach at least this far from the point
+        reach = radius * self.cell_size * NM_PER_DEGREE
+        reach *= math.cos(math.radians(min(89.0, abs(lat) + (radius + 1) * self.cell_size)))
+        distances = haversine(lat, lon, lats[slots], lons[slots])
+        if np.partition(distances, k - 1)[k - 1] <= reach:
+          break
+      radius += 1
+    slots = np.array(slots, dtype=np.intp)
+    distances = haversine(lat, lon, lats[slots], lons[slots])
+    order = np.argsort(distances, kind='mergesort')[:k]
+    return slots[order], distances[order]
+
+  def within(self, lat, lon, radius_nm, lats, lons):
+    """(slots, distances) of every slot within radius_nm of (lat, lon),
+    nearest first.
+    """
+    slots = np.array(self.candidates_within(lat, lon, radius_nm), dtype=np.intp)
+    distances = haversine(lat, lon, lats[slots], lons[slots])
+    inside = np.flatnonzero(distances <= radius_nm)
+    order = inside[np.argsort(distances[inside], kind='mergesort')]
+    return slots[order], distances[order]
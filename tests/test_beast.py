@@ -0,0 +1,145 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# the Beast decoder on frames with known contents, from memory and from a replay file
+from __future__ import print_function
+import binascii
+import os
+import shutil
+import tempfile
+import unittest
+
+from beast import BeastDecoder, decode_message, replay_file, split_frames
+
+# DF17 messages with published decodings
+IDENT = binascii.unhexlify('8D4840D6202CC371C32CE0576098')     # 4840d6 KLM1023
+VELOCITY = binascii.unhexlify('8D485020994409940838175B284F')  # 485020 159kt 183° -832fpm
+EVEN = binascii.unhexlify('8D40621D58C382D690C8AC2863A7')      # 40621d even CPR, 38000ft
+ODD = binascii.unhexlify('8D40621D58C386435CC412692AD6')       # 40621d odd CPR, 38000ft
+
+# where the pair puts 40621d, by which half came last
+EVEN_LAST = (52.25720, 3.91937)
+ODD_LAST = (52.26578, 3.93891)
+
+def frame(message, timestamp=b'\x00\x01\x02\x03\x04\x05', signal=b'\x80'):
+  """A Beast frame of a Mode S message, escaped the way dump1090 sends it."""
+  kind = b'3' if len(message) == 14 else b'2'
+  return b'\x1a' + kind + (timestamp + signal + message).replace(b'\x1a', b'\x1a\x1a')
+
+class SplitFramesTest(unittest.TestCase):
+
+  def test_frames(self):
+    data = frame(IDENT) + frame(VELOCITY)
+    frames, consumed = split_frames(data)
+    self.assertEqual(consumed, len(data))
+    self.assertEqual([(kind, payload[7:].tobytes()) for kind, payload in frames], [(b'3', IDENT), (b'3', VELOCITY)])
+
+  def test_escaped_bytes(self):
+    timestamp = b'\x1a\x00\x1a\x1a\x00\x01'
+    data = frame(IDENT, timestamp, b'\x1a')
+    self.assertEqual(data.count(b'\x1a'), 1 + 2 * 4)
+    frames, consumed = split_frames(data)
+    self.assertEqual(consumed, len(data))
+    self.assertEqual(len(frames), 1)
+    self.assertEqual(frames[0][1].tobytes(), timestamp + b'\x1a' + IDENT)
+
+  def test_incomplete_frame_is_left_over(self):
+    data = frame(IDENT) + frame(VELOCITY)[:10]
+    frames, consumed = split_frames(data)
+    self.assertEqual(len(frames), 1)
+    self.assertEqual(consumed, len(frame(IDENT)))
+
+  def test_resyncs_after_garbage(self):
+    data = b'\x00\xff\x1a\x7f' + frame(VELOCITY)
+    frames, consumed = split_frames(data)
+    self.assertEqual([payload[7:].tobytes() for kind, payload in frames], [VELOCITY])
+
+  def test_frame_cut_short_by_a_new_frame(self):
+    # a bare escape inside a frame starts the next one
+    data = frame(IDENT)[:12] + frame(VELOCITY)
+    frames, consumed = split_frames(data)
+    self.assertEqual([payload[7:].tobytes() for kind, payload in frames], [VELOCITY])
+
+class DecodeMessageTest(unittest.TestCase):
+
+  def test_ident(self):
+    icao, kind, fields = decode_message(IDENT)
+    self.assertEqual((icao, kind), ('4840d6', 'ident'))
+    self.assertEqual(fields['flight'].strip(), 'KLM1023')
+
+  def test_velocity(self):
+    icao, kind, fields = decode_message(VELOCITY)
+    self.assertEqual((icao, kind), ('485020', 'velocity'))
+    self.assertEqual(fields['speed'], 159)
+    self.assertEqual(fields['track'], 183)
+    self.assertEqual(fields['vert_rate'], -832)
+
+  def test_position(self):
+    icao, kind, fields = decode_message(EVEN)
+    self.assertEqual((icao, kind), ('40621d', 'position'))
+    self.assertEqual(fields, {'odd': 0, 'lat_cpr': 93000, 'lon_cpr': 51372, 'altitude': 38000})
+    self.assertEqual(decode_message(ODD)[2]['odd'], 1)
+
+  def test_bad_crc(self):
+    damaged = IDENT[:5] + b'\x00' + IDENT[6:]
+    self.assertIsNone(decode_message(damaged))
+    self.assertIsNotNone(decode_message(damaged, check_crc=False))
+
+class BeastDecoderTest(unittest.TestCase):
+
+  def assertPosition(self, state, expected):
+    self.assertAlmostEqual(state['lat'], expected[0], places=5)
+    self.assertAlmostEqual(state['lon'], expected[1], places=5)
+
+  def test_cpr_pair_in_one_chunk(self):
+    # both halves arrive in the same read, the one that came last wins
+    decoder = BeastDecoder()
+    decoder.feed(frame(ODD) + frame(EVEN))
+    self.assertPosition(decoder.aircraft['40621d'], EVEN_LAST)
+    decoder = BeastDecoder()
+    decoder.feed(frame(EVEN) + frame(ODD))
+    self.assertPosition(decoder.aircraft['40621d'], ODD_LAST)
+
+  def test_cpr_pair_across_chunks(self):
+    decoder = BeastDecoder()
+    self.assertEqual(decoder.feed(frame(EVEN)), set(['40621d']))
+    self.assertNotIn('lat', decoder.aircraft['40621d'])
+    decoder.feed(frame(ODD))
+    self.assertPosition(decoder.aircraft['40621d'], ODD_LAST)
+    decoder.feed(frame(EVEN))
+    self.assertPosition(decoder.aircraft['40621d'], EVEN_LAST)
+
+  def test_frames_split_across_chunks(self):
+    data = frame(IDENT, b'\x1a\x1a\x1a\x00\x00\x00') + frame(VELOCITY)
+    decoder = BeastDecoder()
+    for i in range(len(data)):
+      decoder.feed(data[i:i + 1])
+    self.assertEqual(decoder.messages, 2)
+    self.assertEqual(decoder.aircraft['4840d6']['flight'].strip(), 'KLM1023')
+    self.assertEqual(decoder.aircraft['485020']['speed'], 159)
+
+class ReplayFileTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_replay_file(self):
+    path = os.path.join(self.directory, 'capture.beast')
+    with open(path, 'wb') as capture:
+      capture.write(b'\x00\x00' + frame(IDENT) + frame(VELOCITY) + frame(EVEN, b'\x1a\x1a\x00\x00\x00\x01'))
+      capture.write(frame(ODD) + frame(ODD[:7]) + frame(EVEN))
+    for chunk_size in (5, 65536):
+      decoder = replay_file(path, chunk_size)
+      self.assertEqual(sorted(decoder.aircraft), ['40621d', '4840d6', '485020'])
+      self.assertEqual(decoder.messages, 5)
+      state = decoder.aircraft['40621d']
+      self.assertEqual(state['altitude'], 38000)
+      self.assertEqual(state['validposition'], 1)
+      self.assertAlmostEqual(state['lat'], EVEN_LAST[0], places=5)
+      self.assertAlmostEqual(state['lon'], EVEN_LAST[1], places=5)
+
+if __name__ == "__main__":
+  unittest.main()
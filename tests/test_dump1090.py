@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# Dump1090Client against a local FakeDump1090
+from __future__ import print_function
+import threading
+import time
+import unittest
+
+from dump1090 import Dump1090Client
+from fake_dump1090 import FakeDump1090, TrafficSimulator
+
+class Dump1090ClientTest(unittest.TestCase):
+
+  def setUp(self):
+    # data.json only changes when a test publishes
+    self.server = FakeDump1090(('127.0.0.1', 0), TrafficSimulator(5, seed=1), update_interval=3600)
+    thread = threading.Thread(target=self.server.serve_forever, name='FakeDump1090')
+    thread.daemon = True
+    thread.start()
+    self.client = Dump1090Client('127.0.0.1:%d' % self.server.server_address[1], min_interval=0.01)
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+  def change(self):
+    self.server.simulator.step(time.time() + 10.0)
+    self.server.publish()
+
+  def test_first_fetch_parses_the_aircraft(self):
+    flights = self.client.fetch()
+    self.assertEqual(len(flights), 5)
+    self.assertEqual(set(flight['hex'] for flight in flights), set(self.server.simulator.hex))
+    self.assertEqual(self.client.updates, 1)
+
+  def test_unchanged_feed_is_not_modified(self):
+    self.client.fetch()
+    self.assertIsNone(self.client.fetch())
+    self.assertIsNone(self.client.fetch())
+    self.assertEqual(self.client.requests, 3)
+    self.assertEqual(self.client.not_modified, 2)
+    self.assertEqual(self.client.updates, 1)
+
+  def test_unchanged_body_is_not_parsed(self):
+    self.client.fetch()
+    # without the validators the body comes back in full, its hash catches it
+    self.client.etag = None
+    self.client.last_modified = None
+    self.assertIsNone(self.client.fetch())
+    self.assertEqual(self.client.not_modified, 0)
+    self.assertEqual(self.client.unchanged, 1)
+    self.assertEqual(self.client.updates, 1)
+
+  def test_changed_feed_is_parsed(self):
+    first = self.client.fetch()
+    self.change()
+    second = self.client.fetch()
+    self.assertIsNotNone(second)
+    self.assertNotEqual(first, second)
+    self.assertEqual(self.client.updates, 2)
+
+  def test_interval_backs_off_while_unchanged(self):
+    self.client.fetch()
+    before = self.client.next_delay()
+    self.client.fetch()
+    self.client.fetch()
+    self.assertAlmostEqual(self.client.next_delay(), before * 1.25 * 1.25)
+    for i in range(30):
+      self.client.fetch()
+    self.assertEqual(self.client.next_delay(), self.client.max_interval)
+
+  def test_interval_follows_the_change_rate(self):
+    self.client.fetch()
+    for i in range(3):
+      time.sleep(0.1)
+      self.change()
+      self.client.fetch()
+    # polls at about twice the rate the feed changes
+    self.assertGreater(self.client.change_period, 0.09)
+    self.assertLess(self.client.change_period, 0.5)
+    self.assertAlmostEqual(self.client.next_delay(), self.client.change_period / 2.0)
+
+  def test_failures_back_off(self):
+    self.client.url = 'http://127.0.0.1:%d/missing' % self.server.server_address[1]
+    for failures in (1, 2):
+      with self.assertRaises(Exception):
+        self.client.fetch()
+      self.assertEqual(self.client.next_delay(), self.client.min_interval * 2 ** failures)
+    self.assertEqual(self.client.errors, 2)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# EnrichmentPool retrying failed lookups, and the Flyover handing it work
+from __future__ import print_function
+import threading
+import time
+import unittest
+
+from all_nearest_planes import Flyover, createDefaultsArgs
+from enrichment import EnrichmentPool
+from receivers import Receiver, ReceiverGroup
+from tests.test_receivers import ScriptedClient
+
+class EnrichmentPoolTest(unittest.TestCase):
+
+  def run_pool(self, lookup, jobs, **kwargs):
+    pool = EnrichmentPool(lookup, workers=1, **kwargs)
+    for key, job in jobs:
+      pool.submit(key, job)
+    deadline = time.time() + 5.0
+    while pool.completed + pool.failed < len(jobs) and time.time() < deadline:
+      time.sleep(0.01)
+    time.sleep(0.05)
+    return pool, dict(pool.drain(1.0))
+
+  def test_failed_keys_are_retried(self):
+    calls = []
+    def lookup(batch):
+      # b fails on its first try only, with what did work still returned
+      failed = set(['b']) if 'b' not in calls else set()
+      calls.extend(key for key, job in batch)
+      return dict((key, {'job': job}) for key, job in batch), failed
+    pool, results = self.run_pool(lookup, [('a', 1), ('b', 2)])
+    self.assertEqual(sorted(calls), ['a', 'b', 'b'])
+    self.assertEqual(results, {'a': {'job': 1}, 'b': {'job': 2}})
+    self.assertEqual((pool.completed, pool.retried, pool.failed), (2, 1, 0))
+    self.assertEqual(pool.attempts, {})
+
+  def test_retries_are_bounded(self):
+    calls = []
+    def lookup(batch):
+      calls.extend(key for key, job in batch)
+      raise IOError("no database")
+    pool, results = self.run_pool(lookup, [('a', 1), ('b', 2)], max_attempts=3)
+    self.assertEqual(sorted(calls), ['a', 'a', 'a', 'b', 'b', 'b'])
+    self.assertEqual(results, {})
+    self.assertEqual((pool.completed, pool.retried, pool.failed), (0, 4, 2))
+    self.assertEqual(pool.pending, {})
+
+class FlyoverEnrichmentTest(unittest.TestCase):
+
+  def test_visible_aircraft_gone_while_waiting(self):
+    options = createDefaultsArgs(['--host', 'feed.test'])
+    flyover = Flyover()
+    release = threading.Event()
+    def lookup(batch):
+      release.wait(5.0)
+      return {}, ()
+    flyover.enrichment = EnrichmentPool(lookup, workers=1)
+    receiver = Receiver(ScriptedClient([{'hex': 'aaaaaa', 'flight': 'UAL123  ', 'lat': 37.3, 'lon': -121.9, 'track': 90}]), options.host)
+    flyover.receivers[(options.source, options.host, options.feed_port)] = ReceiverGroup([receiver])
+    try:
+      receiver.poll_once()
+      flyover.get_nearest_airplane(options)
+      # the one worker is busy with aaaaaa, so bbbbbb waits in the queue
+      # after the aircraft has gone, still on screen in the last snapshot
+      flyover.enrichment.submit('bbbbbb', 'SWA456')
+      flyover.set_visible(['aaaaaa', 'bbbbbb'])
+      flyover.get_nearest_airplane(options)
+      self.assertIn('bbbbbb', flyover.enrichment.pending)
+    finally:
+      release.set()
+      flyover.close()
+
+if __name__ == "__main__":
+  unittest.main()
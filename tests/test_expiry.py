@@ -0,0 +1,55 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# ExpiryQueue evicting quiet keys from its heap of deadlines
+from __future__ import print_function
+import unittest
+
+from expiry import ExpiryQueue
+
+class ExpiryQueueTest(unittest.TestCase):
+
+  def setUp(self):
+    self.now = 1000.0
+    self.queue = ExpiryQueue(10.0, clock=lambda: self.now)
+
+  def test_quiet_keys_expire(self):
+    self.queue.touch('a')
+    self.queue.touch('b', 1005.0)
+    self.assertEqual(self.queue.expired(1009.0), [])
+    self.assertEqual(self.queue.expired(1010.0), ['a'])
+    self.now = 1015.0
+    self.assertEqual(self.queue.expired(), ['b'])
+    self.assertEqual(len(self.queue), 0)
+    self.assertEqual(self.queue.stats(), {'tracked': 0, 'evicted': 2, 'repushed': 0})
+
+  def test_touched_keys_are_pushed_back(self):
+    self.queue.touch('a', 1000.0)
+    self.queue.touch('a', 1008.0)
+    # an older report does not undo the newer one
+    self.queue.touch('a', 1002.0)
+    # the heap entry still says 1010, it is pushed back rather than expired
+    self.assertEqual(self.queue.expired(1010.0), [])
+    self.assertEqual(self.queue.stats()['repushed'], 1)
+    self.queue.touch('a', 1015.0)
+    self.assertEqual(self.queue.expired(1018.0), [])
+    self.assertEqual(self.queue.expired(1024.9), [])
+    self.assertEqual(self.queue.expired(1025.0), ['a'])
+    self.assertEqual(self.queue.stats()['repushed'], 2)
+
+  def test_discard(self):
+    self.queue.touch('a', 1000.0)
+    self.queue.touch('b', 1000.0)
+    self.queue.discard('a')
+    self.queue.discard('missing')
+    self.assertEqual(len(self.queue), 1)
+    self.assertEqual(self.queue.expired(1010.0), ['b'])
+    # heard again after being discarded, the old entry does not evict it early
+    self.queue.touch('a', 1005.0)
+    self.queue.discard('a')
+    self.queue.touch('a', 1007.0)
+    self.assertEqual(self.queue.expired(1016.0), [])
+    self.assertEqual(self.queue.expired(1017.0), ['a'])
+
+if __name__ == "__main__":
+  unittest.main()
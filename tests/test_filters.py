@@ -0,0 +1,114 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# compiled filters over a FlightStore, checked against the aircraft one by one
+from __future__ import print_function
+import random
+import unittest
+
+import numpy as np
+
+from filters import FilterError, compile_filter
+from flightstore import FlightStore
+from spatial import haversine
+
+LOCATION = (37.3628, -121.9292)
+AREAS = ['flyby', 'north_flow', 'south_flow', 'hidden', None]
+STATUSES = ['cruising', 'low cruise', 'climbing', 'descending', 'taking off', 'landing', None]
+OPERATORS = [u'United Airlines', u'Southwest Airlines', u'Alaska Airlines', u'Lufthansa', None]
+PLANS = ['SJC-LAX', 'SFO-SJC', 'SEA-SJC', 'LAX-SEA', None]
+
+def build_store(count, seed=1):
+  generator = random.Random(seed)
+  store = FlightStore(capacity=16)
+  for i in range(count):
+    flight = {
+      'flight': '%s%d  ' % (generator.choice(['UAL', 'SWA', 'ASA', 'DLH']), generator.randint(1, 2000)),
+      'lat': LOCATION[0] + generator.uniform(-1, 1),
+      'lon': LOCATION[1] + generator.uniform(-1, 1),
+      'altitude': generator.randint(0, 40000),
+      'speed': generator.randint(100, 500),
+    }
+    for name, choices in (('area', AREAS), ('status', STATUSES), ('OperatorName', OPERATORS), ('plan', PLANS)):
+      value = generator.choice(choices)
+      if value is not None:
+        flight[name] = value
+    store['%06x' % i] = flight
+  # removed and taken again, so stale slots would show up
+  for i in range(0, count, 7):
+    del store['%06x' % i]
+  return store
+
+def reference(store, slots, test):
+  return np.array([test(store.records[slot]) for slot in slots.tolist()], dtype=bool)
+
+def text(record, name):
+  value = record.get(name)
+  return value.strip().lower() if value is not None else None
+
+class FlightFilterTest(unittest.TestCase):
+
+  def setUp(self):
+    self.store = build_store(300)
+    self.slots = self.store.occupied()
+
+  def check(self, expression, test):
+    mask = compile_filter(expression, LOCATION).mask(self.store, self.slots)
+    expected = reference(self.store, self.slots, test)
+    self.assertEqual(mask.dtype, bool)
+    self.assertEqual(mask.tolist(), expected.tolist(), expression)
+    self.assertTrue(expected.any() and not expected.all(), expression)
+
+  def test_numeric(self):
+    self.check('altitude < 10000', lambda r: r.get('altitude') < 10000)
+    self.check('speed >= 300', lambda r: r.get('speed') >= 300)
+    distance = lambda r: haversine(LOCATION[0], LOCATION[1], np.array([r.get('lat')]), np.array([r.get('lon')]))[0]
+    self.check('distance < 20', lambda r: distance(r) < 20)
+
+  def test_text_equal(self):
+    self.check('area = flyby', lambda r: text(r, 'area') == 'flyby')
+    self.check('AREA = "FLYBY"', lambda r: text(r, 'area') == 'flyby')
+    self.check('status = "taking off"', lambda r: text(r, 'status') == 'taking off')
+    callsign = text(self.store.records[self.slots[3]], 'flight')
+    self.check('callsign = %s' % callsign.upper(), lambda r: text(r, 'flight') == callsign)
+
+  def test_text_not_equal(self):
+    # missing fields never match
+    self.check('area != flyby', lambda r: text(r, 'area') not in ('flyby', None))
+
+  def test_text_contains(self):
+    self.check('operator ~ united', lambda r: 'united' in (text(r, 'OperatorName') or ''))
+    self.check('route ~ SJC', lambda r: 'sjc' in (text(r, 'plan') or ''))
+    self.check('callsign ~ ual', lambda r: text(r, 'flight').startswith('ual'))
+
+  def test_text_in(self):
+    self.check('status in landing, "taking off"', lambda r: text(r, 'status') in ('landing', 'taking off'))
+
+  def test_combined(self):
+    self.check('altitude < 20000 and (area = flyby or operator ~ alaska) and not status = cruising',
+      lambda r: r.get('altitude') < 20000 and (text(r, 'area') == 'flyby' or 'alaska' in (text(r, 'OperatorName') or ''))
+        and text(r, 'status') != 'cruising')
+
+  def test_text_columns_follow_the_records(self):
+    record = self.store.records[self.slots[0]]
+    record['OperatorName'] = u'  KLM Royal Dutch Airlines '
+    record['area'] = None
+    operators = self.store.text_column('OperatorName')
+    self.assertEqual(operators.words[operators.codes[record.slot]], u'klm royal dutch airlines')
+    self.assertEqual(self.store.text_column('area').codes[record.slot], -1)
+    mask = compile_filter('operator ~ "royal dutch"').mask(self.store, self.slots)
+    self.assertEqual(self.slots[mask].tolist(), [record.slot])
+    # words that turn up after a test ran are tested too
+    del self.store[record.hex]
+    self.assertFalse(compile_filter('operator ~ "royal dutch"').mask(self.store, self.store.occupied()).any())
+    self.store['ffffff'] = {'OperatorName': u'Royal Dutch Shell'}
+    mask = compile_filter('operator ~ "royal dutch"').mask(self.store, self.store.occupied())
+    self.assertEqual(self.store.occupied()[mask].tolist(), [self.store.slots['ffffff']])
+
+  def test_errors(self):
+    for expression in ('altitude <', 'speed ~ 5', 'area < 3', 'colour = red', '(area = flyby', 'altitude < high'):
+      self.assertRaises(FilterError, compile_filter, expression, LOCATION)
+    self.assertIsNone(compile_filter('  '))
+
+if __name__ == "__main__":
+  unittest.main()
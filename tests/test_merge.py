@@ -0,0 +1,48 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# merge_flights reporting what changed between two polls
+from __future__ import print_function
+import unittest
+
+from merge import FlightDelta, is_empty, merge_flights
+
+UAL = {'hex': 'aaaaaa', 'flight': 'UAL123  ', 'altitude': 5000, 'speed': 200, 'seen': 0.5, 'messages': 10}
+SWA = {'hex': 'bbbbbb', 'flight': 'SWA456  ', 'altitude': 9000, 'speed': 300, 'seen': 1.0, 'messages': 20}
+
+class MergeFlightsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.current = {}
+    merge_flights(self.current, {'aaaaaa': dict(UAL), 'bbbbbb': dict(SWA)})
+
+  def test_added(self):
+    current = {}
+    incoming = {'aaaaaa': UAL, 'cccccc': dict(UAL, hex='cccccc', seen=61)}
+    delta = merge_flights(current, incoming, max_seen=60)
+    # already too stale to be worth adding
+    self.assertEqual(delta, FlightDelta(['aaaaaa'], {}, []))
+    self.assertEqual(current, {'aaaaaa': UAL})
+    self.assertIsNot(current['aaaaaa'], UAL)
+
+  def test_updated_fields(self):
+    delta = merge_flights(self.current, {'aaaaaa': dict(UAL, altitude=5200, speed=210), 'bbbbbb': dict(SWA)})
+    self.assertEqual(delta, FlightDelta([], {'aaaaaa': set(['altitude', 'speed'])}, []))
+    self.assertEqual(self.current['aaaaaa']['altitude'], 5200)
+
+  def test_volatile_fields_are_kept_but_not_reported(self):
+    delta = merge_flights(self.current, {'aaaaaa': dict(UAL, seen=2.5, messages=14)})
+    self.assertTrue(is_empty(delta))
+    self.assertEqual((self.current['aaaaaa']['seen'], self.current['aaaaaa']['messages']), (2.5, 14))
+    delta = merge_flights(self.current, {'aaaaaa': dict(UAL, seen=3.0, messages=15, squawk='1200')})
+    self.assertEqual(delta.updated, {'aaaaaa': set(['squawk'])})
+
+  def test_removed_past_max_seen(self):
+    delta = merge_flights(self.current, {'bbbbbb': dict(SWA, seen=60)}, max_seen=60)
+    self.assertTrue(is_empty(delta))
+    delta = merge_flights(self.current, {'bbbbbb': dict(SWA, seen=61)}, max_seen=60)
+    self.assertEqual(delta, FlightDelta([], {}, ['bbbbbb']))
+    self.assertEqual(sorted(self.current), ['aaaaaa'])
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# PhaseEngine thresholds, hysteresis and approach areas over a FlightStore
+from __future__ import print_function
+import unittest
+
+import numpy as np
+
+from flightstore import FlightStore
+from phases import CLIMBING, CRUISING, DESCENDING, LANDING, LOW_CRUISE, PhaseEngine, TAKING_OFF, UNKNOWN
+
+class PhaseEngineTest(unittest.TestCase):
+
+  def setUp(self):
+    self.store = FlightStore(capacity=4)
+    # a window of one sample, so each step is classified on its own values
+    self.engine = PhaseEngine(window=1)
+    self.add('aaaaaa')
+
+  def add(self, key, altitude=5000):
+    self.store[key] = {'hex': key, 'altitude': altitude, 'speed': 200, 'vert_rate': 0}
+    self.engine.ensure(self.store.capacity)
+    slot = self.store.slots[key]
+    self.engine.reset(np.array([slot]))
+    return slot
+
+  def step(self, key, **fields):
+    record = self.store.records[self.store.slots[key]]
+    for name, value in fields.iteritems():
+      record[name] = value
+    slots = np.array([record.slot])
+    self.engine.sample(self.store, slots)
+    changed = self.engine.classify(self.store, slots)
+    return self.engine.phase[record.slot], changed.tolist()
+
+  def test_thresholds(self):
+    self.assertEqual(self.step('aaaaaa')[0], LOW_CRUISE)
+    self.assertEqual(self.step('aaaaaa', vert_rate=1200)[0], CLIMBING)
+    self.assertEqual(self.step('aaaaaa', vert_rate=-1200)[0], DESCENDING)
+    self.assertEqual(self.step('aaaaaa', altitude=30000, vert_rate=0)[0], CRUISING)
+    # too slow to be flying
+    self.assertEqual(self.step('aaaaaa', altitude=5000, speed=50)[0], CRUISING)
+
+  def test_only_changes_are_returned(self):
+    slot = self.store.slots['aaaaaa']
+    self.assertEqual(self.step('aaaaaa'), (LOW_CRUISE, [slot]))
+    self.assertEqual(self.step('aaaaaa', altitude=5100), (LOW_CRUISE, []))
+
+  def test_rate_hysteresis(self):
+    # climb_rate 1000, left only below 1000 - 300
+    self.assertEqual(self.step('aaaaaa', vert_rate=900)[0], LOW_CRUISE)
+    self.assertEqual(self.step('aaaaaa', vert_rate=1100)[0], CLIMBING)
+    self.assertEqual(self.step('aaaaaa', vert_rate=900)[0], CLIMBING)
+    self.assertEqual(self.step('aaaaaa', vert_rate=701)[0], CLIMBING)
+    self.assertEqual(self.step('aaaaaa', vert_rate=700)[0], LOW_CRUISE)
+    self.assertEqual(self.step('aaaaaa', vert_rate=900)[0], LOW_CRUISE)
+
+  def test_altitude_hysteresis(self):
+    self.assertEqual(self.step('aaaaaa', altitude=9900)[0], LOW_CRUISE)
+    self.assertEqual(self.step('aaaaaa', altitude=10400)[0], LOW_CRUISE)
+    self.assertEqual(self.step('aaaaaa', altitude=10500)[0], CRUISING)
+    self.assertEqual(self.step('aaaaaa', altitude=10400)[0], CRUISING)
+
+  def test_taking_off_and_landing_only_in_approach_areas(self):
+    self.assertEqual(self.step('aaaaaa', vert_rate=1500)[0], CLIMBING)
+    self.engine.approach[self.store.slots['aaaaaa']] = True
+    self.assertEqual(self.step('aaaaaa')[0], TAKING_OFF)
+    self.assertEqual(self.step('aaaaaa', vert_rate=-1500)[0], LANDING)
+    self.engine.approach[self.store.slots['aaaaaa']] = False
+    self.assertEqual(self.step('aaaaaa')[0], DESCENDING)
+
+  def test_reset_clears_a_reused_slot(self):
+    self.engine.approach[self.store.slots['aaaaaa']] = True
+    self.assertEqual(self.step('aaaaaa', vert_rate=1500)[0], TAKING_OFF)
+    slot = self.store.slots['aaaaaa']
+    del self.store['aaaaaa']
+    self.assertEqual(self.add('bbbbbb'), slot)
+    self.assertEqual(self.engine.phase[slot], UNKNOWN)
+    self.assertFalse(self.engine.approach[slot])
+    self.assertTrue(np.isnan(self.engine.altitudes[slot]).all())
+    # a climb the last aircraft's hysteresis would still have called one
+    self.assertEqual(self.step('bbbbbb', vert_rate=900)[0], LOW_CRUISE)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# Receiver and ReceiverGroup publishing only what each fetch touched
+from __future__ import print_function
+import unittest
+
+from receivers import Receiver, ReceiverGroup
+
+class ScriptedClient(object):
+  """Hands out the next list of aircraft on every fetch, None once done."""
+
+  def __init__(self, *fetches):
+    self.fetches = list(fetches)
+
+  def fetch(self):
+    return self.fetches.pop(0) if self.fetches else None
+
+  def next_delay(self):
+    return 0.25
+
+class ReceiverGroupTest(unittest.TestCase):
+
+  def test_only_touched_aircraft_are_published(self):
+    client = ScriptedClient(
+      [{'hex': 'aaaaaa', 'altitude': 1000}, {'hex': 'bbbbbb', 'altitude': 2000}],
+      [{'hex': 'bbbbbb', 'altitude': 2100}])
+    receiver = Receiver(client, 'one')
+    group = ReceiverGroup([receiver])
+    self.assertIsNone(group.fetch())
+
+    receiver.poll_once()
+    self.assertEqual(sorted(flight['hex'] for flight in group.fetch()), ['aaaaaa', 'bbbbbb'])
+    self.assertIsNone(group.fetch())
+
+    receiver.poll_once()
+    self.assertEqual([(flight['hex'], flight['altitude']) for flight in group.fetch()], [('bbbbbb', 2100)])
+    # the table still has everything heard
+    self.assertEqual(sorted(flight['hex'] for flight in group.flights), ['aaaaaa', 'bbbbbb'])
+    self.assertEqual(receiver.health()['aircraft'], 2)
+
+    receiver.poll_once()
+    self.assertIsNone(group.fetch())
+
+  def test_published_aircraft_are_copies(self):
+    flight = {'hex': 'aaaaaa', 'altitude': 1000}
+    receiver = Receiver(ScriptedClient([flight]), 'one')
+    receiver.poll_once()
+    flight['altitude'] = 5000
+    self.assertEqual(ReceiverGroup([receiver]).fetch()[0]['altitude'], 1000)
+
+  def test_freshest_position_wins(self):
+    near = Receiver(ScriptedClient([{'hex': 'aaaaaa', 'lat': 1.0, 'lon': 1.0, 'seen': 0.5, 'seen_pos': 4.0}]), 'near')
+    far = Receiver(ScriptedClient([{'hex': 'aaaaaa', 'lat': 2.0, 'lon': 2.0, 'seen': 3.0, 'seen_pos': 1.0}]), 'far')
+    group = ReceiverGroup([near, far])
+    near.poll_once()
+    far.poll_once()
+    flights = group.fetch()
+    self.assertEqual(len(flights), 1)
+    self.assertEqual(flights[0]['lat'], 2.0)
+    self.assertLess(flights[0]['seen'], 1.0)
+
+  def test_quiet_aircraft_are_forgotten(self):
+    receiver = Receiver(ScriptedClient([{'hex': 'aaaaaa'}, {'hex': 'bbbbbb', 'seen': 2.0}]), 'one', forget_after=60.0)
+    receiver.poll_once()
+    fetched = receiver.fetched
+    self.assertEqual(receiver.prune(fetched + 57.0), [])
+    # counted from when the receiver last heard it, not when it was fetched
+    self.assertEqual(receiver.prune(fetched + 59.0), ['bbbbbb'])
+    self.assertEqual(receiver.prune(fetched + 61.0), ['aaaaaa'])
+    self.assertEqual(receiver.table, {})
+    self.assertEqual(receiver.take_touched(), set())
+
+if __name__ == "__main__":
+  unittest.main()
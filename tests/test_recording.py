@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# replaying a Recorder log through the Flyover, timed by the recording
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import unittest
+
+from all_nearest_planes import Flyover, createDefaultsArgs
+from recording import Recorder, ReplaySource, read_records
+
+UAL = {'hex': 'aaaaaa', 'flight': 'UAL123  ', 'track': 90, 'altitude': 5000, 'speed': 200, 'seen': 0}
+SWA = {'hex': 'bbbbbb', 'flight': 'SWA456  ', 'track': 270, 'altitude': 9000, 'speed': 300, 'seen': 0}
+
+# what the receivers brought, at the recorded times. SWA is only heard at
+# the start, so it is gone a minute later however fast this plays
+SESSION = [
+  (1000.0, [dict(UAL, lat=37.30, lon=-121.90), dict(SWA, lat=37.50, lon=-122.00)]),
+  (1010.0, [dict(UAL, lat=37.31, lon=-121.90)]),
+  (1100.0, [dict(UAL, lat=37.31, lon=-121.95)]),
+]
+
+class ReplayTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, 'session.jsonl.gz')
+    recorder = Recorder(self.path)
+    for t, flights in SESSION:
+      recorder.write(flights, t)
+    recorder.close()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_recorder_round_trip(self):
+    self.assertEqual(list(read_records(self.path)), SESSION)
+
+  def test_replay_clock(self):
+    source = ReplaySource(self.path, speed=0)
+    self.assertEqual(source.now(), 1000.0)
+    source.fetch()
+    source.fetch()
+    self.assertEqual(source.now(), 1010.0)
+    self.assertEqual(sorted(flight['hex'] for flight in source.flights), ['aaaaaa', 'bbbbbb'])
+
+  def test_replay_is_timed_by_the_recording(self):
+    recorded = os.path.join(self.directory, 'again.jsonl.gz')
+    options = createDefaultsArgs(['--source', 'replay', '--replay', self.path, '--replay-speed', '0',
+      '--expire', '60', '--record', recorded])
+    flyover = Flyover()
+    try:
+      flyover.get_nearest_airplane(options)
+      self.assertEqual(sorted(flyover.flights_dict), ['aaaaaa', 'bbbbbb'])
+      flyover.get_nearest_airplane(options)
+      self.assertIn('bbbbbb', flyover.flights_dict)
+      flyover.get_nearest_airplane(options)
+      # a minute of the recording went by without SWA
+      self.assertEqual(sorted(flyover.flights_dict), ['aaaaaa'])
+      self.assertEqual(flyover.last_delta.removed, ['bbbbbb'])
+      self.assertEqual(flyover.flights_dict['aaaaaa']['position_time'], 1100.0)
+      version, points = flyover.trails.points('aaaaaa')
+      self.assertEqual(points[:, 0].tolist(), [1000.0, 1010.0, 1100.0])
+    finally:
+      flyover.close()
+    # closing finished the new recording, with the recorded times
+    self.assertEqual([t for t, flights in read_records(recorded)], [1000.0, 1010.0, 1100.0])
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,152 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# SBS1Feed reading a captured feed replayed over a local socket
+from __future__ import print_function
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from beast import BeastDecoder
+from sbs1 import AircraftTable, SBS1Feed, parse_message, serve_replay
+
+CAPTURE = (
+  "MSG,1,111,11111,4840D6,111111,2018/06/01,12:00:00.000,2018/06/01,12:00:00.000,KLM1023 ,,,,,,,,,,,0\r\n"
+  "MSG,3,111,11111,4840D6,111111,2018/06/01,12:00:00.100,2018/06/01,12:00:00.100,,38000,,,52.25720,3.91937,,,0,0,0,0\r\n"
+  "MSG,4,111,11111,4840D6,111111,2018/06/01,12:00:00.200,2018/06/01,12:00:00.200,,,159,182.9,,,-832,,0,0,0,0\r\n"
+  "MSG,5,111,11111,A1B2C3,111111,2018/06/01,12:00:00.300,2018/06/01,12:00:00.300,SWA1234 ,4500,,,,,,,0,0,0,0\r\n"
+  "STA,,111,11111,A1B2C3,111111,2018/06/01,12:00:00.400,2018/06/01,12:00:00.400,RM\r\n"
+  "MSG,6,111,11111,A1B2C3,111111,2018/06/01,12:00:00.500,2018/06/01,12:00:00.500,,,,,,,,7000,0,0,0,0\r\n"
+  "MSG,3,111,11111,A1B2C3,111111,2018/06/01,12:00:00.600,2018/06/01,12:00:00.600,,4400,,,37.36280,-121.92920,,,0,0,0,0\r\n"
+)
+
+def free_port():
+  sock = socket.socket()
+  sock.bind(('127.0.0.1', 0))
+  port = sock.getsockname()[1]
+  sock.close()
+  return port
+
+class SBS1FeedTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def replay(self, capture, **kwargs):
+    path = os.path.join(self.directory, 'capture.sbs')
+    with open(path, 'wb') as out:
+      out.write(capture)
+    port = free_port()
+    server = threading.Thread(target=serve_replay, args=(path, '127.0.0.1', port), kwargs=kwargs)
+    server.daemon = True
+    server.start()
+    return port, server
+
+  def fetch_all(self, feed, server, timeout=5.0):
+    # until the replay hung up and the feed noticed, connecting as soon as
+    # the replay listens
+    touched = set()
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+      try:
+        updated = feed.fetch()
+      except socket.error:
+        time.sleep(0.01)
+        continue
+      touched.update(state['hex'] for state in updated or ())
+      if not server.is_alive() and feed.sock is None:
+        return touched
+      time.sleep(0.01)
+    self.fail("the replay did not finish")
+
+  def test_replayed_feed(self):
+    port, server = self.replay(CAPTURE)
+    # a small buffer splits most lines across reads
+    feed = SBS1Feed('127.0.0.1', port, bufsize=16)
+    touched = self.fetch_all(feed, server)
+    self.assertEqual(touched, set(['4840d6', 'a1b2c3']))
+    self.assertEqual(feed.messages, 6)
+
+    klm = feed.aircraft['4840d6']
+    self.assertEqual(klm['flight'], 'KLM1023')
+    self.assertEqual(klm['altitude'], 38000)
+    self.assertAlmostEqual(klm['lat'], 52.2572)
+    self.assertAlmostEqual(klm['lon'], 3.91937)
+    self.assertEqual(klm['speed'], 159)
+    self.assertEqual(klm['track'], 182)
+    self.assertEqual(klm['vert_rate'], -832)
+    self.assertEqual(klm['validposition'], 1)
+    self.assertEqual(klm['messages'], 3)
+
+    swa = feed.aircraft['a1b2c3']
+    self.assertEqual(swa['flight'], 'SWA1234')
+    self.assertEqual(swa['altitude'], 4400)
+    self.assertEqual(swa['squawk'], '7000')
+    self.assertAlmostEqual(swa['lon'], -121.9292)
+    self.assertNotIn('speed', swa)
+
+  def test_line_split_across_reads(self):
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    feed = SBS1Feed('127.0.0.1', listener.getsockname()[1])
+    feed.connect()
+    conn, _ = listener.accept()
+    line = CAPTURE.splitlines(True)[1]
+    try:
+      conn.sendall(line[:40])
+      time.sleep(0.05)
+      self.assertIsNone(feed.fetch())
+      self.assertEqual(feed.aircraft, {})
+      conn.sendall(line[40:])
+      time.sleep(0.05)
+      updated = feed.fetch()
+    finally:
+      conn.close()
+      listener.close()
+      feed.close()
+    self.assertEqual([state['hex'] for state in updated], ['4840d6'])
+    self.assertEqual(updated[0]['altitude'], 38000)
+    self.assertAlmostEqual(updated[0]['lat'], 52.2572)
+
+  def test_parse_message_skips_other_lines(self):
+    self.assertIsNone(parse_message(CAPTURE.splitlines()[4]))
+    self.assertIsNone(parse_message("MSG,3,111,11111,,111111"))
+    self.assertEqual(parse_message(CAPTURE.splitlines()[0]), ('4840d6', {'flight': 'KLM1023'}))
+
+class AircraftTableTest(unittest.TestCase):
+
+  def test_prune_drops_quiet_aircraft(self):
+    table = AircraftTable(expire_after=60.0)
+    table.state_for('aaaaaa')
+    table.state_for('bbbbbb')
+    table.last_message['aaaaaa'] -= 61.0
+    self.assertEqual(table.prune(), ['aaaaaa'])
+    self.assertEqual(table.aircraft.keys(), ['bbbbbb'])
+    self.assertEqual(table.last_message.keys(), ['bbbbbb'])
+    self.assertEqual([state['hex'] for state in table.flights], ['bbbbbb'])
+
+  def test_prune_runs_on_its_interval(self):
+    table = AircraftTable(expire_after=60.0, prune_interval=5.0)
+    table.state_for('aaaaaa')
+    table.last_message['aaaaaa'] -= 61.0
+    self.assertEqual(table.prune_due(table.pruned + 1.0), [])
+    self.assertEqual(table.prune_due(table.pruned + 5.0), ['aaaaaa'])
+
+  def test_prune_drops_cpr_halves(self):
+    decoder = BeastDecoder()
+    decoder.state_for('aaaaaa')
+    decoder.cpr['aaaaaa'] = [(1, 2, 0.0, 0), None]
+    decoder.last_message['aaaaaa'] -= decoder.expire_after + 1.0
+    self.assertEqual(decoder.prune(), ['aaaaaa'])
+    self.assertEqual(decoder.cpr, {})
+
+if __name__ == "__main__":
+  unittest.main()
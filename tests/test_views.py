@@ -0,0 +1,134 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# aircraft the streaming feeds name before they place them, through the Flyover and the views
+from __future__ import print_function
+import os
+import unittest
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+import pygame
+
+import controller
+import model
+from all_nearest_planes import Flyover, createDefaultsArgs
+from beast import BeastDecoder
+from enrichment import EnrichmentPool
+from ingest import FlightPoller
+from receivers import Receiver, ReceiverGroup
+from sbs1 import SBS1Feed
+from tests.test_beast import EVEN, IDENT as BEAST_IDENT, ODD, frame
+
+SIZE = (480, 320)
+
+IDENT = "MSG,1,111,11111,4840D6,111111,2018/06/01,12:00:00.000,2018/06/01,12:00:00.000,KLM1023 ,,,,,,,,,,,0"
+POSITION = "MSG,3,111,11111,4840D6,111111,2018/06/01,12:00:00.100,2018/06/01,12:00:00.100,,38000,,,37.36280,-121.92920,,,0,0,0,0"
+VELOCITY = "MSG,4,111,11111,4840D6,111111,2018/06/01,12:00:00.200,2018/06/01,12:00:00.200,,,159,182.9,,,-832,,0,0,0,0"
+# an aircraft with everything, so the views have something to draw
+SWA = [
+  "MSG,1,111,11111,A1B2C3,111111,2018/06/01,12:00:00.300,2018/06/01,12:00:00.300,SWA1234 ,,,,,,,,,,,0",
+  "MSG,3,111,11111,A1B2C3,111111,2018/06/01,12:00:00.400,2018/06/01,12:00:00.400,,4400,,,37.36000,-121.93000,,,0,0,0,0",
+  "MSG,4,111,11111,A1B2C3,111111,2018/06/01,12:00:00.500,2018/06/01,12:00:00.500,,,210,300.0,,,-640,,0,0,0,0",
+]
+
+class QueuedSBS1Feed(SBS1Feed):
+  """An SBS1Feed the test hands lines to instead of a socket."""
+
+  def __init__(self):
+    SBS1Feed.__init__(self, '127.0.0.1')
+    self.queued = []
+
+  def fetch(self):
+    touched = set(icao for icao in map(self.apply, self.queued) if icao is not None)
+    self.queued = []
+    return self.updated(touched)
+
+class QueuedBeastDecoder(BeastDecoder):
+  """A BeastDecoder the test hands frames to instead of a socket."""
+
+  def __init__(self):
+    BeastDecoder.__init__(self)
+    self.queued = []
+
+  def fetch(self):
+    touched = self.feed(b''.join(self.queued))
+    self.queued = []
+    return self.updated(touched)
+
+  def next_delay(self):
+    return 0.25
+
+class UnplacedAircraftTest(unittest.TestCase):
+  """Aircraft only published once they have a position and a track."""
+
+  @classmethod
+  def setUpClass(cls):
+    pygame.display.init()
+    pygame.font.init()
+
+  def setUp(self):
+    self.options = createDefaultsArgs(['--source', 'sbs', '--host', 'feed.test'])
+    self.flyover = Flyover()
+    # without the databases the lookups only fail
+    self.flyover.enrichment = EnrichmentPool(lambda jobs: ({}, ()))
+    self.poller = FlightPoller(self.options, interval=0, flyover=self.flyover)
+
+  def tearDown(self):
+    self.flyover.close()
+
+  def feed_through(self, client):
+    # a group that is never started, the test polls the receiver itself
+    receiver = Receiver(client, self.options.host)
+    self.flyover.receivers[(self.options.source, self.options.host, self.options.feed_port)] = ReceiverGroup([receiver])
+    return receiver
+
+  def render_views(self):
+    screen = pygame.Surface(SIZE, 0, 32)
+    flymodel = model.UIFlyByModel(SIZE[0], SIZE[1], poller=self.poller)
+    flymodel.download_tiles = False
+    flycontroller = controller.UIFlyByController(flymodel)
+    flycontroller.change_to_allPlanesMap()
+    flycontroller.current().render(screen)
+    flycontroller.change_to_planelist()
+    flycontroller.current().render(screen)
+    for flight in flymodel.get_flights().itervalues():
+      flycontroller.change_to_planeMap(None, flight=flight.get('flight'))
+      flycontroller.current().render(screen)
+
+  def test_ident_only_sbs1_aircraft(self):
+    feed = QueuedSBS1Feed()
+    receiver = self.feed_through(feed)
+    feed.queued = SWA + [IDENT]
+    receiver.poll_once()
+    snapshot = self.poller.poll_once()
+    self.assertEqual(feed.aircraft['4840d6']['flight'], 'KLM1023')
+    self.assertEqual(sorted(snapshot.flights), ['a1b2c3'])
+    self.render_views()
+
+    # a position without a track is not enough either
+    feed.queued = [POSITION]
+    receiver.poll_once()
+    self.assertNotIn('4840d6', self.poller.poll_once().flights)
+
+    feed.queued = [VELOCITY]
+    receiver.poll_once()
+    snapshot = self.poller.poll_once()
+    self.assertEqual(snapshot.delta.added, ['4840d6'])
+    self.assertEqual(snapshot.flights['4840d6']['track'], 182)
+    self.render_views()
+
+  def test_ident_only_beast_aircraft(self):
+    decoder = QueuedBeastDecoder()
+    receiver = self.feed_through(decoder)
+    # 4840d6 is named but never placed, 40621d placed but never named
+    decoder.queued = [frame(BEAST_IDENT), frame(EVEN), frame(ODD)]
+    receiver.poll_once()
+    self.assertEqual(decoder.aircraft['4840d6']['flight'], 'KLM1023 ')
+    self.assertIn('lat', decoder.aircraft['40621d'])
+    self.assertEqual(self.poller.poll_once().flights, {})
+    self.assertEqual(len(self.flyover.flights_dict), 0)
+    self.render_views()
+
+if __name__ == "__main__":
+  unittest.main()
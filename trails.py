@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# encoding: utf-8
+
+# bounded position history of each aircraft, for drawing trails
+from __future__ import print_function
+import threading
+import numpy as np
+
+class Trail(object):
+  """Ring buffer of (time, lat, lon) rows for one aircraft.
+
+  Simplified as it is filled: when the newest point still lies within
+  tolerance degrees of the line from the one before it to the new point,
+  it is moved to the new point instead of a new row being used, so a
+  straight leg takes two rows however long it is.
+  """
+
+  def __init__(self, capacity=64, tolerance=0.0005):
+    self.points = np.empty((capacity, 3))
+    self.tolerance = tolerance
+    self.start = 0
+    self.count = 0
+    self.version = 0
+
+  def row(self, i):
+    # i-th oldest point, negative counts from the newest
+    return self.points[(self.start + i % self.count) % len(self.points)]
+
+  def append(self, t, lat, lon):
+    self.version += 1
+    if self.count >= 2:
+      a = self.row(-2)
+      b = self.row(-1)
+      if self.collinear(a[1], a[2], b[1], b[2], lat, lon):
+        b[:] = (t, lat, lon)
+        return
+    if self.count == len(self.points):
+      self.start = (self.start + 1) % len(self.points)
+      self.count -= 1
+    self.count += 1
+    self.row(-1)[:] = (t, lat, lon)
+
+  def collinear(self, lat0, lon0, lat1, lon1, lat2, lon2):
+    # distance of (lat1, lon1) from the line through the other two
+    dlat = lat2 - lat0
+    dlon = lon2 - lon0
+    length = (dlat * dlat + dlon * dlon) ** 0.5
+    if length == 0.0:
+      return True
+    return abs(dlat * (lon1 - lon0) - dlon * (lat1 - lat0)) / length <= self.tolerance
+
+  def array(self):
+    """Copy of the points, oldest first, as an (n, 3) array."""
+    end = self.start + self.count
+    if end <= len(self.points):
+      return self.points[self.start:end].copy()
+    return np.concatenate((self.points[self.start:], self.points[:end - len(self.points)]))
+
+class TrailHistory(object):
+  """The Trail of every tracked aircraft, keyed by ICAO hex. Written by the
+  poll thread and read by the views.
+  """
+
+  def __init__(self, capacity=64, tolerance=0.0005):
+    self.capacity = capacity
+    self.tolerance = tolerance
+    self.trails = {}
+    self.lock = threading.Lock()
+
+  def record(self, key, t, lat, lon):
+    with self.lock:
+      trail = self.trails.get(key)
+      if trail is None:
+        trail = Trail(self.capacity, self.tolerance)
+        self.trails[key] = trail
+      trail.append(t, lat, lon)
+
+  def discard(self, key):
+    with self.lock:
+      self.trails.pop(key, None)
+
+  def version(self, key):
+    """Changes whenever key's trail does, None when it has none."""
+    trail = self.trails.get(key)
+    return trail.version if trail is not None else None
+
+  def points(self, key):
+    """(version, array of time, lat, lon rows) for key, or (None, None)."""
+    with self.lock:
+      trail = self.trails.get(key)
+      if trail is None:
+        return None, None
+      return trail.version, trail.array()
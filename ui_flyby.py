@@ -2,13 +2,22 @@
 #ui_flyby.py
 
 import os
+import sys
+import threading
 import time
+from timeit import default_timer as timer
 
+import numpy as np
 import pygame
 
 import controller
+import metrics
 import model
 import ui
+import views
+from all_nearest_planes import createDefaultsParser, createDefaultsArgs
+from ingest import FlightPoller
+from scheduler import FrameScheduler
 
 import signal
 
@@ -42,6 +51,17 @@ PLANE_TEXT_FG  = BUTTON_FG
 PLANE_TEXT_BG  = MAIN_BG
 PLANE_TEXT_DETAIL_FG = INPUT_FG
 PLANE_TEXT_DETAIL_BG = MAIN_BG
+TRAIL_FG       = ( 90, 150, 255) # Light blue
+
+# Filters the settings view offers, as (button label, filter expression).
+FILTER_PRESETS = [
+	('ALL', None),
+	('LOW', 'altitude < 10000'),
+	('ARRIVING', 'status in landing, descending'),
+	('DEPARTING', 'status in "taking off", climbing'),
+	('FLYBY', 'area = flyby'),
+	('NEARBY', 'distance < 10'),
+]
 
 # Define gradient of colors for the waterfall graph.  Gradient goes from blue to
 # yellow to cyan to red.
@@ -56,8 +76,154 @@ ui.Button.border_color = BUTTON_BORDER
 ui.Button.padding_px   = 2
 ui.Button.border_px    = 2
 
+# Posted by pygame's timer to end a wait for input.
+FRAME_EVENT = pygame.USEREVENT + 1
+
+# Views the headless mode can render, by --view name.
+HEADLESS_VIEWS = ('map', 'list', 'plane')
+
+
+def createParser():
+	"""The receiver options of all_nearest_planes plus the display ones."""
+	parser = createDefaultsParser()
+	parser.add_argument('--fps', type=float, default=20.0,
+		help="Most frames a second to draw while aircraft move or the screen is touched")
+	parser.add_argument('--idle-fps', type=float, default=2.0,
+		help="Frames a second to draw when nothing has changed for --idle-after seconds")
+	parser.add_argument('--idle-after', type=float, default=3.0,
+		help="Seconds without input or moving aircraft before dropping to --idle-fps")
+	parser.add_argument('--refresh-rate', type=float, default=1.0,
+		help="How many times a second the views take new aircraft data, frames in between are dead reckoned")
+	parser.add_argument('--headless', action='store_true',
+		help="Render offscreen with SDL's dummy driver instead of on the PiTFT, then print frame time stats")
+	parser.add_argument('--size', default='480x320',
+		help="Headless screen size, WIDTHxHEIGHT")
+	parser.add_argument('--frames', type=int, default=300,
+		help="How many frames to render headless")
+	parser.add_argument('--view', choices=HEADLESS_VIEWS + ('all',), default='all',
+		help="The view to render headless, 'all' gives each an equal share of the frames")
+	parser.add_argument('--simulate', type=int, default=None,
+		help="Fly this many simulated aircraft from a local fake dump1090 instead of reading --host")
+	parser.add_argument('--dump', default=None,
+		help="Save headless frames as PNGs in this folder")
+	parser.add_argument('--dump-every', type=int, default=1,
+		help="Only save every this many frames with --dump")
+	parser.add_argument('--offline', action='store_true',
+		help="Only draw the map tiles already downloaded")
+	return parser
+
+
+def wait_for_input(seconds):
+	"""Sleep for up to seconds, returning as soon as an event arrives.  The
+	event is put back for the main loop.  pygame 1.9 has no timeout on
+	event.wait(), so a timer event ends the wait instead.
+	"""
+	if seconds <= 0:
+		return
+	pygame.time.set_timer(FRAME_EVENT, max(1, int(seconds * 1000)))
+	event = pygame.event.wait()
+	pygame.time.set_timer(FRAME_EVENT, 0)
+	if event.type != FRAME_EVENT:
+		pygame.event.post(event)
+
+
+def frame_stats(times):
+	# Milliseconds at the usual percentiles, and the frame rate they add up to.
+	times = np.array(times) * 1000.0
+	return '{0:5d} frames  p50 {1:7.2f}ms  p90 {2:7.2f}ms  p99 {3:7.2f}ms  max {4:7.2f}ms  {5:6.1f}fps'.format(
+		len(times), np.percentile(times, 50), np.percentile(times, 90),
+		np.percentile(times, 99), times.max(), 1000.0 / times.mean())
+
+
+def show_view(fscontroller, fsmodel, name):
+	# Switch to a headless view, False when there is nothing to show in it.
+	if name == 'map':
+		fscontroller.change_to_allPlanesMap()
+	elif name == 'list':
+		fscontroller.change_to_planelist()
+	else:
+		flights = [flight for flight in fsmodel.get_flights().itervalues() if flight.get('flight')]
+		if not flights:
+			return False
+		fscontroller.change_to_planeMap(None, flight=flights[0].get('flight'))
+	return True
+
+
+def run_headless(options, wait=10.0):
+	"""Render the views into an offscreen surface for options.frames frames,
+	as fast as they go, and print how long the frames took.  The feed is
+	--host, a --replay log or --simulate aircraft.
+	"""
+	os.environ['SDL_VIDEODRIVER'] = 'dummy'
+	os.environ['SDL_AUDIODRIVER'] = 'dummy'
+	pygame.display.init()
+	pygame.font.init()
+	size = tuple(int(value) for value in options.size.split('x'))
+	# Without a display mode the default surface is 8 bit.
+	screen = pygame.Surface(size, 0, 32)
+	if options.simulate:
+		from fake_dump1090 import FakeDump1090, TrafficSimulator
+		server = FakeDump1090(('127.0.0.1', 0), TrafficSimulator(options.simulate, seed=1))
+		feeder = threading.Thread(target=server.serve_forever, name='FakeDump1090')
+		feeder.daemon = True
+		feeder.start()
+		options.source = 'http'
+		options.host = '127.0.0.1:{0}'.format(server.server_address[1])
+	if options.metrics_port:
+		metrics.serve(options.metrics_port)
+	if options.dump and not os.path.isdir(options.dump):
+		os.makedirs(options.dump)
+
+	poller = FlightPoller(options)
+	poller.start()
+	fsmodel = model.UIFlyByModel(size[0], size[1], poller=poller)
+	fsmodel.download_tiles = not options.offline
+	fscontroller = controller.UIFlyByController(fsmodel)
+	overlay = views.MetricsOverlay(fsmodel) if options.metrics_overlay else None
+	# Give the feed a moment so the first frames are not empty.
+	deadline = time.time() + wait
+	while poller.latest().version == 0 and time.time() < deadline:
+		time.sleep(0.05)
+
+	names = HEADLESS_VIEWS if options.view == 'all' else (options.view,)
+	times = dict((name, []) for name in names)
+	for frame in xrange(options.frames):
+		name = names[frame * len(names) / options.frames]
+		if not times[name] and not show_view(fscontroller, fsmodel, name):
+			print 'no aircraft to show in the {0} view'.format(name)
+			del times[name]
+			names = tuple(n for n in names if n != name)
+			if not names:
+				poller.stop()
+				poller.join(5.0)
+				return 1
+			continue
+		started = timer()
+		fscontroller.current().render(screen)
+		if overlay is not None:
+			overlay.render(screen)
+		elapsed = timer() - started
+		views.frame_seconds.observe(elapsed)
+		times[name].append(elapsed)
+		if options.dump and frame % options.dump_every == 0:
+			pygame.image.save(screen, os.path.join(options.dump, 'frame-{0:05d}.png'.format(frame)))
+	poller.stop()
+	poller.join(5.0)
+
+	print '{0} aircraft at {1}x{2}'.format(len(fsmodel.all_flights), size[0], size[1])
+	for name in names:
+		if times.get(name):
+			print '{0:5s} {1}'.format(name, frame_stats(times[name]))
+	every = [elapsed for name in times for elapsed in times[name]]
+	if every:
+		print '{0:5s} {1}'.format('all', frame_stats(every))
+	return 0
+
 
 if __name__ == '__main__':
+	options = createDefaultsArgs(parser=createParser())
+	if options.headless:
+		sys.exit(run_headless(options))
 	# Initialize pygame and SDL to use the PiTFT display and touchscreen.
 	os.putenv('SDL_VIDEODRIVER', 'fbcon')
 	os.putenv('SDL_FBDEV'      , '/dev/fb1')
@@ -71,28 +237,63 @@ if __name__ == '__main__':
 	screen = pygame.display.set_mode(size, pygame.FULLSCREEN)
 
 
-	fsmodel = model.UIFlyByModel(size[0], size[1])
+	poller = FlightPoller(options)
+	poller.start()
+	fsmodel = model.UIFlyByModel(size[0], size[1], poller=poller)
+	fsmodel.refresh_interval = 1.0 / options.refresh_rate
+	fsmodel.download_tiles = not options.offline
 	fscontroller = controller.UIFlyByController(fsmodel)
+	if options.metrics_port:
+		metrics.serve(options.metrics_port)
+	overlay = views.MetricsOverlay(fsmodel) if options.metrics_overlay else None
+	scheduler = FrameScheduler(options.fps, options.idle_fps, options.idle_after)
 
 
 	# Main loop to process events and render current view.
 	lastclick = 0
 	tracking = 0
-	while True:
-		# Process any events (only mouse events for now).
-		for event in pygame.event.get():
-			if event.type is pygame.MOUSEBUTTONDOWN \
-				and (time.time() - lastclick) >= CLICK_DEBOUNCE:
-				lastclick = time.time()
-				fscontroller.current().click(pygame.mouse.get_pos())
-				tracking = 1
-			elif event.type is pygame.MOUSEBUTTONUP:
-				tracking = 0
-
-			if event.type is pygame.MOUSEMOTION \
-				and tracking == 1 and (time.time() - lastclick) >= CLICK_DEBOUNCE * 0.1:
-				fscontroller.current().mouse_move(pygame.mouse.get_pos())
-
-		# Update and render the current view.
-		fscontroller.current().render(screen)
-		pygame.display.update()
\ No newline at end of file
+	# Stopping the poller closes the receivers and finishes any --record log.
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+	try:
+		while True:
+			# Sleep until the next frame is due or the screen is touched.
+			wait_for_input(scheduler.delay())
+			started = time.time()
+			# Process any events (only mouse events for now).
+			for event in pygame.event.get():
+				if event.type == pygame.QUIT:
+					sys.exit(0)
+				if event.type in (pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP, pygame.MOUSEMOTION):
+					scheduler.activity()
+				if event.type is pygame.MOUSEBUTTONDOWN \
+					and (time.time() - lastclick) >= CLICK_DEBOUNCE:
+					lastclick = time.time()
+					fscontroller.current().click(pygame.mouse.get_pos())
+					tracking = 1
+				elif event.type is pygame.MOUSEBUTTONUP:
+					tracking = 0
+
+				if event.type is pygame.MOUSEMOTION \
+					and tracking == 1 and (time.time() - lastclick) >= CLICK_DEBOUNCE * 0.1:
+					fscontroller.current().mouse_move(pygame.mouse.get_pos())
+
+			# Take new aircraft data at the refresh rate, moving aircraft keep
+			# the frame rate up.
+			if fsmodel.refresh():
+				scheduler.activity()
+			if scheduler.delay() > 0:
+				continue
+			scheduler.frame()
+
+			# Update and render the current view.
+			view = fscontroller.current()
+			with metrics.histogram('flyby_render_seconds', 'Seconds to render each view',
+					view=type(view).__name__).time():
+				view.render(screen)
+			if overlay is not None:
+				overlay.render(screen)
+			pygame.display.update()
+			views.frame_seconds.observe(time.time() - started)
+	finally:
+		poller.stop()
+		poller.join(5.0)
@@ -25,15 +25,23 @@
 # SOFTWARE.
 import math
 import sys
+import time
 
 import numpy as np
 import pygame
 
 import ui_flyby
 import ui
+import metrics
 
 import os.path
 
+tiles_seconds = metrics.stage('tiles')
+tiles_in_memory = metrics.counter('flyby_tiles_total', 'Map tiles drawn, by where they came from', source='memory')
+tiles_from_disk = metrics.counter('flyby_tiles_total', 'Map tiles drawn, by where they came from', source='disk')
+tiles_downloaded = metrics.counter('flyby_tiles_total', 'Map tiles drawn, by where they came from', source='download')
+frame_seconds = metrics.histogram('flyby_frame_seconds', 'Seconds per frame, from handling events to updating the display')
+
 class ViewBase(object):
 	"""Base class for simple UI view which represents all the elements drawn
 	on the screen.  Subclasses should override the render, and click functions.
@@ -213,19 +221,123 @@ class SettingsList(ViewBase):
 		self.model      = model
 		self.controller = controller
 		# Create button labels with current model values.
-
+		current = model.filter_text()
+		self.label = ui.render_text('FILTER: {0}'.format(current or 'none'),
+			size=ui_flyby.SMALL_FONT, fg=ui_flyby.INPUT_FG, bg=ui_flyby.INPUT_BG)
 		# Create buttons.
 		self.buttons = ui.ButtonGrid(model.width, model.height, 4, 5)
+		self.input_rect = (0, 0, model.width, self.buttons.row_size)
+		self.presets = dict(ui_flyby.FILTER_PRESETS)
+		for i, (name, text) in enumerate(ui_flyby.FILTER_PRESETS):
+			bg_color = ui_flyby.ACCEPT_BG if text == current else None
+			self.buttons.add(i % 2 * 2, 1 + i / 2, name, colspan=2,
+				click=self.preset_click, bg_color=bg_color)
 		self.buttons.add(0, 4, 'BACK', click=self.controller.change_to_main)
 
 	def render(self, screen):
 		# Clear view and render buttons.
 		screen.fill(ui_flyby.MAIN_BG)
+		screen.fill(ui_flyby.INPUT_BG, self.input_rect)
+		screen.blit(self.label, ui.align(self.label.get_rect(), self.input_rect,
+			horizontal=ui.ALIGN_LEFT, hpad=10))
 		self.buttons.render(screen)
 
+	def preset_click(self, button):
+		try:
+			self.model.set_filter(self.presets[button.text])
+		except ValueError, e:
+			self.controller.message_dialog(str(e), accept=self.controller.change_to_settings)
+			return
+		self.controller.change_to_main()
+
 	def click(self, location):
 		self.buttons.click(location)
 
+class MetricsOverlay(object):
+	"""Frame and pipeline timings drawn over the current view, turned on
+	with --metrics-overlay.  The text is laid out again once a second at
+	most, so the overlay does not cost the frames it measures.
+	"""
+
+	def __init__(self, model, refresh=1.0):
+		self.model = model
+		self.refresh = refresh
+		self.updated = 0
+		self.labels = []
+
+	def ms(self, name, percentile=50):
+		value = metrics.stage(name).recent_percentile(percentile)
+		return '-' if value is None else '{0:.1f}ms'.format(value * 1000.0)
+
+	def lines(self):
+		frame = frame_seconds.recent_percentile(50)
+		frame_p90 = frame_seconds.recent_percentile(90)
+		stats = self.model.flyover.cache_stats().values()
+		lookups = sum(stat['hits'] + stat['negative_hits'] + stat['misses'] for stat in stats)
+		hits = sum(stat['hits'] + stat['negative_hits'] for stat in stats)
+		return [
+			'frame {0} p90 {1} {2}fps'.format(
+				'-' if frame is None else '{0:.1f}ms'.format(frame * 1000.0),
+				'-' if frame_p90 is None else '{0:.1f}ms'.format(frame_p90 * 1000.0),
+				'-' if not frame else int(1.0 / frame)),
+			'fetch {0} parse {1} poll {2}'.format(self.ms('fetch'), self.ms('parse'), self.ms('poll')),
+			'tiles {0} reckon {1}'.format(self.ms('tiles'), self.ms('reckon')),
+			'aircraft {0}/{1} enrich {2}'.format(len(self.model.all_flights), len(self.model.flyover.flights_dict),
+				'{0:.0%}'.format(float(hits) / lookups) if lookups else '-'),
+			'tiles mem {0} disk {1} dl {2}'.format(tiles_in_memory.value, tiles_from_disk.value, tiles_downloaded.value),
+		]
+
+	def render(self, screen):
+		now = time.time()
+		if now - self.updated >= self.refresh:
+			self.updated = now
+			self.labels = [ui.render_text(line, size=ui_flyby.SMALL_FONT * 2 / 3,
+				fg=ui_flyby.INPUT_FG, bg=ui_flyby.INPUT_BG) for line in self.lines()]
+		y = 0
+		for label in self.labels:
+			screen.blit(label, (0, y))
+			y += label.get_rect().height
+
+class TrailOverlay(object):
+	"""Draws the trails of aircraft from the flyover's TrailHistory.  Each
+	trail is projected to map pixels once per zoom and trail version, so a
+	frame only shifts the cached points onto the screen.
+	"""
+
+	def __init__(self, model, width=2):
+		self.model = model
+		self.width = width
+		self.cache = {}
+
+	def pixels(self, key, zoom):
+		trails = self.model.flyover.trails
+		version = trails.version(key)
+		cached = self.cache.get(key)
+		if cached is not None and cached[0] == version and cached[1] == zoom:
+			return cached[2]
+		version, points = trails.points(key)
+		if points is None:
+			self.cache.pop(key, None)
+			return None
+		pixels = self.model.deg2PixelArray(points[:, 1], points[:, 2], zoom)
+		self.cache[key] = (version, zoom, pixels)
+		return pixels
+
+	def render(self, screen, heads, zoom, origin, center):
+		"""Draw the trails of heads, a dict of hex to the (lat, lon) the
+		aircraft is drawn at, with the map pixel origin at screen point center.
+		"""
+		shift = np.array(center) - np.array(origin)
+		for key, head in heads.iteritems():
+			pixels = self.pixels(key, zoom)
+			if pixels is None:
+				continue
+			points = np.vstack((pixels, self.model.deg2PixelArray(head[0], head[1], zoom))) + shift
+			if len(points) > 1:
+				pygame.draw.lines(screen, ui_flyby.TRAIL_FG, False, points.tolist(), self.width)
+		for key in [key for key in self.cache if key not in heads]:
+			del self.cache[key]
+
 class AllPlanesMap(ViewBase):
 	"""The main view for the map of all Planes flying around."""
 	def __init__(self, model, controller):
@@ -254,6 +366,7 @@ class AllPlanesMap(ViewBase):
 		self.offset = (0,0)
 
 		self.plane_buttons = None
+		self.trails = TrailOverlay(model)
 
 	def view_showing(self):
 		self.reset_map(None)
@@ -267,11 +380,15 @@ class AllPlanesMap(ViewBase):
 		  new_x = center_x - 2 + x
 		  new_y = center_y - 2 + y
 		  fileName = os.path.join(os.path.dirname(__file__),"map_images_{}{}/{}_{}.png".format(zoom, self.model.map_folder,new_x, new_y))
-		  if self.tiles[x][y].get('name') != fileName:
+		  if self.tiles[x][y].get('name') == fileName:
+			  tiles_in_memory.inc()
+		  else:
 			  if os.path.isfile(fileName) and os.stat(fileName).st_size != 0:
+				tiles_from_disk.inc()
 				self.tiles[x][y]['name'] = fileName
 				self.tiles[x][y]['tile'] = pygame.image.load(fileName)
 			  else:
+			  	tiles_downloaded.inc()
 			  	tilePos = self.model.num2deg(new_x, new_y, zoom)
 			  	if tilePos[0] == 0:
 			  		return
@@ -290,11 +407,17 @@ class AllPlanesMap(ViewBase):
 
 	def blitAllPlanes(self, planes, screen, zoom, centroid, offset, drag_offset):
 		self.plane_buttons = ui.FlyingButtons()
+		visible = []
+		positions = self.model.get_positions()
+		heads = dict((plane.get('hex'), positions.get(plane.get('hex'), (plane.get('lat'), plane.get('lon')))[:2]) for plane in planes)
+		origin = self.model.deg2PixelArray(centroid.x, centroid.y, zoom)[0]
+		self.trails.render(screen, heads, zoom, origin, (self.model.width/2 + drag_offset[0], self.model.height/2 + drag_offset[1]))
 
 		for plane in planes:
 			#centroid is at the center of the screen		
 			#what is the planes offset from the center in pixels at this zoom?
-			plane_offset = self.model.planeOffset(plane.get('lat'), plane.get('lon'), centroid, zoom)
+			lat, lon = heads[plane.get('hex')]
+			plane_offset = self.model.planeOffset(lat, lon, centroid, zoom)
 			angledplane = self.rot_center(self.mini_plane, 360-plane.get('track'))
 			plane_pos = ((self.model.width/2) - plane_offset[0] - 32, (self.model.height/2) - plane_offset[1] - 32)
 			screen.blit(angledplane, ( plane_pos[0] + drag_offset[0], plane_pos[1] + drag_offset[1] ))
@@ -303,10 +426,16 @@ class AllPlanesMap(ViewBase):
 
 			button_rect = ( plane_pos[0] - 16 + drag_offset[0], plane_pos[1] - 16 + drag_offset[1] , angledplane.get_rect().width * 2, angledplane.get_rect().width * 2 )
 			self.plane_buttons.add(button_rect, click=self.controller.change_to_planeMap, flight=plane.get('flight'))
+			if 0 <= plane_pos[0] + drag_offset[0] < self.model.width and 0 <= plane_pos[1] + drag_offset[1] < self.model.height:
+				visible.append(plane.get('hex'))
+
+		# Planes on screen get their details looked up first.
+		self.model.set_visible(visible)
 
 			
 	def loadAndBlitMap(self, x,y,offset_x,offset_y, angle, screen, zoom, offset):
-		self.loadTiles(x,y, zoom)
+		with tiles_seconds.time():
+			self.loadTiles(x,y, zoom)
 		self.blitMap(offset_x,offset_y,screen,offset)
 
 	def rot_center(self, image, angle):
@@ -419,6 +548,7 @@ class PlaneMap(ViewBase):
 		self.zoom = self.model.tile_zoom
 		self.w, self.h = 5, 5
 		self.tiles = [[{} for y in xrange(0,self.h)] for x in xrange(0,self.w)]
+		self.trails = TrailOverlay(model)
 		
 	def paintPlaneInfo(self, flight, screen):
 		# render text
@@ -457,11 +587,15 @@ class PlaneMap(ViewBase):
 		  new_y = center_y - 2 + y
 		  #fileName = "map_images{}/{}_{}.png".format(self.model.map_folder,new_x, new_y)
 		  fileName = os.path.join(os.path.dirname(__file__),"map_images_{}{}/{}_{}.png".format(zoom, self.model.map_folder,new_x, new_y))
-		  if self.tiles[x][y].get('name') != fileName:
+		  if self.tiles[x][y].get('name') == fileName:
+			  tiles_in_memory.inc()
+		  else:
 			  if os.path.isfile(fileName) and os.stat(fileName).st_size != 0:
+				tiles_from_disk.inc()
 				self.tiles[x][y]['name'] = fileName
 				self.tiles[x][y]['tile'] = pygame.image.load(fileName)
 			  else:
+			  	tiles_downloaded.inc()
 			  	tilePos = self.model.num2deg(new_x, new_y, zoom)
 			  	if tilePos[0] == 0:
 			  		return
@@ -480,9 +614,15 @@ class PlaneMap(ViewBase):
 		angledplane = self.rot_center(self.the_plane, angle)
 		screen.blit(angledplane, (self.model.width/2-32,self.model.height/2-32))
 
-	def loadAndBlitMap(self, x,y,offset_x,offset_y, angle, screen):
-		self.loadTiles(x,y, self.zoom)
+	def loadAndBlitMap(self, x,y,offset_x,offset_y, angle, screen, trail=None):
+		with tiles_seconds.time():
+			self.loadTiles(x,y, self.zoom)
 		self.blitMap(offset_x,offset_y,screen)
+		if trail is not None:
+			# the plane is drawn at the center of the screen
+			key, lat, lon = trail
+			self.trails.render(screen, {key: (lat, lon)}, self.zoom,
+				self.model.deg2PixelArray(lat, lon, self.zoom)[0], (self.model.width/2, self.model.height/2))
 		self.blitPlane(360 - angle,screen)
 
 	def rot_center(self, image, angle):
@@ -495,12 +635,13 @@ class PlaneMap(ViewBase):
 	    return rot_image
 
 	def renderPlane(self, screen):
-		flight_dict = self.model.get_flights()
-		flight = flight_dict.get(self.plane)
+		flight = self.model.flight_for_callsign(self.plane)
 		if flight is not None:
-			tile = self.model.deg2num(flight.get('lat'), flight.get('lon'), self.zoom)
-			offset = self.model.getOffset(flight.get('lat'), flight.get('lon'), self.zoom)	
-			self.loadAndBlitMap(tile[0], tile[1], offset[0], offset[1], flight.get('track'), screen)
+			self.model.set_visible([flight.get('hex')])
+			lat, lon = self.model.get_positions().get(flight.get('hex'), (flight.get('lat'), flight.get('lon')))[:2]
+			tile = self.model.deg2num(lat, lon, self.zoom)
+			offset = self.model.getOffset(lat, lon, self.zoom)	
+			self.loadAndBlitMap(tile[0], tile[1], offset[0], offset[1], flight.get('track'), screen, (flight.get('hex'), lat, lon))
 			self.paintPlaneInfo(flight, screen)
 		else:
 			#return the main screen
@@ -565,11 +706,20 @@ class PlaneList(ViewBase):
 		# Create buttons.
 		self.buttons = ui.ButtonGrid(model.width, model.height, 6, 5)
 		self.buttons.add(5, 0, 'MAP', click=self.controller.change_to_allPlanesMap)
+		self.buttons.add(5, 2, 'FILTER', click=self.controller.change_to_settings)
 		self.buttons.add(5, 4, 'X', click=self.quit_click,
 			bg_color=ui_flyby.CANCEL_BG)
 		self.plane_buttons = None
+		self.plane_buttons_version = None
 
 	def planeButtons(self, flights, screen):
+		# Only lay the list out again when the flights changed.
+		if self.plane_buttons_version == self.model.flights_version:
+			self.plane_buttons.render(screen)
+			return
+		self.plane_buttons_version = self.model.flights_version
+		# Only the first rows fit on screen, look those up first.
+		self.model.set_visible([flight.get('hex') for flight in flights[:5]])
 		self.plane_buttons = ui.AirplaneButtonGrid(self.model.width, self.model.height, 6, 5)
 		for x in xrange(0,len(flights)):
 			flight = flights[x]